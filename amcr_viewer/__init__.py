@@ -31,6 +31,10 @@ def classFactory(iface):  # pylint: disable=invalid-name
     :param iface: A QGIS interface instance.
     :type iface: QgsInterface
     """
-    #
+    import time
+    started = time.perf_counter()
+
     from .amcr_viewer import AmcrViewer
-    return AmcrViewer(iface)
+    plugin = AmcrViewer(iface)
+    plugin.load_started = started
+    return plugin
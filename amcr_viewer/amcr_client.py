@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from qgis.core import Qgis, QgsMessageLog
+from qgis.PyQt.QtCore import QCoreApplication, QThread
+import requests
+
+from . import amcr_health
+
+LOGIN_URL = "https://digiarchiv.aiscr.cz/api/user/login"
+
+# Requests one client keeps in flight at the same time; further
+# requests of its worker threads wait for a free slot
+MAX_CONCURRENT_REQUESTS = 4
+
+# The server drops sessions idle for about this long; a session idle
+# longer is renewed before the next request instead of failing it
+SESSION_IDLE_S = 30 * 60
+
+# Sessions send JSON by default (login) – form bodies must say so
+FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+
+# HTTP statuses by which a server refuses a POST body for the endpoint
+# itself, whatever the query
+POST_REFUSED_STATUSES = (405, 414, 501)
+
+
+class PostRefused(ValueError):
+    """
+    Raised by AmcrClient.post_form_json when the server refuses the
+    POST method for the URL (see POST_REFUSED_STATUSES). Subclasses
+    ValueError like the invalid-JSON error the call raises otherwise.
+    """
+
+
+def _log(msg: str, level=Qgis.MessageLevel.Info):
+    """
+    Shortcut: writes a message to the QGIS log
+    (Messages panel → AMČR login tab).
+    """
+    QgsMessageLog.logMessage(msg, "AMČR login", level)
+
+
+def _in_main_thread() -> bool:
+    app = QCoreApplication.instance()
+    return app is None or QThread.currentThread() == app.thread()
+
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    session.headers.update({
+        "Accept": "application/json, text/plain, */*",
+        "Content-Type": "application/json",
+        "User-Agent": "QGIS-Plugin/1.0 (AISCR Data Fetcher)"
+    })
+    return session
+
+
+def _is_auth_error(resp: requests.Response, body) -> bool:
+    """The API returns auth errors with status 200 –
+    the body must be checked."""
+    if resp.status_code == 401:
+        return True
+    if not isinstance(body, dict):
+        return False
+    err = str(body.get("error", "")).lower()
+    return (
+        "unauthorized" in err
+        or "not logged" in err
+        or "session" in err
+    )
+
+
+def _parse(resp):
+    try:
+        return resp.json()
+    except ValueError:
+        return None
+
+
+class AmcrClient:
+    """
+    One user of the AMČR API: its login session, login state and limit
+    of concurrent requests.
+
+    Clients are independent of each other – an anonymous and an
+    authenticated client, or one client per background task, can run
+    side by side. A client is thread-safe: its requests may come from
+    several worker threads, which then share one login.
+
+    The plugin's own downloads use amcr_session.DEFAULT_CLIENT, which
+    reads the credentials stored in the Authentication Manager; the
+    download stages in amcr_tools take another client via client=.
+    Translations and codelists are read-only and shared by all clients.
+
+    What the client has learnt about the search endpoint (see learn)
+    is kept per client, too.
+    """
+
+    def __init__(self, credentials=None, stored_credentials=False,
+                 max_requests=MAX_CONCURRENT_REQUESTS):
+        # Session with authentication cookie after login;
+        # None = not logged in (anonymous access)
+        self.session: requests.Session | None = None
+        # Reason of the last failed login: 'auth' (wrong credentials),
+        # 'network' (server unreachable / invalid response) or None
+        self.last_login_error: str | None = None
+        # Time (epoch seconds) the current session was created and
+        # last used by a request
+        self.session_created = 0.0
+        self.session_used = 0.0
+
+        # (username, password); None = anonymous, unless
+        # stored_credentials reads them from the Authentication Manager
+        self._credentials = credentials
+        self._stored_credentials = stored_credentials
+
+        # Whether the search endpoint supports cursor paging
+        # (cursorMark); None until a response tells
+        self.cursor_paging: bool | None = None
+        # Whether it accepts queries as POST form bodies; None until
+        # a response tells
+        self.post_queries: bool | None = None
+
+        # Held for the whole login – concurrent requests that hit an
+        # expired session wait here for one shared re-authentication
+        self._login_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_requests)
+        self._learn_lock = threading.Lock()
+
+    def login(self, username: str, password: str):
+        """
+        Logs in to the Digiarchiv API using a username and password.
+        Returns a requests.Session with the session cookie set, or None
+        on error.
+        """
+        self.last_login_error = None
+
+        _log(f"Přihlašuji uživatele: '{username}'")
+
+        if not username or not password:
+            _log(
+                "CHYBA: username nebo heslo je prázdné.",
+                Qgis.MessageLevel.Critical
+            )
+            self.last_login_error = 'auth'
+            return None
+
+        session = _new_session()
+
+        try:
+            _log(f"Odesílám POST na {LOGIN_URL} ...")
+            response = amcr_health.call(
+                session.post,
+                LOGIN_URL,
+                json={"user": username, "pwd": password},
+                timeout=10
+            )
+            _log(f"HTTP status: {response.status_code}")
+            response.raise_for_status()
+
+            # The API returns errors with status code 200 –
+            # the response body must be checked
+            body = response.json()
+            if "error" in body:
+                _log(
+                    f"CHYBA přihlášení (API): {body['error']}",
+                    Qgis.MessageLevel.Critical
+                )
+                self.last_login_error = 'auth'
+                return None
+
+            _log("Přihlášení proběhlo úspěšně.")
+            self.session = session
+            self.session_created = self.session_used = time.time()
+            self._credentials = (username, password)
+            return session
+
+        except requests.exceptions.HTTPError as e:
+            status = (
+                e.response.status_code if e.response is not None else None
+            )
+            _log(f"CHYBA HTTP {status if status else '?'}: "
+                 f"{e.response.text[:300] if e.response is not None else 'žádná odpověď'}",
+                 Qgis.MessageLevel.Critical)
+            self.last_login_error = (
+                'auth' if status in (401, 403) else 'network'
+            )
+            return None
+        except requests.exceptions.RequestException as e:
+            _log(f"CHYBA sítě: {e}", Qgis.MessageLevel.Critical)
+            self.last_login_error = 'network'
+            return None
+        except ValueError:
+            # Server returned non-JSON (e.g. an HTML error page behind
+            # a proxy)
+            _log("CHYBA: server nevrátil platný JSON: "
+                 f"{response.text[:300]}",
+                 Qgis.MessageLevel.Critical)
+            self.last_login_error = 'network'
+            return None
+
+    def credentials(self) -> tuple[str, str]:
+        """
+        Returns the client's credentials. Stored credentials are read
+        from the Authentication Manager on first use in the main thread;
+        background threads only see credentials that were read earlier
+        (the manager may prompt for the master password).
+        """
+        if (
+            self._credentials is None
+            and self._stored_credentials
+            and _in_main_thread()
+        ):
+            from .amcr_dialog import LoginDialog
+            self._credentials = LoginDialog.get_credentials()
+        return self._credentials or ("", "")
+
+    def reauthenticate(self, stale=None) -> requests.Session | None:
+        """
+        Replaces the given (expired) session with a new login and
+        returns it.
+
+        Only one login runs at a time. Callers that waited for a login
+        started by someone else get its session instead of logging in
+        again. Safe to call from a background thread.
+        """
+        username, password = self.credentials()
+        with self._login_lock:
+            if self.session is not None and self.session is not stale:
+                return self.session
+            if not (username and password):
+                return None
+            if stale is not None:
+                _log("Obnovuji přihlášení...")
+            session = self.login(username, password)
+            # A still valid session survives a refresh that failed
+            # only because the server was unreachable
+            if session is None and self.last_login_error != 'network':
+                self.session = None
+            return session
+
+    def get_session(self) -> requests.Session | None:
+        """
+        Returns the active session. If none exists, or the server has
+        most likely dropped it for inactivity (see SESSION_IDLE_S), logs
+        in with the client's credentials – or waits for a login that is
+        already running. Returns None for anonymous access.
+        """
+        session = self.session
+        if session is None:
+            return self.reauthenticate()
+        if time.time() - self.session_used > SESSION_IDLE_S:
+            return self.reauthenticate(stale=session)
+        return session
+
+    def adopt_session(self, session, created) -> bool:
+        """
+        Uses a session restored from elsewhere (a saved cookie) unless
+        the client has logged in meanwhile.
+        """
+        with self._login_lock:
+            if self.session is not None:
+                return False
+            self.session = session
+            self.session_created = self.session_used = created
+            return True
+
+    def logout(self):
+        """Drops the session and cached credentials."""
+        with self._login_lock:
+            self.session = None
+            self._credentials = None
+
+    def learn(self, capability, supported: bool):
+        """
+        Records whether the endpoint supports a capability (an attribute
+        such as cursor_paging). The first answer wins, so concurrent
+        requests of the client cannot flip it back and forth. Returns
+        True if this call recorded the answer.
+        """
+        with self._learn_lock:
+            if getattr(self, capability) is not None:
+                return False
+            setattr(self, capability, supported)
+            return True
+
+    def get_json(self, url, params, timeout=30) -> dict:
+        """
+        Performs a GET request and returns the parsed JSON body.
+        If the API signals an expired login, re-authenticates once and
+        retries. The body is parsed exactly once (the auth check reuses
+        it). Raises ValueError if the server does not return valid JSON.
+        """
+        return self._request_json("get", url, timeout, params=params)
+
+    def post_form_json(self, url, data, timeout=30) -> dict:
+        """
+        Like get_json, but sends the parameters as a form-encoded POST
+        body, which has no length limit. Raises PostRefused if the
+        server does not accept POST for the URL.
+        """
+        return self._request_json(
+            "post", url, timeout, refused=POST_REFUSED_STATUSES,
+            data=data, headers=FORM_HEADERS
+        )
+
+    def _request_json(self, method, url, timeout, refused=(),
+                      **kwargs) -> dict:
+        with self._slots:
+            session = self.get_session()
+            resp = amcr_health.call(
+                getattr(session or requests, method), url,
+                timeout=timeout, **kwargs
+            )
+            body = _parse(resp)
+
+            if _is_auth_error(resp, body):
+                _log("Session vypršela během stahování – obnovuji "
+                     "přihlášení...", Qgis.MessageLevel.Warning)
+                # Requests failing at the same time share a single
+                # new login
+                session = self.reauthenticate(stale=session)
+                if session:
+                    resp = amcr_health.call(
+                        getattr(session, method), url,
+                        timeout=timeout, **kwargs
+                    )
+                    body = _parse(resp)
+                else:
+                    _log("Opakované přihlášení selhalo – pokračuji "
+                         "anonymně.", Qgis.MessageLevel.Warning)
+            if session is not None:
+                self.session_used = time.time()
+
+        if resp.status_code in refused:
+            raise PostRefused(
+                f"API odmítlo metodu {method.upper()} "
+                f"(HTTP {resp.status_code})"
+            )
+        if body is None:
+            raise ValueError(
+                f"API nevrátilo platný JSON (HTTP {resp.status_code})"
+            )
+        return body
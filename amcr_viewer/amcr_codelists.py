@@ -1,16 +1,22 @@
 ﻿# -*- coding: utf-8 -*-
 import os
 import csv
-import requests
+import sqlite3
 import xml.etree.ElementTree as ET  # nosec
 import time
+from collections.abc import Mapping
 from qgis.core import QgsMessageLog, Qgis
 
+from .amcr_search import SearchIndex
+
 # Define paths for the plugin and its codelists directory
 PLUGIN_DIR = os.path.dirname(__file__)
 CODELISTS_DIR = os.path.join(PLUGIN_DIR, 'codelists')
 BASE_URL = "https://api.aiscr.cz/2.2/oai"
 OUTPUT_FILE = os.path.join(CODELISTS_DIR, 'heslar.csv')
+# Compiled, indexed copy of heslar.csv; rebuilt whenever the CSV changes
+STORE_FILE = os.path.join(CODELISTS_DIR, 'heslar.sqlite')
+STORE_VERSION = 2
 
 slovnicek = {
     'obdobi': 'heslo:obdobi',
@@ -29,6 +35,10 @@ slovnicek = {
     'pristupnost': 'heslo:pristupnost'
 }
 
+# Administrative units, from the top. Lower units reference their parent
+# through dc:relation in the OAI-PMH records.
+HIERARCHIE = ['kraj', 'okres', 'katastr']
+
 NS = {
     'oai': 'http://www.openarchives.org/OAI/2.0/',
     'dc': 'http://purl.org/dc/elements/1.1/',
@@ -42,68 +52,474 @@ def ensure_codelists_dir():
         os.makedirs(CODELISTS_DIR)
 
 
-def parse_codelist_file(filename, target_dict=None):
+def _csv_signature():
+    """
+    Returns a string identifying the current version of heslar.csv
+    (size and modification time), or None if the file is missing.
+    """
+    try:
+        st = os.stat(OUTPUT_FILE)
+    except OSError:
+        return None
+    return f"{STORE_VERSION}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def _read_csv_rows():
     """
-    Reads a CSV codelist file and populates
-    the target dictionary grouped by categories.
+    Yields (label, code, category, identifier, parents) tuples from
+    heslar.csv. The last two columns are optional – older files
+    without them yield empty strings.
     """
-    if target_dict is None:
-        target_dict = {}
+    with open(OUTPUT_FILE, 'r', encoding='utf-8-sig') as f:
+        reader = csv.reader(f, delimiter=';')
+
+        # Skip the CSV header row
+        next(reader, None)
 
-    path = os.path.join(CODELISTS_DIR, filename)
+        for row in reader:
+            if len(row) >= 3:
+                code = row[1].strip()
+                extra = [x.strip() for x in row[3:5]]
+                extra += [''] * (2 - len(extra))
+                yield (
+                    row[0].strip(), code if code else None,
+                    row[2].strip(), *extra
+                )
 
-    # Return early if the file doesn't exist to avoid missing file errors
+
+def _ref_id(value):
+    """Reduces a reference (plain identifier or full URI) to the identifier."""
+    return value.strip().rstrip('/').rsplit('/', 1)[-1]
+
+
+def _write_hierarchy(conn):
+    """
+    Precomputes the kraj → okres → katastr links. Parent references are
+    resolved from raw OAI identifiers to codelist codes; a katastr that
+    only references its okres inherits the kraj of that okres.
+    """
+    units = {}    # raw identifier → (category, code)
+    parents = []  # (category, code, parent identifiers)
+    for cat, code, ident, nadrazeny in conn.execute(
+        "SELECT kategorie, kod, ident, nadrazeny FROM heslar "
+        "WHERE kategorie IN ('kraj', 'okres', 'katastr')"
+    ):
+        if ident:
+            units[ident] = (cat, code)
+        if nadrazeny:
+            parents.append(
+                (cat, code, [_ref_id(ref) for ref in nadrazeny.split('|')])
+            )
+
+    links = {}  # (category, code) → {'kraj': code, 'okres': code}
+    for cat, code, refs in parents:
+        link = links.setdefault((cat, code), {})
+        for ref in refs:
+            parent = units.get(ref)
+            # Only links pointing upwards in the hierarchy are kept
+            if (
+                parent
+                and HIERARCHIE.index(parent[0]) < HIERARCHIE.index(cat)
+            ):
+                link[parent[0]] = parent[1]
+
+    for (cat, code), link in links.items():
+        if 'kraj' not in link and 'okres' in link:
+            okres = links.get(('okres', link['okres']), {})
+            if 'kraj' in okres:
+                link['kraj'] = okres['kraj']
+
+    conn.executemany(
+        "INSERT INTO uzemi (kategorie, kod, kraj, okres) VALUES (?, ?, ?, ?)",
+        (
+            (cat, code, link.get('kraj'), link.get('okres'))
+            for (cat, code), link in links.items() if link
+        )
+    )
+
+
+def _write_store(conn, signature):
+    """Creates the schema and fills the store from heslar.csv."""
+    conn.executescript("""
+        DROP TABLE IF EXISTS meta;
+        DROP TABLE IF EXISTS heslar;
+        DROP TABLE IF EXISTS uzemi;
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE heslar (
+            kategorie TEXT NOT NULL,
+            nazev TEXT NOT NULL,
+            kod TEXT,
+            ident TEXT,
+            nadrazeny TEXT
+        );
+        CREATE TABLE uzemi (
+            kategorie TEXT NOT NULL,
+            kod TEXT NOT NULL,
+            kraj TEXT,
+            okres TEXT
+        );
+    """)
+    conn.executemany(
+        "INSERT INTO heslar (nazev, kod, kategorie, ident, nadrazeny) "
+        "VALUES (?, ?, ?, ?, ?)",
+        _read_csv_rows()
+    )
+    _write_hierarchy(conn)
+    # Per-category indexes for both lookup directions
+    conn.execute(
+        "CREATE INDEX heslar_nazev ON heslar (kategorie, nazev)"
+    )
+    conn.execute("CREATE INDEX heslar_kod ON heslar (kategorie, kod)")
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('signature', ?)",
+        (signature,)
+    )
+    conn.commit()
+
+
+def _stored_signature(path):
+    """Returns the CSV signature the store at path was compiled from."""
     if not os.path.exists(path):
-        return target_dict
+        return None
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key = 'signature'"
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def compile_store(force=False):
+    """
+    Compiles heslar.csv into the indexed SQLite store.
+
+    The store is rebuilt only if the CSV changed since the last
+    compilation (or when forced). It is written to a temporary file first
+    and then swapped in, so readers never see a half-written store.
+    Returns True if the on-disk store is up to date.
+    """
+    global _MEMORY_STORE
+
+    signature = _csv_signature()
+    if signature is None:
+        return False
+    if not force and _stored_signature(STORE_FILE) == signature:
+        return True
+
+    tmp_file = STORE_FILE + '.part'
+    try:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        conn = sqlite3.connect(tmp_file)
+        try:
+            _write_store(conn, signature)
+        finally:
+            conn.close()
+        os.replace(tmp_file, STORE_FILE)
+        _MEMORY_STORE = None
+        return True
+
+    except (OSError, sqlite3.Error) as e:
+        # Read-only plugin directory etc. – keep working from memory
+        QgsMessageLog.logMessage(
+            f"AMČR: hesláře nelze uložit do {STORE_FILE} ({e}), "
+            "používám dočasnou kopii v paměti.",
+            "AMČR", Qgis.Warning)
+        if os.path.exists(tmp_file):
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        _write_store(conn, signature)
+        _MEMORY_STORE = conn
+        return False
+
+
+def _query(sql, params=()):
+    """Runs a read query against the codelist store."""
+    global _STORE_CHECKED
+
+    if not _STORE_CHECKED:
+        ensure_codelists_dir()
+        try:
+            compile_store()
+        except Exception as e:
+            QgsMessageLog.logMessage(
+                f"AMČR Codelist Read Error for heslar.csv: {e}",
+                "AMČR", Qgis.Critical)
+        _STORE_CHECKED = True
+
+    if _MEMORY_STORE is not None:
+        return _MEMORY_STORE.execute(sql, params).fetchall()
+    if not os.path.exists(STORE_FILE):
+        return []
 
     try:
-        # Open the file using standard UTF-8 encoding
-        with open(path, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f, delimiter=';')
-
-            # Skip the CSV header row
-            next(reader, None)
-
-            # Iterate through rows and extract label, code, and category
-            for row in reader:
-                if len(row) >= 3:
-                    label = row[0].strip()
-                    code = row[1].strip()
-                    cat = row[2].strip()
-                    clean = code if code else None
-
-                    # Initialize a new dictionary for a category if encountered
-                    # for the first time
-                    if cat not in target_dict:
-                        target_dict[cat] = {}
-
-                    # Assign the extracted code to the corresponding label
-                    # within the category
-                    target_dict[cat][label] = clean
-
-    except Exception as e:
+        conn = sqlite3.connect(STORE_FILE)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
         QgsMessageLog.logMessage(
-            f"AMČR Codelist Read Error for {filename}: {e}",
+            f"AMČR Codelist Read Error for {STORE_FILE}: {e}",
             "AMČR", Qgis.Critical)
+        return []
 
-    return target_dict
 
+class Codelist(Mapping):
+    """
+    Read-only label → code mapping of one codelist category.
+
+    Rows are loaded from the store on first access, so categories that are
+    never shown in a dialog cost nothing. The reverse (code → label) index
+    and the search index are built only when they are first asked for.
+    """
+
+    def __init__(self, category):
+        self.category = category
+        self._data = None
+        self._labels = None
+        self._search_index = None
+
+    def _load(self):
+        if self._data is None:
+            # Ordered by rowid – with duplicate labels the last one wins,
+            # exactly like the former CSV → dict parsing
+            self._data = dict(_query(
+                "SELECT nazev, kod FROM heslar "
+                "WHERE kategorie = ? ORDER BY rowid",
+                (self.category,)
+            ))
+        return self._data
+
+    def __getitem__(self, label):
+        return self._load()[label]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def code(self, label, default=None):
+        """Returns the code for a label."""
+        return self._load().get(label, default)
+
+    def label(self, code, default=None):
+        """Returns the label for a code."""
+        if self._labels is None:
+            self._labels = {
+                c: lbl for lbl, c in self._load().items() if c is not None
+            }
+        return self._labels.get(code, default)
+
+    def search_index(self):
+        """
+        Returns the search index over the alphabetically sorted labels.
+        It is built once and reused by every picker of this category.
+        """
+        if self._search_index is None:
+            self._search_index = SearchIndex(sorted(self._load()))
+        return self._search_index
+
+    def invalidate(self):
+        """Drops the loaded rows; they are re-read on next access."""
+        self._data = None
+        self._labels = None
+        self._search_index = None
+
+
+class AdminHierarchy:
+    """
+    Parent → children index of the administrative units, loaded from
+    the store on first use. Used to narrow the okres and katastr pickers
+    to the selected kraje (and okresy).
+    """
+
+    def __init__(self):
+        self._children = None
+        self._parents = None
+
+    def _load(self):
+        if self._children is None:
+            children = {}
+            parents = {}
+            for cat, code, kraj, okres in _query(
+                "SELECT kategorie, kod, kraj, okres FROM uzemi"
+            ):
+                parents[(cat, code)] = (kraj, okres)
+                if kraj:
+                    children.setdefault(
+                        ('kraj', cat), {}
+                    ).setdefault(kraj, set()).add(code)
+                if okres:
+                    children.setdefault(
+                        ('okres', cat), {}
+                    ).setdefault(okres, set()).add(code)
+            self._children = children
+            self._parents = parents
+        return self._children
+
+    def allowed(self, category, kraje=None, okresy=None):
+        """
+        Returns the set of codes of the category lying within the given
+        kraje and okresy, or None if the category is not restricted
+        (nothing selected above it, or no hierarchy data available).
+        """
+        children = self._load()
+        result = None
+        for parent_cat, selected in (('kraj', kraje), ('okres', okresy)):
+            index = children.get((parent_cat, category))
+            if not selected or not index:
+                continue
+            codes = set()
+            for code in selected:
+                codes.update(index.get(code, ()))
+            result = codes if result is None else result & codes
+        return result
+
+    def available(self) -> bool:
+        """
+        False if the stored codelists carry no hierarchy (a codelist
+        file from before the identifier columns; fixed by an update).
+        """
+        return bool(self._load())
+
+    def parents(self, category, code):
+        """
+        Returns the (kraj, okres) codes of a unit; unknown parents
+        are None.
+        """
+        self._load()
+        return self._parents.get((category, code), (None, None))
+
+    def invalidate(self):
+        self._children = None
+        self._parents = None
+
+
+def code_labels():
+    """
+    Returns a code → label dictionary over all categories. Categories
+    whose code is the label itself (okres, katastr) are left out.
+    """
+    return dict(_query(
+        "SELECT kod, nazev FROM heslar "
+        "WHERE kod IS NOT NULL AND kod != nazev ORDER BY rowid"
+    ))
 
-def load_all_data():
-    """Loads the codelist during plugin startup."""
-    ensure_codelists_dir()
-    categorized_data = {k: {} for k in slovnicek.keys()}
-    parse_codelist_file('heslar.csv', categorized_data)
-    return categorized_data
 
+def lookup_code(category, label, default=None):
+    """Translates a codelist label to its code."""
+    return CODELISTS[category].code(label, default)
+
+
+def lookup_label(category, code, default=None):
+    """Translates a codelist code to its label."""
+    return CODELISTS[category].label(code, default)
+
+
+def _parse_record(rec, internal_name):
+    """
+    Converts a single parsed OAI-PMH <record> element into a codelist row.
+    Returns None for records that should be skipped.
+    """
+    metadata = rec.find('.//oai_dc:dc', NS)
+    if metadata is None:
+        return None
+
+    # Code (identifier)
+    identifier_el = metadata.find('dc:identifier', NS)
+    kod = identifier_el.text if identifier_el is not None else ""
+    identifier = kod
+
+    # Parent administrative units (okres → kraj, katastr → okres/kraj);
+    # relations may be full URIs, only the identifier part is kept
+    nadrazeny = ""
+    if internal_name in HIERARCHIE:
+        nadrazeny = "|".join(
+            _ref_id(el.text)
+            for el in metadata.findall('dc:relation', NS)
+            if el.text and el.text.strip()
+        )
+
+    # Title – filter out system labels "AMČR - ..."
+    titles = metadata.findall('dc:title', NS)
+    nazev = ""
+    for t in titles:
+        if (
+            t.text
+            and not t.text.startswith("AMČR -")
+            and not t.text.startswith(" AMČR -")
+        ):
+            nazev = t.text
+            break
+    # If no title passed the filter, fall back
+    # to the first available one
+    if not nazev and titles:
+        nazev = titles[0].text
+
+    specialni_pripady = ['okres', 'katastr']
+
+    if internal_name in specialni_pripady:
+        kod = nazev
+
+    if internal_name == 'pristupnost':
+        kod = next(
+            (
+                t.text for t in titles
+                if t.text
+                and len(t.text) == 1
+                and t.text.isalpha()
+            ),
+            None
+        )
+        # Skip records without a valid one-letter code –
+        # a None code would end up in the CSV and later
+        # in the API filter as the string "None"
+        if not kod:
+            return None
+
+    return {
+        'Název': nazev,
+        'Kód': kod,
+        'Kategorie': internal_name,
+        'Identifikátor': identifier,
+        'Nadřazený': nadrazeny
+    }
+
+
+def fetch_set(internal_name, api_set, write_row, task=None):
+    """
+    Downloads one OAI-PMH set and passes every parsed record to write_row()
+    as soon as it is complete.
+
+    The response is parsed incrementally while it is being received, and
+    each <record> element is discarded right after it has been written,
+    so memory use does not grow with the size of the set.
+    Returns the number of written records, or None if the task was cancelled.
+    Raises amcr_health.ServiceUnavailable when the API is known to be down.
+    """
+    # Imported lazily – the HTTP stack is only needed for an update
+    import requests
+    from . import amcr_health
 
-def fetch_set(internal_name, api_set, task=None):
-    dataset = []
     params = {
         "verb": "ListRecords",
         "metadataPrefix": "oai_dc",
         "set": api_set
     }
+    record_tag = f"{{{NS['oai']}}}record"
+    token_tag = f"{{{NS['oai']}}}resumptionToken"
+    list_tag = f"{{{NS['oai']}}}ListRecords"
+    written = 0
 
     while True:
         # Check for cancellation at each iteration
@@ -111,171 +527,158 @@ def fetch_set(internal_name, api_set, task=None):
             return None
 
         try:
-            response = requests.get(BASE_URL, params=params, timeout=30)
-            response.raise_for_status()
-            root = ET.fromstring(response.content)  # nosec
-
-            records = root.findall('.//oai:record', NS)
-            for rec in records:
-                metadata = rec.find('.//oai_dc:dc', NS)
-                if metadata is not None:
-                    # Code (identifier)
-                    identifier_el = metadata.find('dc:identifier', NS)
-                    kod = (
-                        identifier_el.text
-                        if identifier_el is not None
-                        else ""
-                    )
-
-                    # Title – filter out system labels "AMČR - ..."
-                    titles = metadata.findall('dc:title', NS)
-                    nazev = ""
-                    for t in titles:
-                        if (
-                            t.text
-                            and not t.text.startswith("AMČR -")
-                            and not t.text.startswith(" AMČR -")
-                        ):
-                            nazev = t.text
-                            break
-                    # If no title passed the filter, fall back
-                    # to the first available one
-                    if not nazev and titles:
-                        nazev = titles[0].text
-
-                    specialni_pripady = ['okres', 'katastr']
-
-                    if internal_name in specialni_pripady:
-                        kod = nazev
-
-                    if internal_name == 'pristupnost':
-                        kod = next(
-                            (
-                                t.text for t in titles
-                                if t.text
-                                and len(t.text) == 1
-                                and t.text.isalpha()
-                            ),
-                            None
-                        )
-                        # Skip records without a valid one-letter code –
-                        # a None code would end up in the CSV and later
-                        # in the API filter as the string "None"
-                        if not kod:
+            token = None
+            parser = ET.XMLPullParser(events=('start', 'end'))  # nosec
+            container = None
+
+            with amcr_health.call(
+                requests.get, BASE_URL, params=params, timeout=30,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+
+                for chunk in response.iter_content(chunk_size=65536):
+                    if task and task.isCanceled():
+                        return None
+
+                    parser.feed(chunk)
+                    for event, el in parser.read_events():
+                        if event == 'start':
+                            if el.tag == list_tag:
+                                container = el
                             continue
 
-                    dataset.append({
-                        'Název': nazev,
-                        'Kód': kod,
-                        'Kategorie': internal_name
-                    })
+                        if el.tag == record_tag:
+                            row = _parse_record(el, internal_name)
+                            if row is not None:
+                                write_row(row)
+                                written += 1
+                            # Drop the finished record from the tree
+                            if container is not None:
+                                container.remove(el)
+                            else:
+                                el.clear()
+                        elif el.tag == token_tag:
+                            token = el.text
+
+            parser.close()
 
             # Pagination
-            token = root.find('.//oai:resumptionToken', NS)
-            if token is not None and token.text:
+            if token:
                 params = {
                     "verb": "ListRecords",
-                    "resumptionToken": token.text
+                    "resumptionToken": token
                 }
                 time.sleep(0.5)
             else:
                 break
 
+        except amcr_health.ServiceUnavailable:
+            # Abort the whole update – the remaining sets would come
+            # back empty and replace the codelists stored on disk
+            raise
         except Exception as e:
             QgsMessageLog.logMessage(
                 f"Chyba u setu {api_set}: {e}",
                 "AMČR", Qgis.Warning)
             break
 
-    return dataset
+    return written
 
 
 def download_heslare(task=None):
-    """Fetches the codelists from the AMČR API and saves it to a CSV file."""
+    """
+    Fetches the codelists from the AMČR API and streams them into
+    the CSV file.
+
+    Records are written while they are being parsed into a temporary file
+    that replaces heslar.csv only after a complete run, so a cancelled
+    update never leaves a truncated codelist behind.
+    """
     ensure_codelists_dir()
-    all_data = []
     total_sets = len(slovnicek)
+    tmp_file = OUTPUT_FILE + '.part'
 
-    for index, (interni, api_nazev) in enumerate(slovnicek.items()):
-        # Check if the user cancelled the task via the QGIS taskbar
-        if task and task.isCanceled():
-            return False
+    try:
+        with open(tmp_file, 'w', newline='', encoding='utf-8-sig') as f:
+            fieldnames = [
+                'Název', 'Kód', 'Kategorie', 'Identifikátor', 'Nadřazený'
+            ]
+            writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=';')
+            writer.writeheader()
 
-        QgsMessageLog.logMessage(
-            f"Zpracovávám kategorii: {interni}...",
-            "AMČR", Qgis.Info)
+            for index, (interni, api_nazev) in enumerate(slovnicek.items()):
+                # Check if the user cancelled the task
+                # via the QGIS taskbar
+                if task and task.isCanceled():
+                    return False
 
-        # Pass the task correctly to the updated fetch function
-        data = fetch_set(interni, api_nazev, task=task)
+                QgsMessageLog.logMessage(
+                    f"Zpracovávám kategorii: {interni}...",
+                    "AMČR", Qgis.Info)
 
-        if data is None:
-            return False  # Cancelled mid-download
+                count = fetch_set(
+                    interni, api_nazev, writer.writerow, task=task
+                )
 
-        all_data.extend(data)
+                if count is None:
+                    return False  # Cancelled mid-download
 
-        # Report progress (0-100)
-        if task:
-            progress = (index + 1) / total_sets * 100
-            task.setProgress(progress)
+                # Report progress (0-100)
+                if task:
+                    progress = (index + 1) / total_sets * 100
+                    task.setProgress(progress)
 
-    # Save to CSV
-    with open(OUTPUT_FILE, 'w', newline='', encoding='utf-8-sig') as f:
-        fieldnames = ['Název', 'Kód', 'Kategorie']
-        writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=';')
-        writer.writeheader()
-        writer.writerows(all_data)
+        os.replace(tmp_file, OUTPUT_FILE)
 
-    return True
+        # Compile the store here in the background thread, so the refresh
+        # in the main thread only has to invalidate the loaded categories
+        compile_store()
+        return True
+
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
 
 
 def refresh_globals():
-    """Reloads data from files into the global variables."""
-    data = load_all_data()
-
-    OBDOBI.clear()
-    OBDOBI.update(data.get('obdobi', {}))
-    TYP_AKCE.clear()
-    TYP_AKCE.update(data.get('typ_akce', {}))
-    AREAL.clear()
-    AREAL.update(data.get('areal', {}))
-    KRAJE.clear()
-    KRAJE.update(data.get('kraj', {}))
-    ORGANIZACE.clear()
-    ORGANIZACE.update(data.get('organizace', {}))
-    OKRESY.clear()
-    OKRESY.update(data.get('okres', {}))
-    KATASTRY.clear()
-    KATASTRY.update(data.get('katastr', {}))
-    VEDOUCI.clear()
-    VEDOUCI.update(data.get('vedouci', {}))
-    PIAN_PRESNOST.clear()
-    PIAN_PRESNOST.update(data.get('pian_presnost', {}))
-    TYP_LOKALITY.clear()
-    TYP_LOKALITY.update(data.get('typ_lokality', {}))
-    DRUH_LOKALITY.clear()
-    DRUH_LOKALITY.update(data.get('druh_lokality', {}))
-    JISTOTA.clear()
-    JISTOTA.update(data.get('jistota', {}))
-    LOKALITA_ZACHOVALOST.clear()
-    LOKALITA_ZACHOVALOST.update(data.get('lokalita_zachovalost', {}))
-    PRISTUPNOST.clear()
-    PRISTUPNOST.update(data.get('pristupnost', {}))
-
-
-# Initialize empty dicts that will be populated immediately below
-OBDOBI = {}
-TYP_AKCE = {}
-AREAL = {}
-KRAJE = {}
-ORGANIZACE = {}
-OKRESY = {}
-KATASTRY = {}
-VEDOUCI = {}
-PIAN_PRESNOST = {}
-TYP_LOKALITY = {}
-DRUH_LOKALITY = {}
-JISTOTA = {}
-LOKALITA_ZACHOVALOST = {}
-PRISTUPNOST = {}
-
-refresh_globals()
+    """
+    Recompiles the store if heslar.csv changed and makes all codelists
+    re-read their data on next access.
+    """
+    global _STORE_CHECKED, STORE_GENERATION
+    _STORE_CHECKED = False
+    STORE_GENERATION += 1
+    for codelist in CODELISTS.values():
+        codelist.invalidate()
+    ADMIN_HIERARCHY.invalidate()
+
+
+# Compiled store state: the SQLite file is checked against heslar.csv once
+# per session; _MEMORY_STORE is used when the file cannot be written
+_STORE_CHECKED = False
+_MEMORY_STORE = None
+
+# Incremented on every refresh, so that derived indexes
+# (e.g. amcr_tools.label_index) know when to rebuild
+STORE_GENERATION = 0
+
+# One lazily loaded codelist per category
+CODELISTS = {k: Codelist(k) for k in slovnicek}
+
+OBDOBI = CODELISTS['obdobi']
+TYP_AKCE = CODELISTS['typ_akce']
+AREAL = CODELISTS['areal']
+KRAJE = CODELISTS['kraj']
+ORGANIZACE = CODELISTS['organizace']
+OKRESY = CODELISTS['okres']
+KATASTRY = CODELISTS['katastr']
+VEDOUCI = CODELISTS['vedouci']
+PIAN_PRESNOST = CODELISTS['pian_presnost']
+TYP_LOKALITY = CODELISTS['typ_lokality']
+DRUH_LOKALITY = CODELISTS['druh_lokality']
+JISTOTA = CODELISTS['jistota']
+LOKALITA_ZACHOVALOST = CODELISTS['lokalita_zachovalost']
+PRISTUPNOST = CODELISTS['pristupnost']
+
+ADMIN_HIERARCHY = AdminHierarchy()
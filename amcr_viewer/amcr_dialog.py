@@ -2,9 +2,10 @@
 from qgis.PyQt.QtWidgets import (QDialog, QVBoxLayout,
                                  QLineEdit, QDialogButtonBox,
                                  QCheckBox, QGroupBox, QPushButton,
-                                 QListWidget, QListWidgetItem, QHBoxLayout,
+                                 QListView, QHBoxLayout,
                                  QMessageBox, QLabel, QFormLayout)
-from qgis.PyQt.QtCore import Qt, QSettings
+from qgis.PyQt.QtCore import (Qt, QSettings, QAbstractListModel,
+                              QModelIndex)
 from qgis.core import (QgsTask, QgsApplication,
                        QgsMessageLog, Qgis, QgsAuthMethodConfig)
 from qgis.utils import iface
@@ -12,7 +13,10 @@ from .amcr_codelists import (OBDOBI, TYP_AKCE, KRAJE, AREAL, ORGANIZACE,
                              OKRESY, KATASTRY, VEDOUCI, PIAN_PRESNOST,
                              TYP_LOKALITY, DRUH_LOKALITY, JISTOTA,
                              LOKALITA_ZACHOVALOST, PRISTUPNOST,
-                             download_heslare, refresh_globals)
+                             download_heslare, refresh_globals, Codelist,
+                             ADMIN_HIERARCHY)
+from .amcr_search import SearchIndex
+from .amcr_mirror import MIRROR_KEY
 
 
 # Keep Python references to running tasks. QgsTaskManager only holds the
@@ -56,20 +60,143 @@ class UpdateCodelistsTask(QgsTask):
                     "AMČR", Qgis.Critical)
 
 
+def _is_checked(value):
+    """
+    True if a CheckStateRole value means 'checked'. Views pass the value
+    as a plain int under PyQt6, as the enum (or int) under PyQt5.
+    """
+    checked = Qt.CheckState.Checked
+    return getattr(value, 'value', value) == getattr(checked, 'value', checked)
+
+
+class CodelistModel(QAbstractListModel):
+    """
+    List model over the (label, code) pairs of one codelist.
+
+    Items are rendered on demand by the view, so even the 13k-entry
+    katastr list costs only two Python lists. The check state lives in
+    a set of selected codes instead of in per-item objects.
+
+    The model shows the rows returned by its search index, ordered by
+    match rank: the result list itself maps view rows to items, so a
+    keystroke costs no per-row filter callback. With an empty query
+    all rows are shown in their original order.
+    """
+    def __init__(self, data_dict, selected_codes, parent=None):
+        super().__init__(parent)
+        # Items sorted alphabetically by their display name; rows follow
+        # the search index so its results map directly onto the model
+        if isinstance(data_dict, Codelist):
+            self.search_index = data_dict.search_index()
+        else:
+            self.search_index = SearchIndex(sorted(data_dict.keys()))
+        self.labels = self.search_index.labels
+        self.codes = [data_dict[name] for name in self.labels]
+        self.selected = set(selected_codes)
+
+        # Rows of the search result; None = no query
+        self._matches = None
+        # Item rows allowed at all (e.g. katastry of the selected kraj);
+        # None = no restriction
+        self._allowed_rows = None
+        # View row → item row
+        self._rows = range(len(self.labels))
+
+    def set_allowed_rows(self, rows):
+        self._allowed_rows = rows
+        self._update_rows()
+
+    def set_query(self, text):
+        self._matches = self.search_index.search(text)
+        self._update_rows()
+
+    def _update_rows(self):
+        rows = self._matches
+        allowed = self._allowed_rows
+        if rows is None:
+            rows = (
+                range(len(self.labels)) if allowed is None
+                else sorted(allowed)
+            )
+        elif allowed is not None:
+            rows = [row for row in rows if row in allowed]
+        self.beginResetModel()
+        self._rows = rows
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self.labels[row]
+        if role == Qt.ItemDataRole.UserRole:
+            # The actual code (ID) hidden behind the label
+            return self.codes[row]
+        if role == Qt.ItemDataRole.CheckStateRole:
+            return (
+                Qt.CheckState.Checked
+                if self.codes[row] in self.selected
+                else Qt.CheckState.Unchecked
+            )
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        return (
+            Qt.ItemFlag.ItemIsEnabled
+            | Qt.ItemFlag.ItemIsSelectable
+            | Qt.ItemFlag.ItemIsUserCheckable
+        )
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid() or role != Qt.ItemDataRole.CheckStateRole:
+            return False
+        code = self.codes[self._rows[index.row()]]
+        if _is_checked(value):
+            self.selected.add(code)
+        else:
+            self.selected.discard(code)
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def selected_items(self):
+        """Returns (codes, labels) of all checked items in list order."""
+        codes = []
+        labels = []
+        for label, code in zip(self.labels, self.codes):
+            if code in self.selected:
+                codes.append(code)
+                labels.append(label)
+        return codes, labels
+
+
 class FilterableSelectionDialog(QDialog):
     """
     A custom dialog for selecting multiple items from
     a list with a search filter.
     Updated for PyQt6/Qt6 compatibility.
     """
-    def __init__(self, title, data_dict, preselected_codes, parent=None):
+    def __init__(self, title, data_dict, preselected_codes, parent=None,
+                 allowed_codes=None):
         super().__init__(parent)
         self.setWindowTitle(f"Výběr: {title}")
         self.resize(400, 500)
 
-        # Store the source data and previously selected items
-        self.data_dict = data_dict
-        self.preselected = preselected_codes if preselected_codes else []
+        # Source data and previously selected items live in the model;
+        # the view only asks for the rows that are visible on screen
+        self.model = CodelistModel(data_dict, preselected_codes or [], self)
+
+        # Offer only codes consistent with the rest of the filter
+        if allowed_codes is not None:
+            self.model.set_allowed_rows({
+                row for row, code in enumerate(self.model.codes)
+                if code in allowed_codes
+            })
 
         layout = QVBoxLayout()
 
@@ -79,10 +206,11 @@ class FilterableSelectionDialog(QDialog):
         self.search_bar.textChanged.connect(self.filter_list)
         layout.addWidget(self.search_bar)
 
-        # Main list widget for displaying selectable items
-        self.list_widget = QListWidget()
-        self.populate_list()
-        layout.addWidget(self.list_widget)
+        # Main list view for displaying selectable items
+        self.list_view = QListView()
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setModel(self.model)
+        layout.addWidget(self.list_view)
 
         # Standard OK/Cancel dialog buttons
         buttons = QDialogButtonBox(
@@ -95,58 +223,32 @@ class FilterableSelectionDialog(QDialog):
 
         self.setLayout(layout)
 
-    def populate_list(self):
-        # Sort items alphabetically by their display name
-        sorted_names = sorted(self.data_dict.keys())
-        for name in sorted_names:
-            code = self.data_dict[name]
-            item = QListWidgetItem(name)
-
-            # Store the actual code (ID) hidden in the UserRole
-            item.setData(Qt.ItemDataRole.UserRole, code)
-
-            # Make the item checkable (adds a checkbox)
-            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
-
-            # Restore previous selection state
-            if code in self.preselected:
-                item.setCheckState(Qt.CheckState.Checked)
-            else:
-                item.setCheckState(Qt.CheckState.Unchecked)
-
-            self.list_widget.addItem(item)
-
     def filter_list(self, text):
-        # Hide items that don't match the search text (case-insensitive)
-        search_text = text.lower()
-        for i in range(self.list_widget.count()):
-            item = self.list_widget.item(i)
-            item.setHidden(search_text not in item.text().lower())
+        # Show matching items, best first; case and diacritics are ignored
+        self.model.set_query(text)
 
     def get_selected_codes(self):
         """Returns the hidden codes and display labels of all checked items."""
-        codes = []
-        labels = []
-        for i in range(self.list_widget.count()):
-            item = self.list_widget.item(i)
-            if item.checkState() == Qt.CheckState.Checked:
-                codes.append(item.data(Qt.ItemDataRole.UserRole))
-                labels.append(item.text())
-        return codes, labels
+        return self.model.selected_items()
 
 
 # --- Main window ---
 class AmcrFilterDialog(QDialog):
     """
     The main filtering UI where users set criteria before downloading data.
+
+    mode is 'download' (layers in the project), 'export' (straight to
+    a file) or 'live' (browsing the map extent). The layer refresh and
+    offline mirror options apply to downloads only; browsing always
+    follows the map extent.
     """
-    def __init__(self, typ_dat, parent=None):
+    def __init__(self, typ_dat, parent=None, mode="download"):
         super().__init__(parent)
         self.setWindowTitle("Filtr AMČR")
         self.resize(500, 750)
 
-        # Determines if we are fetching 'akce' (events)
-        # or 'lokalita' (sites)
+        # Determines if we are fetching 'akce' (events),
+        # 'lokalita' (sites) or 'oboje' (both – common filters only)
         self.typ_dat = typ_dat
 
         # Cache dictionary to store selected codes for each category
@@ -157,6 +259,10 @@ class AmcrFilterDialog(QDialog):
             'druh_lokality': [], 'jistota': [], 'lokalita_zachovalost': []
         }
 
+        # Display fields and codelists of the pickers, by cache key
+        self.display_fields = {}
+        self.picker_sources = {}
+
         layout = QVBoxLayout()
 
         # Filter by current map canvas extent
@@ -170,6 +276,18 @@ class AmcrFilterDialog(QDialog):
             self.chk_posevidence = QCheckBox("Pouze pozitivní zjištění")
             layout.addWidget(self.chk_posevidence)
 
+        # Both entities – a filter of one entity would drop every
+        # record of the other, so only the common filters are offered
+
+        if self.typ_dat == "oboje":
+            self.setWindowTitle("Filtr AMČR – akce i lokality")
+            lbl_oboje = QLabel(
+                "Akce a lokality se stahují společně. Filtry platné jen "
+                "pro akce nebo jen pro lokality zde nejsou k dispozici."
+            )
+            lbl_oboje.setWordWrap(True)
+            layout.addWidget(lbl_oboje)
+
         layout.addSpacing(10)
 
         # Spatial information – valid for all
@@ -288,6 +406,55 @@ class AmcrFilterDialog(QDialog):
             self.lbl_komponenty_warning.setVisible
         )
 
+        # Refresh the layers of an earlier download instead of adding new
+        self.chk_refresh = QCheckBox("Aktualizovat existující vrstvy")
+        self.chk_refresh.setToolTip(
+            "Změněné prvky se přepíší, nové přidají a chybějící odeberou "
+            "ve vrstvách dříve stažených se stejným nastavením komponent."
+        )
+        layout.addWidget(self.chk_refresh)
+
+        # Local mirror of downloaded records (see amcr_mirror)
+        self.chk_mirror = QCheckBox("Ukládat stažená data pro offline režim")
+        self.chk_mirror.setChecked(
+            QSettings().value(MIRROR_KEY, False, type=bool)
+        )
+        self.chk_mirror.toggled.connect(
+            lambda checked: QSettings().setValue(MIRROR_KEY, checked)
+        )
+        layout.addWidget(self.chk_mirror)
+
+        self.chk_offline = QCheckBox("Hledat offline v uložených datech")
+        self.chk_offline.setToolTip(
+            "Záznamy se vyhledají v dříve stažených datech bez připojení "
+            "k serveru. Filtry vedoucího a jistoty nejsou podporovány."
+        )
+        layout.addWidget(self.chk_offline)
+
+        for widget in (self.chk_refresh, self.chk_mirror, self.chk_offline):
+            widget.setVisible(mode == "download")
+        self.chk_bbox.setVisible(mode != "live")
+
+        # Codelists without the unit hierarchy (the file shipped with
+        # the plugin) cannot expand kraj/okres filters offline
+        self.lbl_offline_warning = QLabel(
+            "⚠ Uložené hesláře neobsahují hierarchii územních jednotek – "
+            "offline filtr podle kraje a okresu bude dostupný "
+            "po aktualizaci heslářů."
+        )
+        self.lbl_offline_warning.setWordWrap(True)
+        self.lbl_offline_warning.setStyleSheet(
+            self.lbl_komponenty_warning.styleSheet()
+        )
+        self.lbl_offline_warning.setVisible(False)
+        layout.addWidget(self.lbl_offline_warning)
+
+        self.chk_offline.toggled.connect(
+            lambda checked: self.lbl_offline_warning.setVisible(
+                checked and not ADMIN_HIERARCHY.available()
+            )
+        )
+
         # Pushes everything above to the top
         layout.addStretch(1)
 
@@ -334,13 +501,17 @@ class AmcrFilterDialog(QDialog):
         btn = QPushButton("Vybrat...")
         btn.setFixedWidth(80)
 
+        self.display_fields[cache_key] = display_field
+        self.picker_sources[cache_key] = data_source
+
         # Nested handler: opens the selection dialog and saves the result
         def open_dialog():
             dlg = FilterableSelectionDialog(
                 label_text,
                 data_source,
                 self.selection_cache[cache_key],
-                self
+                self,
+                allowed_codes=self.allowed_codes(cache_key)
             )
             if dlg.exec() == QDialog.DialogCode.Accepted:
                 codes, labels = dlg.get_selected_codes()
@@ -351,6 +522,8 @@ class AmcrFilterDialog(QDialog):
                     display_field.setText(", ".join(labels))
                 else:
                     display_field.clear()
+                if cache_key in ('kraj', 'okres'):
+                    self.prune_hierarchy()
 
         # Special case: pre-select default PIAN accuracy levels
         if cache_key == 'pian_presnost':
@@ -376,6 +549,43 @@ class AmcrFilterDialog(QDialog):
         row_widget.setLayout(row_layout)
         return row_widget
 
+    def allowed_codes(self, cache_key):
+        """
+        Returns the codes that can be combined with the current kraj/okres
+        selection, or None if the picker is not restricted.
+        """
+        if cache_key == 'okres':
+            return ADMIN_HIERARCHY.allowed(
+                'okres', kraje=self.selection_cache['kraj']
+            )
+        if cache_key == 'katastr':
+            return ADMIN_HIERARCHY.allowed(
+                'katastr',
+                kraje=self.selection_cache['kraj'],
+                okresy=self.selection_cache['okres']
+            )
+        return None
+
+    def prune_hierarchy(self):
+        """
+        Drops selected okresy and katastry lying outside the selected
+        kraje (and okresy), so that an impossible combination is never
+        sent to the server.
+        """
+        for cache_key in ('okres', 'katastr'):
+            allowed = self.allowed_codes(cache_key)
+            selected = self.selection_cache[cache_key]
+            if allowed is None or not selected:
+                continue
+            kept = [code for code in selected if code in allowed]
+            if len(kept) == len(selected):
+                continue
+
+            self.selection_cache[cache_key] = kept
+            source = self.picker_sources[cache_key]
+            labels = [source.label(code, code) for code in kept]
+            self.display_fields[cache_key].setText(", ".join(labels))
+
     def action_update_heslare(self):
         # Create the task instance and keep a reference so the Python
         # wrapper survives until the task finishes
@@ -400,6 +610,13 @@ class AmcrFilterDialog(QDialog):
 
         def on_completed():
             _cleanup()
+            try:
+                self.lbl_offline_warning.setVisible(
+                    self.chk_offline.isChecked()
+                    and not ADMIN_HIERARCHY.available()
+                )
+            except RuntimeError:
+                pass  # dialog already closed
             QMessageBox.information(
                 parent_win,
                 "Hotovo",
@@ -430,6 +647,12 @@ class AmcrFilterDialog(QDialog):
     def get_komponenty(self):
         return "true" if self.chk_komponenty.isChecked() else "false"
 
+    def get_refresh(self):
+        return "true" if self.chk_refresh.isChecked() else "false"
+
+    def get_offline(self):
+        return "true" if self.chk_offline.isChecked() else "false"
+
     def get_filters(self):
         """Compiles the user selections from the cache into
         API-ready filter parameters."""
@@ -635,13 +858,13 @@ class LoginDialog(QDialog):
         unverified. Wrong credentials are never stored.
         """
         # Lazy import to avoid an import cycle
-        # (amcr_tools imports LoginDialog lazily as well)
-        from . import amcr_tools
+        # (amcr_session imports LoginDialog lazily as well)
+        from . import amcr_session
 
-        if amcr_tools.login_to_api(username, password):
+        if amcr_session.login_to_api(username, password):
             return True
 
-        if amcr_tools.LAST_LOGIN_ERROR == 'network':
+        if amcr_session.last_login_error() == 'network':
             answer = QMessageBox.question(
                 self,
                 "Server nedostupný",
@@ -752,6 +975,8 @@ class LoginDialog(QDialog):
         if existing_id:
             QgsApplication.authManager().removeAuthenticationConfig(existing_id)
             settings.remove(self.SETTINGS_KEY)
+        from . import amcr_session
+        amcr_session.forget_session()
         QMessageBox.information(
             self,
             "Hotovo",
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from urllib.parse import urlsplit
+
+from qgis.core import Qgis, QgsMessageLog
+import requests
+
+# Timeout of the reachability probe (seconds) – an unreachable server is
+# detected within this time instead of a full request timeout
+PROBE_TIMEOUT = 1.0
+
+# Consecutive failures (failed requests and failed probes) after which
+# the circuit opens – a single slow probe or request never opens it
+FAILURE_THRESHOLD = 3
+
+# How long an open circuit rejects requests before the next probe
+OPEN_SECONDS = 15.0
+
+# HTTP statuses that mean the service itself is down
+# (as opposed to a bad request)
+DOWN_STATUSES = (502, 503, 504)
+
+
+class ServiceUnavailable(requests.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request to a server that is known to be
+    unreachable. Subclasses ConnectionError, so callers that already
+    handle network errors need no changes.
+    """
+
+
+class _Circuit:
+    """Health state of one server (host)."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+
+# One circuit per host; shared by all threads
+_CIRCUITS: dict[str, _Circuit] = {}
+_LOCK = threading.Lock()
+
+
+def _circuit(url) -> _Circuit:
+    parts = urlsplit(url)
+    host = parts.netloc
+    with _LOCK:
+        circuit = _CIRCUITS.get(host)
+        if circuit is None:
+            circuit = _Circuit(f"{parts.scheme}://{host}/")
+            _CIRCUITS[host] = circuit
+        return circuit
+
+
+def probe(url) -> bool:
+    """
+    Cheap reachability check: True if the server answers at all
+    (any HTTP status) within PROBE_TIMEOUT.
+    """
+    try:
+        requests.head(
+            _circuit(url).base_url, timeout=PROBE_TIMEOUT,
+            allow_redirects=False
+        )
+        return True
+    except requests.exceptions.RequestException:
+        return False
+
+
+def _open(circuit, reason):
+    circuit.open_until = time.monotonic() + OPEN_SECONDS
+    QgsMessageLog.logMessage(
+        f"Server {circuit.base_url} je nedostupný ({reason}) – "
+        f"další požadavky selžou okamžitě, nový pokus za "
+        f"{OPEN_SECONDS:.0f} s.",
+        "AMČR", Qgis.MessageLevel.Warning
+    )
+
+
+def check(url):
+    """
+    Raises ServiceUnavailable if the server is known to be unreachable.
+
+    Once the open interval runs out, one caller probes the server: if it
+    answers, the circuit closes and requests go through again, otherwise
+    it stays open for another interval. Other callers fail immediately
+    while the probe runs.
+    """
+    circuit = _circuit(url)
+    with _LOCK:
+        if not circuit.open_until:
+            return
+        if circuit.probing or time.monotonic() < circuit.open_until:
+            raise ServiceUnavailable(
+                f"Server {circuit.base_url} je nedostupný."
+            )
+        circuit.probing = True
+
+    reachable = probe(url)
+    with _LOCK:
+        circuit.probing = False
+        if reachable:
+            circuit.failures = 0
+            circuit.open_until = 0.0
+        else:
+            _open(circuit, "neodpovídá")
+    if reachable:
+        QgsMessageLog.logMessage(
+            f"Server {circuit.base_url} je opět dostupný.",
+            "AMČR", Qgis.MessageLevel.Info
+        )
+    else:
+        raise ServiceUnavailable(f"Server {circuit.base_url} je nedostupný.")
+
+
+def record_success(url):
+    circuit = _circuit(url)
+    with _LOCK:
+        circuit.failures = 0
+
+
+def record_failure(url, reason):
+    """
+    Counts a failed request. Below FAILURE_THRESHOLD failures in a row
+    the server is probed, and a failed probe counts as one more failure.
+    The circuit opens once the threshold is reached.
+    """
+    if _count_failure(url) < FAILURE_THRESHOLD and not probe(url):
+        _count_failure(url)
+    circuit = _circuit(url)
+    with _LOCK:
+        if circuit.failures >= FAILURE_THRESHOLD and not circuit.open_until:
+            _open(circuit, reason)
+
+
+def _count_failure(url) -> int:
+    circuit = _circuit(url)
+    with _LOCK:
+        circuit.failures += 1
+        return circuit.failures
+
+
+def call(send, url, *args, **kwargs):
+    """
+    Sends a request through the circuit breaker:
+    call(session.get, url, params=..., timeout=...).
+
+    Fails immediately with ServiceUnavailable while the server is known
+    to be down; otherwise returns the response and records the outcome.
+    """
+    check(url)
+    try:
+        response = send(url, *args, **kwargs)
+    except (requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout) as e:
+        record_failure(url, type(e).__name__)
+        raise
+    if response.status_code in DOWN_STATUSES:
+        record_failure(url, f"HTTP {response.status_code}")
+    else:
+        record_success(url)
+    return response
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+import math
+from collections import OrderedDict
+
+from qgis.core import (QgsProject, QgsTask, QgsApplication, QgsMessageLog,
+                       Qgis, QgsCoordinateReferenceSystem,
+                       QgsCoordinateTransform, QgsRectangle)
+from qgis.PyQt.QtCore import QTimer
+from qgis.utils import iface
+
+from . import amcr_session, amcr_tools
+
+# The map is split into a fixed grid of WGS-84 tiles (about 5 × 3.5 km);
+# every tile is downloaded at most once while it stays in the cache
+# (again only if its last result was incomplete)
+TILE_DEG = 0.05
+
+# Above this many visible tiles the user has to zoom in – browsing whole
+# regions on demand would amount to a bulk download
+MAX_VISIBLE_TILES = 144
+
+# Least recently visible tiles (and their features) are dropped beyond this
+MAX_CACHED_TILES = 400
+
+# Map movements within this interval are merged into a single request
+DEBOUNCE_MS = 400
+
+
+class LiveFetchTask(QgsTask):
+    """
+    Downloads the records and geometries of one request area and builds
+    their features in a background thread.
+    """
+
+    def __init__(self, loader, tiles, bbox_str):
+        super().__init__("Průběžné načítání AMČR", QgsTask.CanCancel)
+        self.loader = loader
+        self.tiles = tiles
+        self.bbox_str = bbox_str
+        # The label index may be rebuilt in the main thread meanwhile
+        self.labels = amcr_tools.label_index()
+        self.features = []
+        self.limit_reached = False
+        self.network_error = False
+        self.exception = None
+
+    def run(self):
+        """Runs in a background thread."""
+        loader = self.loader
+        try:
+            params = amcr_tools.build_search_params(
+                loader.typ_dat, loader.filters, self.bbox_str
+            )
+            docs, network_error, self.limit_reached = (
+                amcr_tools.fetch_records(params, pump_events=False)
+            )
+            if self.isCanceled():
+                return False
+
+            pian_lookup, _, _ = amcr_tools.parse_records(
+                docs, loader.typ_dat, loader.filters, loader.komponenty,
+                self.labels
+            )
+            docs_pian, pian_network_error = amcr_tools.fetch_pians(
+                pian_lookup, loader.filters, pump_events=False
+            )
+            self.network_error = network_error or pian_network_error
+            if self.isCanceled():
+                return False
+
+            self.features = list(amcr_tools.iter_features(
+                docs_pian, pian_lookup, loader.typ_dat,
+                loader.komponenty, loader.filters, labels=self.labels
+            ))
+            return True
+        except Exception as e:
+            self.exception = e
+            return False
+
+    def finished(self, result):
+        """Runs in the main thread after run() completes."""
+        self.loader.on_task_finished(self, result)
+
+
+class LiveLoader:
+    """
+    Browsing mode: keeps a set of AMČR layers filled with the records
+    lying in the visible map extent.
+
+    Whenever the map stops moving, the tiles of the visible extent that
+    are not cached yet are fetched in one background request (the
+    bounding box of all missing tiles). Only one request runs at a time;
+    movements during a request are merged into a single follow-up.
+    Features are shared by all tiles they touch and removed when the last
+    of those tiles is evicted, so memory follows what has been looked at
+    recently, not the size of the whole area.
+
+    A result cut short by a network error or the record limit still adds
+    its features, but its tiles stay incomplete and are requested again
+    the next time they are visible.
+    """
+
+    def __init__(self, canvas, typ_dat, filters=None, komponenty="false"):
+        self.canvas = canvas
+        self.typ_dat = typ_dat
+        self.filters = filters or {}
+        self.komponenty = komponenty
+
+        self.layers = amcr_tools.create_layers(
+            typ_dat, komponenty, name_suffix=" (průběžně)"
+        )
+
+        self._tile_keys = OrderedDict()  # tile → feature keys, LRU order
+        self._key_tiles = {}             # feature key → tiles it touches
+        self._key_fids = {}              # feature key → (layer suffix, fid)
+        # Cached tiles whose last request returned an incomplete result
+        self._incomplete = set()
+
+        self._task = None
+        self._rerun = False
+        self._stopped = False
+        self._zoom_warned = False
+
+        self._to_wgs = QgsCoordinateTransform(
+            QgsCoordinateReferenceSystem("EPSG:5514"),
+            QgsCoordinateReferenceSystem("EPSG:4326"),
+            QgsProject.instance()
+        )
+
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(DEBOUNCE_MS)
+        self._timer.timeout.connect(self.update)
+
+    def start(self):
+        """Adds the layers to the project and loads the visible extent."""
+        # Everything that may need the main thread (stored credentials,
+        # translation dictionary) is prepared before the first task
+        amcr_tools.load_translations()
+        amcr_tools.label_index()
+        amcr_session.prepare_session_async()
+
+        proj = QgsProject.instance()
+        for layer in self.layers.values():
+            # The memory provider keeps the spatial index up to date
+            # as features are added and removed; features are found
+            # by key through _key_fids
+            amcr_tools.build_spatial_index(layer)
+            proj.addMapLayer(layer)
+
+        self.canvas.extentsChanged.connect(self._timer.start)
+        self.update()
+
+    def stop(self):
+        """Stops following the map; the layers stay in the project."""
+        self._stopped = True
+        self._timer.stop()
+        try:
+            self.canvas.extentsChanged.disconnect(self._timer.start)
+        except (TypeError, RuntimeError):
+            pass
+        if self._task is not None:
+            self._task.cancel()
+
+    def _visible_tiles(self):
+        extent = amcr_tools.canvas_extent_wgs(self.canvas)
+        x0 = math.floor(extent.xMinimum() / TILE_DEG)
+        x1 = math.floor(extent.xMaximum() / TILE_DEG)
+        y0 = math.floor(extent.yMinimum() / TILE_DEG)
+        y1 = math.floor(extent.yMaximum() / TILE_DEG)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_VISIBLE_TILES:
+            return None
+        return {
+            (ix, iy)
+            for ix in range(x0, x1 + 1)
+            for iy in range(y0, y1 + 1)
+        }
+
+    def update(self):
+        """Requests the missing tiles of the visible extent."""
+        if self._stopped:
+            return
+        if self._task is not None:
+            # Coalesce: one request at a time, the latest extent next
+            self._rerun = True
+            return
+
+        tiles = self._visible_tiles()
+        if tiles is None:
+            if not self._zoom_warned:
+                self._zoom_warned = True
+                iface.messageBar().pushMessage(
+                    "AMCR",
+                    "Pro průběžné načítání přibližte mapu.",
+                    level=Qgis.MessageLevel.Info
+                )
+            return
+        self._zoom_warned = False
+
+        # Mark visible tiles as recently used
+        for tile in tiles & self._tile_keys.keys():
+            self._tile_keys.move_to_end(tile)
+
+        missing = (tiles - self._tile_keys.keys()) | (tiles & self._incomplete)
+        if not missing:
+            return
+
+        xs = [ix for ix, _ in missing]
+        ys = [iy for _, iy in missing]
+        rect = QgsRectangle(
+            min(xs) * TILE_DEG, min(ys) * TILE_DEG,
+            (max(xs) + 1) * TILE_DEG, (max(ys) + 1) * TILE_DEG
+        )
+
+        self._task = LiveFetchTask(self, missing, amcr_tools.bbox_param(rect))
+        amcr_tools._ACTIVE_TASKS.append(self._task)
+        QgsApplication.taskManager().addTask(self._task)
+
+    def on_task_finished(self, task, result):
+        if task in amcr_tools._ACTIVE_TASKS:
+            amcr_tools._ACTIVE_TASKS.remove(task)
+        self._task = None
+        if self._stopped:
+            return
+
+        try:
+            if result:
+                self._add_features(task.tiles, task.features)
+                if task.network_error or task.limit_reached:
+                    self._incomplete |= task.tiles
+                else:
+                    self._incomplete -= task.tiles
+                if task.limit_reached:
+                    iface.messageBar().pushMessage(
+                        "AMCR",
+                        f"Limit {amcr_tools.MAX_LIMIT} záznamů dosažen – "
+                        "přibližte mapu pro úplný výsledek.",
+                        level=Qgis.MessageLevel.Warning
+                    )
+                if task.network_error:
+                    iface.messageBar().pushMessage(
+                        "AMCR",
+                        "Průběžné načítání bylo přerušeno chybou sítě.",
+                        level=Qgis.MessageLevel.Warning
+                    )
+            elif task.exception is not None:
+                QgsMessageLog.logMessage(
+                    f"Chyba průběžného načítání: {task.exception}",
+                    "AMČR", Qgis.MessageLevel.Warning
+                )
+            self._evict()
+        except RuntimeError:
+            # The user removed the layers from the project
+            self.stop()
+            return
+
+        if self._rerun:
+            self._rerun = False
+            self.update()
+
+    def _tiles_of(self, geom, candidates):
+        """Returns the candidate tiles touched by the geometry's bbox."""
+        bbox = self._to_wgs.transformBoundingBox(geom.boundingBox())
+        x0 = math.floor(bbox.xMinimum() / TILE_DEG)
+        x1 = math.floor(bbox.xMaximum() / TILE_DEG)
+        y0 = math.floor(bbox.yMinimum() / TILE_DEG)
+        y1 = math.floor(bbox.yMaximum() / TILE_DEG)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(candidates):
+            return {
+                (ix, iy) for ix, iy in candidates
+                if x0 <= ix <= x1 and y0 <= iy <= y1
+            }
+        return {
+            (ix, iy)
+            for ix in range(x0, x1 + 1)
+            for iy in range(y0, y1 + 1)
+        } & candidates
+
+    def _add_features(self, tiles, features):
+        # Features of an earlier, incomplete request stay with their tiles
+        for tile in tiles:
+            self._tile_keys.setdefault(tile, set())
+            self._tile_keys.move_to_end(tile)
+
+        new = {suffix: [] for suffix in self.layers}
+        for suffix, feat in features:
+            # Features outside the requested tiles come from records
+            # reaching into them; they are loaded with their own tile
+            feat_tiles = self._tiles_of(feat.geometry(), tiles)
+            if not feat_tiles:
+                continue
+
+            key = amcr_tools.feature_key(feat, self.komponenty)
+            for tile in feat_tiles:
+                self._tile_keys[tile].add(key)
+            if key in self._key_tiles:
+                self._key_tiles[key] |= feat_tiles
+                continue
+            self._key_tiles[key] = set(feat_tiles)
+            new[suffix].append((key, feat))
+
+        for suffix, items in new.items():
+            if not items:
+                continue
+            layer = self.layers[suffix]
+            ok, added = layer.dataProvider().addFeatures(
+                [feat for _, feat in items]
+            )
+            for (key, _), feat in zip(items, added):
+                self._key_fids[key] = (suffix, feat.id())
+            layer.updateExtents()
+            layer.triggerRepaint()
+
+    def _evict(self):
+        """Drops the least recently visible tiles beyond the cache size."""
+        removed = {suffix: [] for suffix in self.layers}
+        while len(self._tile_keys) > MAX_CACHED_TILES:
+            tile, keys = self._tile_keys.popitem(last=False)
+            self._incomplete.discard(tile)
+            for key in keys:
+                key_tiles = self._key_tiles.get(key)
+                if key_tiles is None:
+                    continue
+                key_tiles.discard(tile)
+                if not key_tiles:
+                    del self._key_tiles[key]
+                    suffix, fid = self._key_fids.pop(key)
+                    removed[suffix].append(fid)
+
+        for suffix, fids in removed.items():
+            if fids:
+                layer = self.layers[suffix]
+                layer.dataProvider().deleteFeatures(fids)
+                layer.triggerRepaint()
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import sqlite3
+import time
+
+from qgis.core import (QgsMessageLog, Qgis, QgsCoordinateReferenceSystem,
+                       QgsCoordinateTransform, QgsProject, QgsApplication)
+from qgis.PyQt.QtCore import QSettings
+
+from . import amcr_codelists
+
+# Local copy of the records and PIAN geometries harvested by downloads.
+# Kept in the QGIS user profile: the plugin directory is replaced
+# (and the mirror would be lost) on every plugin upgrade
+MIRROR_DIR = os.path.join(QgsApplication.qgisSettingsDirPath(), 'amcr_viewer')
+MIRROR_FILE = os.path.join(MIRROR_DIR, 'mirror.sqlite')
+MIRROR_VERSION = 2
+
+# QSettings key: store downloaded records in the mirror
+MIRROR_KEY = "amcr_viewer/offline_mirror"
+
+# SQLite limits the number of parameters of one statement
+_CHUNK = 500
+
+# Filter parameters answered from the index of the mirror
+# (OR within a parameter, AND between parameters)
+INDEXED_FILTERS = (
+    'f_kraj', 'f_okres', 'f_katastr', 'f_obdobi', 'f_areal',
+    'f_typ_vyzkumu', 'f_organizace', 'f_typ_lokality',
+    'f_druh_lokality', 'f_lokalita_zachovalost', 'pristupnost',
+)
+
+# Filters applied to the records afterwards, exactly as for
+# an online download (see amcr_tools.parse_records / parse_pian)
+CLIENT_FILTERS = ('posevidence', 'f_pian_presnost')
+
+
+class MirrorError(Exception):
+    """The mirror cannot answer the query."""
+
+
+def harvest_enabled() -> bool:
+    return QSettings().value(MIRROR_KEY, False, type=bool)
+
+
+def _connect():
+    os.makedirs(os.path.dirname(MIRROR_FILE), exist_ok=True)
+    conn = sqlite3.connect(MIRROR_FILE)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != MIRROR_VERSION:
+        _create_schema(conn)
+    return conn
+
+
+def _create_schema(conn):
+    conn.executescript("""
+        DROP TABLE IF EXISTS zaznam;
+        DROP TABLE IF EXISTS zaznam_pian;
+        DROP TABLE IF EXISTS filtr;
+        DROP TABLE IF EXISTS pian;
+        DROP TABLE IF EXISTS pian_rtree;
+        CREATE TABLE zaznam (
+            entita TEXT NOT NULL,
+            ident TEXT NOT NULL,
+            doc TEXT NOT NULL,
+            stazeno REAL NOT NULL,
+            PRIMARY KEY (entita, ident)
+        );
+        CREATE TABLE zaznam_pian (
+            entita TEXT NOT NULL,
+            ident TEXT NOT NULL,
+            pian TEXT NOT NULL
+        );
+        CREATE INDEX zaznam_pian_ident ON zaznam_pian (entita, ident);
+        CREATE INDEX zaznam_pian_pian ON zaznam_pian (pian, entita, ident);
+        CREATE TABLE filtr (
+            entita TEXT NOT NULL,
+            ident TEXT NOT NULL,
+            pole TEXT NOT NULL,
+            hodnota TEXT NOT NULL
+        );
+        CREATE INDEX filtr_hodnota ON filtr (entita, pole, hodnota, ident);
+        CREATE INDEX filtr_ident ON filtr (entita, ident);
+        CREATE TABLE pian (
+            id INTEGER PRIMARY KEY,
+            ident TEXT NOT NULL UNIQUE,
+            doc TEXT NOT NULL,
+            stazeno REAL NOT NULL
+        );
+    """)
+    # WGS-84 bounding boxes of the PIAN geometries
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE pian_rtree USING rtree"
+            "(id, minx, maxx, miny, maxy)"
+        )
+    except sqlite3.OperationalError:
+        # SQLite built without the R*Tree module – same columns,
+        # ordinary indexes
+        conn.executescript("""
+            CREATE TABLE pian_rtree (
+                id INTEGER PRIMARY KEY,
+                minx REAL, maxx REAL, miny REAL, maxy REAL
+            );
+            CREATE INDEX pian_rtree_x ON pian_rtree (minx, maxx);
+        """)
+    conn.execute(f"PRAGMA user_version = {MIRROR_VERSION}")
+    conn.commit()
+
+
+def _as_list(value):
+    if value is None or value == "":
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _value_id(value):
+    """Codes come either plain or as {'id': ..., 'value': ...}."""
+    if isinstance(value, dict):
+        return value.get('id')
+    return value
+
+
+def _record_pians(doc):
+    pians = set(str(p) for p in _as_list(doc.get('az_dj_pian')) if p)
+    for dj in _as_list(doc.get('az_dokumentacni_jednotka')):
+        pid = (dj.get('dj_pian') or {}).get('id')
+        if pid:
+            pians.add(pid)
+    return pians
+
+
+def _filter_values(typ_dat, doc):
+    """
+    Yields the (filter parameter, code) pairs a record matches, as named
+    by the record itself. Parent units are resolved at query time (see
+    _search_values), so the rows stay valid when the hierarchy changes.
+    """
+    for kraj in _as_list(doc.get('kraj')):
+        yield 'f_kraj', _value_id(kraj)
+    for okres in _as_list(doc.get('az_okres')):
+        yield 'f_okres', okres
+    for katastr in _as_list(doc.get('katastr')):
+        yield 'f_katastr', katastr
+
+    for dj in _as_list(doc.get('az_dokumentacni_jednotka')):
+        for komp in _as_list(dj.get('dj_komponenta')):
+            yield 'f_obdobi', _value_id(komp.get('komponenta_obdobi'))
+            yield 'f_areal', _value_id(komp.get('komponenta_areal'))
+
+    for value in _as_list(doc.get('pristupnost')):
+        yield 'pristupnost', _value_id(value)
+
+    if typ_dat == "akce":
+        for key in ('akce_hlavni_typ', 'akce_vedlejsi_typ'):
+            for value in _as_list(doc.get(key)):
+                yield 'f_typ_vyzkumu', _value_id(value)
+        for value in _as_list(doc.get('akce_organizace')):
+            yield 'f_organizace', _value_id(value)
+    else:
+        for key, param in (
+            ('lokalita_typ_lokality', 'f_typ_lokality'),
+            ('lokalita_druh', 'f_druh_lokality'),
+            ('lokalita_zachovalost', 'f_lokalita_zachovalost'),
+        ):
+            for value in _as_list(doc.get(key)):
+                yield param, _value_id(value)
+
+
+def _search_values(key, values):
+    """
+    Returns the (filter parameter, code) pairs that satisfy one filter.
+    A kraj is also matched by the okresy and katastry inside it, an
+    okres by its katastry – taken from the current codelist hierarchy.
+    Raises MirrorError if the hierarchy is not available.
+    """
+    pairs = [(key, str(v)) for v in values]
+    if key not in ('f_kraj', 'f_okres'):
+        return pairs
+
+    hierarchy = amcr_codelists.ADMIN_HIERARCHY
+    parent = 'kraje' if key == 'f_kraj' else 'okresy'
+    children = ('okres', 'katastr') if key == 'f_kraj' else ('katastr',)
+    for category in children:
+        codes = hierarchy.allowed(category, **{parent: values})
+        if codes is None:
+            raise MirrorError(
+                "Offline filtr podle kraje a okresu vyžaduje hierarchii "
+                "územních jednotek – aktualizujte hesláře."
+            )
+        pairs += [(f"f_{category}", code) for code in codes]
+    return pairs
+
+
+def store(typ_dat, docs, docs_pian):
+    """
+    Adds (or replaces) downloaded records and PIAN geometries in the
+    mirror. Called in the main thread after a download.
+
+    Only records whose PIANs were all downloaded are stored. A download
+    filtered by PIAN precision, positive evidence or components fetches
+    just the PIANs that pass – such a record would later be returned
+    offline with missing geometry, so its earlier copy (if any) is kept.
+    """
+    # Lazy import – amcr_tools imports this module
+    from .amcr_tools import parse_pian
+
+    downloaded = {doc.get('ident_cely') for doc in docs_pian}
+    complete = [doc for doc in docs if _record_pians(doc) <= downloaded]
+    skipped = len(docs) - len(complete)
+    docs = complete
+
+    started = time.perf_counter()
+    to_wgs = QgsCoordinateTransform(
+        QgsCoordinateReferenceSystem("EPSG:5514"),
+        QgsCoordinateReferenceSystem("EPSG:4326"),
+        QgsProject.instance()
+    )
+    now = time.time()
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                for doc in docs:
+                    ident = doc.get('ident_cely')
+                    if not ident:
+                        continue
+                    conn.execute(
+                        "INSERT OR REPLACE INTO zaznam "
+                        "(entita, ident, doc, stazeno) VALUES (?, ?, ?, ?)",
+                        (typ_dat, ident, json.dumps(doc, ensure_ascii=False),
+                         now)
+                    )
+                    for table in ('zaznam_pian', 'filtr'):
+                        conn.execute(
+                            f"DELETE FROM {table} "  # nosec B608
+                            "WHERE entita = ? AND ident = ?",
+                            (typ_dat, ident)
+                        )
+                    conn.executemany(
+                        "INSERT INTO zaznam_pian (entita, ident, pian) "
+                        "VALUES (?, ?, ?)",
+                        ((typ_dat, ident, p) for p in _record_pians(doc))
+                    )
+                    conn.executemany(
+                        "INSERT INTO filtr (entita, ident, pole, hodnota) "
+                        "VALUES (?, ?, ?, ?)",
+                        (
+                            (typ_dat, ident, param, str(value))
+                            for param, value in set(
+                                _filter_values(typ_dat, doc)
+                            )
+                            if value
+                        )
+                    )
+
+                for doc in docs_pian:
+                    ident = doc.get('ident_cely')
+                    parsed = parse_pian(doc) if ident else None
+                    if parsed is None:
+                        continue
+                    conn.execute(
+                        "INSERT INTO pian (ident, doc, stazeno) "
+                        "VALUES (?, ?, ?) ON CONFLICT (ident) DO UPDATE "
+                        "SET doc = excluded.doc, stazeno = excluded.stazeno",
+                        (ident, json.dumps(doc, ensure_ascii=False), now)
+                    )
+                    pian_id = conn.execute(
+                        "SELECT id FROM pian WHERE ident = ?", (ident,)
+                    ).fetchone()[0]
+                    bbox = to_wgs.transformBoundingBox(
+                        parsed[1].boundingBox()
+                    )
+                    conn.execute(
+                        "INSERT OR REPLACE INTO pian_rtree "
+                        "(id, minx, maxx, miny, maxy) VALUES (?, ?, ?, ?, ?)",
+                        (pian_id, bbox.xMinimum(), bbox.xMaximum(),
+                         bbox.yMinimum(), bbox.yMaximum())
+                    )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        QgsMessageLog.logMessage(
+            f"Offline zrcadlo nelze uložit do {MIRROR_FILE}: {e}",
+            "AMČR", Qgis.MessageLevel.Warning
+        )
+        return
+
+    QgsMessageLog.logMessage(
+        f"Offline zrcadlo: uloženo {len(docs)} záznamů a "
+        f"{len(docs_pian)} geometrií za "
+        f"{(time.perf_counter() - started) * 1000:.0f} ms."
+        + (
+            f" {skipped} záznamů bez všech geometrií (filtr přesnosti, "
+            "pozitivních zjištění nebo komponent) neuloženo."
+            if skipped else ""
+        ),
+        "AMČR", Qgis.MessageLevel.Info
+    )
+
+
+def has_data(typ_dat) -> bool:
+    if not os.path.exists(MIRROR_FILE):
+        return False
+    try:
+        conn = _connect()
+        try:
+            return conn.execute(
+                "SELECT 1 FROM zaznam WHERE entita = ? LIMIT 1", (typ_dat,)
+            ).fetchone() is not None
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+
+
+def query(typ_dat, filters=None, bbox_str=None, limit=None):
+    """
+    Answers a download query from the mirror. Returns (docs, docs_pian)
+    in the same form the API returns them, so the rest of the download
+    runs unchanged. Raises MirrorError for filters the mirror does not
+    index or when the mirror cannot be read.
+    """
+    filters = filters or {}
+    unsupported = [
+        key for key, value in filters.items()
+        if value and key not in INDEXED_FILTERS and key not in CLIENT_FILTERS
+    ]
+    if unsupported:
+        raise MirrorError(
+            "Offline zrcadlo nepodporuje filtr: " + ", ".join(unsupported)
+        )
+    if not os.path.exists(MIRROR_FILE):
+        raise MirrorError("Offline zrcadlo je prázdné.")
+
+    # Codes satisfying each filter, kept in a temporary table –
+    # a kraj expands to thousands of katastry
+    searched = [
+        (key, pole, hodnota)
+        for key in INDEXED_FILTERS
+        if filters.get(key)
+        for pole, hodnota in _search_values(key, _as_list(filters[key]))
+    ]
+
+    started = time.perf_counter()
+    sql = ["SELECT doc FROM zaznam WHERE entita = ?"]
+    params = [typ_dat]
+
+    for key in dict.fromkeys(key for key, _, _ in searched):
+        sql.append(
+            "AND ident IN (SELECT f.ident FROM filtr f "
+            "JOIN hledano h ON h.pole = f.pole AND h.hodnota = f.hodnota "
+            "WHERE f.entita = ? AND h.filtr = ?)"
+        )
+        params += [typ_dat, key]
+
+    if bbox_str:
+        min_lat, min_lon, max_lat, max_lon = (
+            float(v) for v in bbox_str.split(',')
+        )
+        sql.append(
+            "AND ident IN (SELECT zp.ident FROM pian_rtree r "
+            "JOIN pian p ON p.id = r.id "
+            "JOIN zaznam_pian zp ON zp.pian = p.ident AND zp.entita = ? "
+            "WHERE r.minx <= ? AND r.maxx >= ? "
+            "AND r.miny <= ? AND r.maxy >= ?)"
+        )
+        params += [typ_dat, max_lon, min_lon, max_lat, min_lat]
+
+    sql.append("ORDER BY ident")
+    if limit:
+        sql.append("LIMIT ?")
+        params.append(limit)
+
+    try:
+        conn = _connect()
+        try:
+            conn.execute(
+                "CREATE TEMP TABLE hledano "
+                "(filtr TEXT, pole TEXT, hodnota TEXT, "
+                "PRIMARY KEY (filtr, pole, hodnota))"
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO hledano VALUES (?, ?, ?)", searched
+            )
+            docs = [
+                json.loads(raw)
+                for (raw,) in conn.execute(" ".join(sql), params)
+            ]
+            pian_ids = sorted(set().union(*map(_record_pians, docs)))
+            docs_pian = []
+            for i in range(0, len(pian_ids), _CHUNK):
+                chunk = pian_ids[i: i + _CHUNK]
+                docs_pian += [
+                    json.loads(raw)
+                    for (raw,) in conn.execute(
+                        "SELECT doc FROM pian WHERE ident IN "  # nosec B608
+                        f"({','.join('?' * len(chunk))})",
+                        chunk
+                    )
+                ]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        raise MirrorError(f"Offline zrcadlo nelze přečíst: {e}")
+
+    QgsMessageLog.logMessage(
+        f"Offline zrcadlo: {len(docs)} záznamů a {len(docs_pian)} "
+        f"geometrií za {(time.perf_counter() - started) * 1000:.0f} ms.",
+        "AMČR", Qgis.MessageLevel.Info
+    )
+    return docs, docs_pian
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from qgis.core import (QgsMapRendererSequentialJob, QgsMapSettings,
+                       QgsMessageLog, QgsRectangle, QgsSingleSymbolRenderer,
+                       QgsSymbol, Qgis)
+from qgis.PyQt.QtCore import QSettings, QSize
+
+# resource is not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# QSettings key: profile the memory of each download stage
+PROFILE_KEY = "amcr_viewer/profile_memory"
+
+# Directory of the JSON reports (QSettings key; default: system temp)
+PROFILE_DIR_KEY = "amcr_viewer/profile_memory_dir"
+
+# Allocation sites listed per stage
+TOP_SITES = 10
+
+# Stack depth recorded per allocation; one frame is enough to attribute
+# memory to a line, more only slows the traced code down
+TRACE_FRAMES = 1
+
+# Map image drawn when timing a layer: size in pixels and resolution
+RENDER_SIZE = 1000
+RENDER_DPI = 96
+
+# Allocations made by the profiler itself and by imports
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def enabled() -> bool:
+    return QSettings().value(PROFILE_KEY, False, type=bool)
+
+
+def _kib(size) -> float:
+    return round(size / 1024, 1)
+
+
+def _rss_peak_kib():
+    """Peak resident size of the whole process (incl. C++), if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return _kib(peak) if sys.platform == "darwin" else float(peak)
+
+
+class MemoryProfile:
+    """
+    Memory profile of one download, built from tracemalloc snapshots
+    taken at the stage boundaries.
+
+    For every stage it records the peak traced memory while the stage
+    ran, the memory still held when it finished (relative to the start
+    of the download) and the lines that allocated the most of it.
+    Only Python allocations are traced – memory of QGIS objects held
+    on the C++ side (feature geometries, layer storage) shows up just
+    in the process peak (rss_peak_kib).
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.stages = []
+        self.renders = []
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(TRACE_FRAMES)
+        tracemalloc.reset_peak()
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        self._previous = self._snapshot()
+        self._stage_started = time.perf_counter()
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+    def stage(self, name):
+        """Closes the stage that has just finished."""
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = self._snapshot()
+        sites = [
+            {
+                'site': f"{stat.traceback[0].filename}:"
+                        f"{stat.traceback[0].lineno}",
+                'kib': _kib(stat.size_diff),
+                'count': stat.count_diff,
+            }
+            for stat in snapshot.compare_to(self._previous, 'lineno')
+            if stat.size_diff > 0
+        ][:TOP_SITES]
+        self.stages.append({
+            'stage': name,
+            'seconds': round(time.perf_counter() - self._stage_started, 3),
+            'peak_kib': _kib(peak - self._baseline),
+            'retained_kib': _kib(current - self._baseline),
+            'top_sites': sites,
+        })
+        self._previous = snapshot
+        tracemalloc.reset_peak()
+        self._stage_started = time.perf_counter()
+
+    def render(self, layers, scales):
+        """
+        Times drawing each layer at the given map scales, once with its
+        own renderer (the simplified geometry levels of amcr_tools) and
+        once with a plain symbol that draws the full geometry.
+        """
+        for layer in layers:
+            own = layer.renderer().clone()
+            plain = QgsSingleSymbolRenderer(
+                QgsSymbol.defaultSymbol(layer.geometryType())
+            )
+            for scale in scales:
+                times = []
+                for renderer in (own, plain):
+                    layer.setRenderer(renderer.clone())
+                    times.append(_render_ms(layer, scale))
+                self.renders.append({
+                    'layer': layer.name(),
+                    'scale': scale,
+                    'levels_ms': times[0],
+                    'full_ms': times[1],
+                })
+            layer.setRenderer(own)
+
+    def finish(self):
+        """Stops tracing, logs the profile and writes the JSON report."""
+        if self._started_tracing:
+            tracemalloc.stop()
+
+        report = {
+            'label': self.label,
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'rss_peak_kib': _rss_peak_kib(),
+            'stages': self.stages,
+            'render': self.renders,
+        }
+        lines = [f"Profil paměti ({self.label}):"]
+        for s in self.stages:
+            lines.append(
+                f"  {s['stage']}: špička {s['peak_kib']:.0f} KiB, "
+                f"drženo {s['retained_kib']:.0f} KiB, {s['seconds']:.2f} s"
+            )
+            for site in s['top_sites'][:3]:
+                lines.append(f"      {site['kib']:.0f} KiB  {site['site']}")
+        for r in self.renders:
+            lines.append(
+                f"  Vykreslení {r['layer']} 1:{r['scale']}: "
+                f"úrovně {r['levels_ms']} ms, "
+                f"plná geometrie {r['full_ms']} ms"
+            )
+
+        path = os.path.join(
+            QSettings().value(PROFILE_DIR_KEY, "") or tempfile.gettempdir(),
+            f"amcr_pamet_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        )
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            lines.append(f"Report: {path}")
+        except OSError as e:
+            lines.append(f"Report nelze uložit do {path}: {e}")
+
+        QgsMessageLog.logMessage(
+            "\n".join(lines), "AMČR", Qgis.MessageLevel.Info
+        )
+        return report
+
+
+def _render_ms(layer, scale):
+    """
+    Draws the layer around the centre of its extent at the given scale
+    and returns the drawing time in milliseconds.
+    """
+    settings = QgsMapSettings()
+    settings.setLayers([layer])
+    settings.setDestinationCrs(layer.crs())
+    settings.setOutputSize(QSize(RENDER_SIZE, RENDER_SIZE))
+    settings.setOutputDpi(RENDER_DPI)
+    # Half the image width in map units (metres) at the scale
+    half = scale * RENDER_SIZE / RENDER_DPI * 0.0254 / 2
+    center = layer.extent().center()
+    settings.setExtent(QgsRectangle(
+        center.x() - half, center.y() - half,
+        center.x() + half, center.y() + half
+    ))
+    job = QgsMapRendererSequentialJob(settings)
+    job.start()
+    job.waitForFinished()
+    return job.renderingTime()
+
+
+class _NoProfile:
+    """Stand-in used while profiling is off."""
+
+    def stage(self, name):
+        pass
+
+    def render(self, layers, scales):
+        pass
+
+    def finish(self):
+        return None
+
+
+def start(label):
+    """Returns a running MemoryProfile, or a no-op when profiling is off."""
+    return MemoryProfile(label) if enabled() else _NoProfile()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+
+# Ranks of a match, best first
+RANK_EXACT = 0      # the whole label equals the query
+RANK_PREFIX = 1     # the label starts with the query
+RANK_WORD = 2       # a word inside the label starts with the query
+RANK_SUBSTRING = 3  # the query occurs anywhere else in the label
+
+# Queries shorter than this are matched by prefix only –
+# a trigram index cannot answer them and they would match almost everything
+MIN_SUBSTRING_LEN = 3
+
+
+def fold(text):
+    """
+    Normalizes text for searching: removes diacritics and case,
+    so that "Brezno" matches "Březno".
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(
+        ch for ch in decomposed if not unicodedata.combining(ch)
+    ).casefold()
+
+
+def _word_starts(text):
+    """Yields the positions where a word starts in the text."""
+    prev_alnum = False
+    for i, ch in enumerate(text):
+        is_alnum = ch.isalnum()
+        if is_alnum and not prev_alnum:
+            yield i
+        prev_alnum = is_alnum
+
+
+class SearchIndex:
+    """
+    Diacritics-insensitive search index over the labels of one codelist.
+
+    Built once per codelist category. Prefix queries are answered by
+    binary search over the sorted word suffixes, substring queries by
+    verifying the rows listed under the rarest trigram of the query, so
+    a keystroke never has to scan the whole list.
+    """
+
+    def __init__(self, labels):
+        self.labels = list(labels)
+        self.folded = [fold(label) for label in self.labels]
+
+        # Every label suffix that starts at a word boundary, sorted –
+        # a prefix query is a contiguous range in this list
+        suffixes = []
+        trigrams = defaultdict(list)
+        for row, text in enumerate(self.folded):
+            for start in _word_starts(text):
+                suffixes.append((text[start:], row))
+            for gram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                trigrams[gram].append(row)
+        suffixes.sort()
+
+        self._suffix_keys = [key for key, _ in suffixes]
+        self._suffix_rows = [row for _, row in suffixes]
+        self._trigrams = dict(trigrams)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def search(self, query):
+        """
+        Returns the rows matching the query, best matches first
+        (ties keep the order of the labels), or None for an empty query,
+        which means "everything".
+        """
+        q = fold(query).strip()
+        if not q:
+            return None
+
+        ranks = {}
+
+        # Prefix matches – of the whole label or of any word in it
+        keys = self._suffix_keys
+        i = bisect_left(keys, q)
+        while i < len(keys) and keys[i].startswith(q):
+            row = self._suffix_rows[i]
+            text = self.folded[row]
+            if text == q:
+                rank = RANK_EXACT
+            elif text.startswith(q):
+                rank = RANK_PREFIX
+            else:
+                rank = RANK_WORD
+            if rank < ranks.get(row, RANK_SUBSTRING + 1):
+                ranks[row] = rank
+            i += 1
+
+        # Substring matches – candidates from the rarest trigram
+        if len(q) >= MIN_SUBSTRING_LEN:
+            postings = [
+                self._trigrams.get(q[j:j + 3], ())
+                for j in range(len(q) - 2)
+            ]
+            for row in min(postings, key=len):
+                if row not in ranks and q in self.folded[row]:
+                    ranks[row] = RANK_SUBSTRING
+
+        return sorted(ranks, key=lambda row: (ranks[row], row))
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+
+from qgis.core import Qgis, QgsTask, QgsApplication
+from qgis.PyQt.QtCore import QSettings
+import requests
+
+from .amcr_client import AmcrClient, _log, _new_session
+
+# A session older than this is renewed in the background when a dialog
+# opens, so the download that follows does not wait for the login
+SESSION_REFRESH_S = 20 * 60
+
+# A cookie persisted by a previous QGIS session is reused only if younger
+# than this (the server drops idle sessions after about half an hour)
+SESSION_MAX_AGE_S = 30 * 60
+
+# Key of the cookie record inside the encrypted auth config that also
+# holds the credentials (see amcr_dialog.LoginDialog)
+COOKIE_CONFIG_KEY = "session_cookies"
+
+# Client of the plugin's own downloads; logs in with the credentials
+# stored in the Authentication Manager. The functions below manage its
+# session (background login, cookie persistence, renewal).
+DEFAULT_CLIENT = AmcrClient(stored_credentials=True)
+
+# Python references to running tasks (see amcr_dialog._ACTIVE_TASKS)
+_ACTIVE_TASKS = []
+
+
+def login_to_api(username: str, password: str):
+    """
+    Logs in the default client (see AmcrClient.login).
+    Returns a requests.Session with the session cookie set, or None on error.
+    """
+    return DEFAULT_CLIENT.login(username, password)
+
+
+def last_login_error() -> str | None:
+    """Reason of the last failed login of the default client."""
+    return DEFAULT_CLIENT.last_login_error
+
+
+def reauthenticate(stale=None) -> requests.Session | None:
+    """Renews the default client's session (see AmcrClient)."""
+    return DEFAULT_CLIENT.reauthenticate(stale)
+
+
+def get_session() -> requests.Session | None:
+    """
+    Returns the default client's session, logging in with the stored
+    credentials if needed. Returns None for anonymous access.
+    """
+    return DEFAULT_CLIENT.get_session()
+
+
+def _store_cookies(session):
+    """Saves the session cookie into the encrypted auth config."""
+    from .amcr_dialog import LoginDialog
+
+    config_id = QSettings().value(LoginDialog.SETTINGS_KEY, "")
+    if not config_id:
+        return
+    ok, cfg = LoginDialog._load_config(config_id, full=True)
+    if not ok:
+        return
+    cookies = [
+        {
+            'name': c.name, 'value': c.value,
+            'domain': c.domain, 'path': c.path
+        }
+        for c in session.cookies
+    ]
+    cfg.setConfig(COOKIE_CONFIG_KEY, json.dumps({
+        'created': DEFAULT_CLIENT.session_created,
+        'cookies': cookies,
+    }))
+    QgsApplication.authManager().updateAuthenticationConfig(cfg)
+
+
+def _restore_cookies() -> bool:
+    """
+    Recreates the session from the cookie saved by a previous QGIS
+    session, if it is recent enough. No network request is made;
+    an expired cookie is replaced on the first auth error.
+    """
+    from .amcr_dialog import LoginDialog
+
+    config_id = QSettings().value(LoginDialog.SETTINGS_KEY, "")
+    if not config_id:
+        return False
+    ok, cfg = LoginDialog._load_config(config_id, full=True)
+    if not ok:
+        return False
+    try:
+        stored = json.loads(cfg.config(COOKIE_CONFIG_KEY, "") or "{}")
+        created = float(stored.get('created', 0))
+        cookies = stored.get('cookies') or []
+    except (ValueError, TypeError, AttributeError):
+        return False
+    if not cookies or time.time() - created > SESSION_MAX_AGE_S:
+        return False
+
+    session = _new_session()
+    for c in cookies:
+        session.cookies.set(
+            c['name'], c['value'], domain=c.get('domain', ''),
+            path=c.get('path', '/')
+        )
+    if DEFAULT_CLIENT.adopt_session(session, created):
+        _log("Použita uložená session z předchozího spuštění.")
+    return True
+
+
+class LoginTask(QgsTask):
+    """Logs in (or renews the session) in the background."""
+
+    def __init__(self, stale=None):
+        super().__init__("Přihlášení do AMČR", QgsTask.Silent)
+        self.stale = stale
+        self.session = None
+        self.exception = None
+
+    def run(self):
+        """Runs in a background thread."""
+        try:
+            self.session = reauthenticate(self.stale)
+            return self.session is not None
+        except Exception as e:
+            self.exception = e
+            return False
+
+    def finished(self, result):
+        """Runs in the main thread after run() completes."""
+        if self in _ACTIVE_TASKS:
+            _ACTIVE_TASKS.remove(self)
+        if result:
+            _store_cookies(self.session)
+        elif self.exception is not None:
+            _log(f"Přihlášení na pozadí selhalo: {self.exception}",
+                 Qgis.MessageLevel.Warning)
+
+
+def _start_login(stale=None):
+    if any(isinstance(t, LoginTask) for t in _ACTIVE_TASKS):
+        return
+    task = LoginTask(stale)
+    _ACTIVE_TASKS.append(task)
+    QgsApplication.taskManager().addTask(task)
+
+
+def _refresh_if_old():
+    """Renews an old session in the background."""
+    session = DEFAULT_CLIENT.session
+    if session is not None and (
+        time.time() - DEFAULT_CLIENT.session_created >= SESSION_REFRESH_S
+    ):
+        _start_login(stale=session)
+
+
+def prepare_session_async():
+    """
+    Makes sure an authenticated session will be ready when the download
+    starts, without blocking the GUI. Called in the main thread when the
+    filter dialog opens.
+
+    The credentials are read here (the Authentication Manager may ask for
+    the master password), a saved cookie is reused if recent, and the
+    login itself runs in a background task. An old session is renewed
+    the same way. Nothing runs between downloads; a session that
+    expires meanwhile is renewed by the client on its next request
+    (see AmcrClient.get_session).
+    """
+    username, password = DEFAULT_CLIENT.credentials()
+    if not (username and password):
+        return
+
+    if DEFAULT_CLIENT.session is None and not _restore_cookies():
+        _start_login()
+    else:
+        _refresh_if_old()
+
+
+def remember_session():
+    """
+    Persists the current session after an interactive login
+    (main thread, once the credentials have been saved).
+    """
+    if DEFAULT_CLIENT.session is not None:
+        _store_cookies(DEFAULT_CLIENT.session)
+
+
+def forget_session():
+    """Drops the session and cached credentials (logout)."""
+    DEFAULT_CLIENT.logout()
@@ -1,205 +1,417 @@
 ﻿# -*- coding: utf-8 -*-
 from qgis.core import (QgsProject, QgsVectorLayer, QgsFeature, QgsGeometry,
-                       QgsField, QgsCoordinateReferenceSystem,
+                       QgsField, QgsFields, QgsCoordinateReferenceSystem,
                        QgsCoordinateTransform, QgsWkbTypes, Qgis,
-                       QgsMessageLog)
+                       QgsMessageLog, QgsTask, QgsApplication,
+                       QgsVectorFileWriter, QgsFeatureRequest,
+                       QgsRuleBasedRenderer, QgsSymbol, QgsFillSymbol,
+                       QgsLineSymbol, QgsGeometryGeneratorSymbolLayer,
+                       QgsEditorWidgetSetup)
 from qgis.utils import iface
-from qgis.PyQt.QtCore import Qt, QMetaType
+from qgis.PyQt.QtCore import Qt, QMetaType, QTimer, QSettings
 from qgis.PyQt.QtWidgets import QApplication
 from qgis.PyQt.QtGui import QCursor
 import requests
+import functools
+import itertools
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from . import (amcr_codelists, amcr_health, amcr_mirror, amcr_profiling,
+               amcr_session)
+from .amcr_client import PostRefused
+from .amcr_codelists import CODELISTS_DIR, ensure_codelists_dir
 
 # Global cache to store translated terms from the Digital Archive
 TRANSLATIONS = {}
 
-# Session with authentication cookie after login;
-# None = not logged in (anonymous access)
-AMCR_SESSION: requests.Session | None = None
-
-# Reason of the last failed login: 'auth' (wrong credentials),
-# 'network' (server unreachable / invalid response) or None
-LAST_LOGIN_ERROR: str | None = None
-
-# Re-entrancy guard: the download runs in the main thread and pumps the
-# event loop via processEvents(), so the user could otherwise start
-# a second download while the first one is still running
+TRANSLATIONS_URL = "https://digiarchiv.aiscr.cz/api/assets/i18n/cs.json"
+
+# On-disk copy of the translation dictionary together with the HTTP
+# validators (ETag / Last-Modified) needed to revalidate it
+TRANSLATIONS_CACHE = os.path.join(CODELISTS_DIR, 'cs.json')
+TRANSLATIONS_CACHE_VERSION = 1
+# Parsed TRANSLATIONS_CACHE; the file is read at most once per session
+_TRANSLATIONS_FILE: dict | None = None
+_TRANSLATIONS_FILE_READ = False
+
+# Unified code → label index (codelists overlaid with TRANSLATIONS);
+# rebuilt lazily whenever either source changes
+_LABEL_INDEX: dict | None = None
+_LABEL_INDEX_GENERATION = None
+
+# Background revalidation runs at most once per QGIS session
+_TRANSLATIONS_REVALIDATED = False
+
+# Python references to running tasks (see amcr_dialog._ACTIVE_TASKS)
+_ACTIVE_TASKS = []
+
+# Simplified geometry levels of polygon/line features, stored with each
+# feature: (hidden field, tolerance in metres, scale denominator from
+# which the level is drawn). A tolerance stays below half a pixel
+# at the level's scale; closer in, the full geometry is drawn. The
+# levels are derived from the geometry – exports and layer updates
+# leave them out of the attributes they write or compare.
+SIMPLIFY_LEVELS = [
+    ("geom_25k", 3.0, 25000),
+    ("geom_250k", 30.0, 250000),
+]
+
+# Key indexes of the output layers: layer ID → LayerKeys (see layer_keys)
+_LAYER_KEYS = {}
+
+# QSettings key: build layer indexes only after the layers are shown
+# (default) instead of before adding them to the project
+DEFERRED_INDEXES_KEY = "amcr_viewer/deferred_indexes"
+
+# Re-entrancy guard (see _exclusive): the download runs in the main
+# thread and pumps the event loop via processEvents(), so the user could
+# otherwise start a second download while the first one is still running
 _LOADING = False
 
-
-def _log(msg: str, level=Qgis.MessageLevel.Info):
+SEARCH_URL = "https://digiarchiv.aiscr.cz/api/search/query"
+DIGIARCHIV_ID_URL = "https://digiarchiv.aiscr.cz/id/"
+
+BATCH_DOCS = 500   # Records per API request
+MAX_LIMIT = 20000  # Safety limit to prevent QGIS from freezing
+# Geometry requests are batch-processed
+# to stay under URL length limits:
+BATCH_PIAN = 200
+# PIANs per request when queries go in a POST body (no URL limit)
+BATCH_PIAN_POST = 1000
+
+# Values of one multi-select filter sent in a single query; longer
+# OR lists are split into sub-queries that run side by side
+MAX_OR_VALUES = 100
+MAX_PARALLEL_QUERIES = 4
+# Sub-queries of one query; splitting several long lists multiplies them
+MAX_SUB_QUERIES = 32
+
+# Entities downloaded together by load_combined_data, with their labels
+ENTITIES = {"akce": "Akce", "lokalita": "Lokality"}
+
+# Custom layer properties identifying the output layers of a download,
+# so that a refresh can find them again (also in a saved project)
+LAYER_PROPERTY_PREFIX = "amcr_viewer/"
+
+# Fields requested by the fingerprint pass of a sync – the record
+# identifier and the index version that changes with every edit
+SYNC_FIELDS = "ident_cely,_version_"
+
+# Output layers: (memory layer geometry, layer name suffix)
+LAYER_GEOMETRIES = [
+    ("Polygon", "Polygony"),
+    ("LineString", "Linie"),
+    ("Point", "Body"),
+]
+# Geometry type → name suffix of the layer the feature belongs to
+LAYER_SUFFIXES = {
+    QgsWkbTypes.PolygonGeometry: "Polygony",
+    QgsWkbTypes.LineGeometry: "Linie",
+    QgsWkbTypes.PointGeometry: "Body",
+}
+# File export: layer name suffix → geometry type of the output file;
+# multi-part, as a PIAN may be single or multi-part
+EXPORT_GEOMETRIES = {
+    "Polygony": QgsWkbTypes.MultiPolygon,
+    "Linie": QgsWkbTypes.MultiLineString,
+    "Body": QgsWkbTypes.MultiPoint,
+}
+# File export: OGR driver → file extension. Each geometry type gets its
+# own file – FlatGeobuf and GeoParquet hold a single layer, and writers
+# of several GeoPackage layers open at once would each hold their own
+# SQLite write transaction on the same file.
+EXPORT_FORMATS = {
+    "FlatGeobuf": ".fgb",
+    "GPKG": ".gpkg",
+    "Parquet": ".parquet",
+}
+
+
+def _api_query_json(url, params, timeout=30, client=None) -> dict:
     """
-    Shortcut: writes a message to the QGIS log
-    (Messages panel → AMČR tab).
+    Sends a search query through the given client (default: the
+    plugin's own, amcr_session.DEFAULT_CLIENT) and returns the parsed
+    JSON body; see AmcrClient.get_json.
+
+    Queries go as POST form bodies, free of URL length limits, as long
+    as the endpoint accepts them. POST counts as unsupported by the
+    client (client.post_queries) only if the server refuses the method
+    or a query that failed as POST succeeds as GET; a query that fails
+    either way leaves the flag untouched.
+
+    A server may also accept the method but ignore the body, answering
+    a default, unfiltered query. Until POST is known to work, its reply
+    is therefore accepted only if it echoes the query sent
+    (_post_body_used) or matches the reply to the same query as GET.
     """
-    QgsMessageLog.logMessage(msg, "AMČR login", level)
+    client = client or amcr_session.DEFAULT_CLIENT
+    if client.post_queries is False:
+        return client.get_json(url, params, timeout)
+    try:
+        body = client.post_form_json(url, params, timeout)
+    except PostRefused:
+        _post_unsupported(client)
+        return client.get_json(url, params, timeout)
+    except ValueError:
+        if client.post_queries:
+            raise
+        # An error page instead of JSON – GET decides
+        body = None
+    post_body = None
+    if isinstance(body, dict):
+        if 'response' in body:
+            if client.post_queries or _post_body_used(params, body):
+                client.learn('post_queries', True)
+                return body
+            # Not confirmed – GET decides
+            post_body = body
+        # The query itself failed (left to the caller, such as the
+        # cursor fallback of _fetch_pages)
+        elif client.post_queries or _is_cursor_error(body):
+            return body
+    body = client.get_json(url, params, timeout)
+    if 'response' in body:
+        if post_body is not None and _same_result(post_body, body):
+            client.learn('post_queries', True)
+        else:
+            _post_unsupported(client)
+    return body
 
 
-def login_to_api(username: str, password: str):
+def _post_body_used(params, body) -> bool:
     """
-    Logs in to the Digiarchiv API using a username and password.
-    Returns a requests.Session with the session cookie set, or None on error.
+    True if the reply to a POST query echoes the query and page size
+    sent in the form body (responseHeader.params).
     """
-    login_url = "https://digiarchiv.aiscr.cz/api/user/login"
+    echoed = body.get('responseHeader', {}).get('params')
+    if not isinstance(echoed, dict):
+        return False
+    return all(
+        str(echoed.get(key)) == str(params[key])
+        for key in ('q', 'rows') if key in params
+    )
 
-    global LAST_LOGIN_ERROR
-    LAST_LOGIN_ERROR = None
 
-    _log(f"Přihlašuji uživatele: '{username}'")
+def _same_result(first, second) -> bool:
+    """True if two query replies found and returned the same records."""
+    a = first.get('response', {})
+    b = second.get('response', {})
+    return (
+        a.get('numFound') == b.get('numFound')
+        and len(a.get('docs', [])) == len(b.get('docs', []))
+    )
+
 
-    if not username or not password:
-        _log(
-            "CHYBA: username nebo heslo je prázdné.",
-            Qgis.MessageLevel.Critical
+def _post_unsupported(client):
+    if client.learn('post_queries', False):
+        QgsMessageLog.logMessage(
+            "API nepřijímá dotazy metodou POST – použita metoda GET.",
+            "AMČR", Qgis.MessageLevel.Info
         )
-        LAST_LOGIN_ERROR = 'auth'
-        return None
 
-    session = requests.Session()
-    session.headers.update({
-        "Accept": "application/json, text/plain, */*",
-        "Content-Type": "application/json",
-        "User-Agent": "QGIS-Plugin/1.0 (AISCR Data Fetcher)"
-    })
 
-    try:
-        _log(f"Odesílám POST na {login_url} ...")
-        response = session.post(
-            login_url,
-            json={"user": username, "pwd": password},
-            timeout=10
-        )
-        _log(f"HTTP status: {response.status_code}")
-        response.raise_for_status()
-
-        # The API returns errors with status code 200 –
-        # the response body must be checked
-        body = response.json()
-        if "error" in body:
-            _log(
-                f"CHYBA přihlášení (API): {body['error']}",
-                Qgis.MessageLevel.Critical
-            )
-            LAST_LOGIN_ERROR = 'auth'
-            return None
+def _set_translations(translations: dict):
+    """Replaces the translation dictionary and drops the label index."""
+    global TRANSLATIONS, _LABEL_INDEX
+    TRANSLATIONS = translations
+    _LABEL_INDEX = None
 
-        _log("Přihlášení proběhlo úspěšně.")
-        global AMCR_SESSION
-        AMCR_SESSION = session
-        return session
-
-    except requests.exceptions.HTTPError as e:
-        status = e.response.status_code if e.response is not None else None
-        _log(f"CHYBA HTTP {status if status else '?'}: "
-             f"{e.response.text[:300] if e.response is not None else 'žádná odpověď'}",
-             Qgis.MessageLevel.Critical)
-        LAST_LOGIN_ERROR = 'auth' if status in (401, 403) else 'network'
-        return None
-    except requests.exceptions.RequestException as e:
-        _log(f"CHYBA sítě: {e}", Qgis.MessageLevel.Critical)
-        LAST_LOGIN_ERROR = 'network'
-        return None
-    except ValueError:
-        # Server returned non-JSON (e.g. an HTML error page behind a proxy)
-        _log("CHYBA: server nevrátil platný JSON: "
-             f"{response.text[:300]}",
-             Qgis.MessageLevel.Critical)
-        LAST_LOGIN_ERROR = 'network'
-        return None
+
+def label_index() -> dict:
+    """
+    Returns the unified code → label index: labels of all local codelists
+    overlaid with the Digiarchiv translation dictionary. Built once and
+    rebuilt only after the translations or the codelists change.
+    """
+    global _LABEL_INDEX, _LABEL_INDEX_GENERATION
+    generation = amcr_codelists.STORE_GENERATION
+    if _LABEL_INDEX is None or _LABEL_INDEX_GENERATION != generation:
+        index = amcr_codelists.code_labels()
+        index.update(TRANSLATIONS)
+        _LABEL_INDEX = index
+        _LABEL_INDEX_GENERATION = generation
+    return _LABEL_INDEX
 
 
-def _get_session() -> requests.Session | None:
+def _read_translations_cache() -> dict | None:
     """
-    Returns the active session. If none exists (e.g. after a QGIS restart),
-    attempts automatic login using stored credentials.
-    Returns None if no credentials are stored.
+    Returns the cached translation file (dictionary and validators),
+    or None if it is missing, unreadable or of an older format. The file
+    is parsed on first use only; later calls return the parsed copy.
     """
-    global AMCR_SESSION
-    if AMCR_SESSION is not None:
-        return AMCR_SESSION
+    global _TRANSLATIONS_FILE, _TRANSLATIONS_FILE_READ
+    if not _TRANSLATIONS_FILE_READ:
+        _TRANSLATIONS_FILE = _parse_translations_cache()
+        _TRANSLATIONS_FILE_READ = True
+    return _TRANSLATIONS_FILE
+
+
+def _parse_translations_cache() -> dict | None:
+    try:
+        with open(TRANSLATIONS_CACHE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        problem = str(e)
+    else:
+        if not isinstance(cache, dict):
+            problem = "obsah není slovník"
+        else:
+            missing = [
+                key for key in ('version', 'translations')
+                if not cache.get(key)
+            ]
+            if missing:
+                problem = f"chybí klíč '{missing[0]}'"
+            elif cache['version'] != TRANSLATIONS_CACHE_VERSION:
+                problem = f"starší formát (verze {cache['version']})"
+            else:
+                return cache
+    QgsMessageLog.logMessage(
+        f"Uložený slovník {TRANSLATIONS_CACHE} nelze použít ({problem}) "
+        "– bude stažen znovu.",
+        "AMČR", Qgis.MessageLevel.Warning
+    )
+    return None
 
-    # Attempt auto-login using stored credentials
-    from .amcr_dialog import LoginDialog
-    username, password = LoginDialog.get_credentials()
-    if username and password:
-        _log("Session vypršela nebo chybí – automatické přihlášení...")
-        AMCR_SESSION = login_to_api(username, password)
 
-    return AMCR_SESSION
+def _write_translations_cache(cache: dict):
+    """Atomically replaces the cached translation file."""
+    global _TRANSLATIONS_FILE, _TRANSLATIONS_FILE_READ
+    _TRANSLATIONS_FILE = cache
+    _TRANSLATIONS_FILE_READ = True
+    ensure_codelists_dir()
+    tmp_file = TRANSLATIONS_CACHE + '.part'
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_file, TRANSLATIONS_CACHE)
+    except OSError as e:
+        QgsMessageLog.logMessage(
+            f"Slovník nelze uložit do {TRANSLATIONS_CACHE}: {e}",
+            "AMČR", Qgis.MessageLevel.Warning
+        )
 
 
-def _api_get_json(url, params, timeout=30) -> dict:
+def fetch_translations(cache: dict | None = None) -> dict | None:
     """
-    Performs a GET request and returns the parsed JSON body.
-    If the API signals an expired login, re-authenticates once and retries.
-    The body is parsed exactly once (the auth check reuses it).
-    Raises ValueError if the server does not return valid JSON.
+    Downloads the translation dictionary, revalidating the given cache
+    with If-None-Match / If-Modified-Since. Stores a changed dictionary
+    on disk and returns the up-to-date cache. Raises ValueError (or a
+    requests exception) on failure. Safe to call from a background
+    thread.
     """
-    global AMCR_SESSION
-
-    def _is_auth_error(resp: requests.Response, body) -> bool:
-        """The API returns auth errors with status 200 –
-        the body must be checked."""
-        if resp.status_code == 401:
+    headers = {}
+    if cache:
+        if cache.get('etag'):
+            headers['If-None-Match'] = cache['etag']
+        if cache.get('last_modified'):
+            headers['If-Modified-Since'] = cache['last_modified']
+
+    r = amcr_health.call(
+        requests.get, TRANSLATIONS_URL, headers=headers, timeout=10
+    )
+    if r.status_code == 304 and cache:
+        return cache
+    if r.status_code != 200:
+        raise ValueError(f"HTTP {r.status_code}")
+
+    translations = r.json()
+    if not isinstance(translations, dict):
+        raise ValueError("odpověď není slovník")
+
+    cache = {
+        'version': TRANSLATIONS_CACHE_VERSION,
+        'etag': r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+        'fetched': time.time(),
+        'translations': translations,
+    }
+    _write_translations_cache(cache)
+    return cache
+
+
+class RefreshTranslationsTask(QgsTask):
+    """Revalidates the cached translation dictionary in the background."""
+
+    def __init__(self, cache):
+        super().__init__("Aktualizace slovníku AMČR", QgsTask.Silent)
+        self.cache = cache
+        self.result_cache = None
+        self.exception = None
+
+    def run(self):
+        """Runs in a background thread."""
+        try:
+            self.result_cache = fetch_translations(self.cache)
             return True
-        if not isinstance(body, dict):
+        except Exception as e:
+            self.exception = e
             return False
-        err = str(body.get("error", "")).lower()
-        return (
-            "unauthorized" in err
-            or "not logged" in err
-            or "session" in err
-        )
 
-    def _parse(resp):
-        try:
-            return resp.json()
-        except ValueError:
-            return None
-
-    session = _get_session()
-    resp = (session or requests).get(url, params=params, timeout=timeout)
-    body = _parse(resp)
-
-    if _is_auth_error(resp, body):
-        _log("Session vypršela během stahování – obnovuji přihlášení...",
-             Qgis.MessageLevel.Warning)
-        AMCR_SESSION = None  # Invalidate the old session
-        from .amcr_dialog import LoginDialog
-        username, password = LoginDialog.get_credentials()
-        if username and password:
-            AMCR_SESSION = login_to_api(username, password)
-            if AMCR_SESSION:
-                resp = AMCR_SESSION.get(url, params=params, timeout=timeout)
-                body = _parse(resp)
-            else:
-                _log("Opakované přihlášení selhalo.",
-                     Qgis.MessageLevel.Critical)
+    def finished(self, result):
+        """Runs in the main thread after run() completes."""
+        if self in _ACTIVE_TASKS:
+            _ACTIVE_TASKS.remove(self)
+        if result:
+            _set_translations(self.result_cache['translations'])
         else:
-            _log("Přihlašovací údaje nejsou uloženy – pokračuji anonymně.",
-                 Qgis.MessageLevel.Warning)
+            QgsMessageLog.logMessage(
+                f"Error downloading vocabulary: {self.exception}",
+                "AMČR", Qgis.MessageLevel.Warning
+            )
 
-    if body is None:
-        raise ValueError(
-            f"API nevrátilo platný JSON (HTTP {resp.status_code})"
-        )
-    return body
+
+def refresh_translations_async():
+    """
+    Loads the translation dictionary from the disk cache (if not loaded
+    yet) and revalidates it against the server in a background task.
+    Called when the filter dialog opens, so that the dictionary is ready
+    before the download starts.
+    """
+    global _TRANSLATIONS_REVALIDATED
+
+    cache = _read_translations_cache()
+    if not TRANSLATIONS and cache:
+        _set_translations(cache['translations'])
+
+    if _TRANSLATIONS_REVALIDATED:
+        return
+    _TRANSLATIONS_REVALIDATED = True
+
+    task = RefreshTranslationsTask(cache)
+    _ACTIVE_TASKS.append(task)
+    QgsApplication.taskManager().addTask(task)
 
 
 def load_translations():
     """
-    Fetches the official Czech translation dictionary
-    from the Digiarchive API.
+    Makes the official Czech translation dictionary available.
+
+    The on-disk copy is used when present (revalidated in the
+    background); only the very first run without any cached copy
+    downloads the dictionary synchronously.
     """
-    global TRANSLATIONS
+    global _TRANSLATIONS_REVALIDATED
     if TRANSLATIONS:
         return
 
-    url = "https://digiarchiv.aiscr.cz/api/assets/i18n/cs.json"
+    cache = _read_translations_cache()
+    if cache:
+        _set_translations(cache['translations'])
+        refresh_translations_async()
+        return
+
     try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            TRANSLATIONS = r.json()
+        cache = fetch_translations()
+        if cache:
+            _set_translations(cache['translations'])
+            # Just downloaded – no revalidation needed in this session
+            _TRANSLATIONS_REVALIDATED = True
     except Exception as e:
         QgsMessageLog.logMessage(
             f"Error downloading vocabulary: {e}",
@@ -207,14 +419,156 @@ def load_translations():
         )
 
 
-def tr_code(code):
+def tr_code(code, labels=None):
     """
     Translates a technical code into a human-readable string
-    using the global cache.
+    using the unified label index (no network access).
+
+    Code running outside the main thread passes labels, a label_index()
+    taken in the main thread: the index may be dropped and rebuilt
+    there at any time (e.g. when new translations arrive).
     """
     if not code:
         return ""
-    return TRANSLATIONS.get(code, code)
+    if labels is None:
+        labels = label_index()
+    return labels.get(code, code)
+
+
+def build_spatial_index(layer):
+    """Builds a spatial index, if the layer's provider supports it."""
+    try:
+        provider = layer.dataProvider()
+        caps = provider.capabilities()
+    except RuntimeError:
+        return  # Layer was removed before the deferred call ran
+
+    if caps & Qgis.VectorProviderCapability.CreateSpatialIndex:
+        provider.createSpatialIndex()
+
+
+class LayerKeys:
+    """
+    Key index of an output layer, kept in Python because the memory
+    provider has no attribute indexes: feature key (see feature_key)
+    → fid and record ident → fids. Used by upsert_features and
+    replace_records to find features without scanning the layer.
+    """
+
+    def __init__(self, layer, typ_dat, komponenty="false"):
+        self.komponenty = komponenty
+        self.record_field = layer.fields().indexOf(typ_dat)
+        self.by_key = {}     # feature key → fid
+        self.by_record = {}  # record ident → fids
+        self._fid_keys = {}  # fid → (feature key, record ident)
+        self.add(layer.getFeatures())
+
+    def __len__(self):
+        return len(self._fid_keys)
+
+    def add(self, feats):
+        """Indexes added features (with the fids assigned by the layer)."""
+        for feat in feats:
+            fid = feat.id()
+            key = feature_key(feat, self.komponenty)
+            record = feat.attributes()[self.record_field]
+            self.by_key[key] = fid
+            self.by_record.setdefault(record, set()).add(fid)
+            self._fid_keys[fid] = (key, record)
+
+    def remove(self, fids):
+        """Drops deleted features from the index."""
+        for fid in fids:
+            key, record = self._fid_keys.pop(fid)
+            self.by_key.pop(key, None)
+            record_fids = self.by_record[record]
+            record_fids.discard(fid)
+            if not record_fids:
+                del self.by_record[record]
+
+
+def layer_keys(layer, typ_dat, komponenty="false") -> LayerKeys:
+    """
+    Returns the key index of an output layer, built on first use.
+    An index whose size no longer matches the layer (features added or
+    deleted by hand) is rebuilt; indexes of removed layers are dropped.
+    """
+    keys = _LAYER_KEYS.get(layer.id())
+    if keys is None or len(keys) != layer.featureCount():
+        project_layers = QgsProject.instance().mapLayers()
+        for layer_id in list(_LAYER_KEYS):
+            if layer_id not in project_layers:
+                del _LAYER_KEYS[layer_id]
+        keys = LayerKeys(layer, typ_dat, komponenty)
+        _LAYER_KEYS[layer.id()] = keys
+    return keys
+
+
+def build_layer_indexes(layer, typ_dat, komponenty="false"):
+    """Builds the spatial index and the key index of an output layer."""
+    build_spatial_index(layer)
+    try:
+        layer_keys(layer, typ_dat, komponenty)
+    except RuntimeError:
+        return  # Layer was removed before the deferred call ran
+
+
+def geometry_levels(suffix, geom) -> list:
+    """
+    Returns the simplified geometry levels of a PIAN (WKB per entry of
+    SIMPLIFY_LEVELS). Each level simplifies the previous one. A level is
+    None for points and where simplifying removes no vertex or nothing
+    is left (tiny polygons) – the full geometry is drawn instead.
+
+    The levels are built once per PIAN (see iter_features); the
+    features of its rows hold the same QByteArray, which Qt shares
+    instead of copying.
+    """
+    if suffix not in ("Polygony", "Linie"):
+        return [None] * len(SIMPLIFY_LEVELS)
+    levels = []
+    vertices = geom.constGet().nCoordinates()
+    for _, tolerance, _ in SIMPLIFY_LEVELS:
+        simple = geom.simplify(tolerance)
+        if simple.isEmpty() or simple.constGet().nCoordinates() >= vertices:
+            levels.append(None)
+            continue
+        levels.append(simple.asWkb())
+        geom = simple
+        vertices = simple.constGet().nCoordinates()
+    return levels
+
+
+def setup_geometry_levels(layer, suffix):
+    """
+    Draws a polygon/line layer with the simplified geometry level of the
+    map scale (see SIMPLIFY_LEVELS): a rule-based renderer with one
+    scale range per level, whose symbols draw the level's stored
+    geometry through a geometry generator. Identification, selection and
+    the spatial index use the full geometry.
+    """
+    symbol_class = QgsFillSymbol if suffix == "Polygony" else QgsLineSymbol
+    base = QgsSymbol.defaultSymbol(layer.geometryType())
+
+    root = QgsRuleBasedRenderer.Rule(None)
+    # Full detail closer in than the first level
+    root.appendChild(QgsRuleBasedRenderer.Rule(
+        base.clone(), 0, SIMPLIFY_LEVELS[0][2], "", "Plný detail"
+    ))
+    for i, (field, _, scale) in enumerate(SIMPLIFY_LEVELS):
+        generator = QgsGeometryGeneratorSymbolLayer.create({
+            "geometryModifier":
+                f'coalesce(geom_from_wkb("{field}"), $geometry)',
+        })
+        generator.setSubSymbol(base.clone())
+        next_scale = (
+            SIMPLIFY_LEVELS[i + 1][2] if i + 1 < len(SIMPLIFY_LEVELS) else 0
+        )
+        root.appendChild(QgsRuleBasedRenderer.Rule(
+            symbol_class([generator]), scale, next_scale, "",
+            f"Zjednodušeno (1:{scale:,})".replace(",", " ")
+        ))
+    layer.setRenderer(QgsRuleBasedRenderer(root))
 
 
 def komp_projde_filtrem(komp, filter_areal, filter_datace, filters):
@@ -230,738 +584,1416 @@ def komp_projde_filtrem(komp, filter_areal, filter_datace, filters):
     return True
 
 
-def load_amcr_data(canvas, bb, filters=None,
-                   typ_dat="akce", komponenty="false"):
+def canvas_extent_wgs(canvas):
     """
-    Main processing function:
-    1. Determines search area (Bounding Box)
-    2. Fetches metadata and geometries from API
-    3. Creates QGIS memory layers and populates them with features
+    Returns the current map extent transformed from the project CRS
+    (usually S-JTSK) to WGS-84.
     """
-    global _LOADING
-    if _LOADING:
-        iface.messageBar().pushMessage(
-            "AMCR",
-            "Stahování již probíhá, počkejte na jeho dokončení.",
-            level=Qgis.MessageLevel.Warning
-        )
-        return
-    _LOADING = True
-
-    load_translations()
-
-    # --- 1. COORDINATE TRANSFORMATION ---
-    # Get current map extent and transform it
-    # from project CRS (usually S-JTSK) to WGS-84 for the API
     extent = canvas.extent()
     crs_src = canvas.mapSettings().destinationCrs()
     crs_dest = QgsCoordinateReferenceSystem("EPSG:4326")
     xform = QgsCoordinateTransform(crs_src, crs_dest, QgsProject.instance())
-    extent_wgs = xform.transformBoundingBox(extent)
+    return xform.transformBoundingBox(extent)
 
-    # Format the bounding box string as required by the API:
-    # minLat,minLon,maxLat,maxLon
-    bbox_str = (
+
+def bbox_param(extent_wgs) -> str:
+    """
+    Formats a WGS-84 rectangle as required by the API:
+    minLat,minLon,maxLat,maxLon
+    """
+    return (
         f"{extent_wgs.yMinimum()},{extent_wgs.xMinimum()},"
         f"{extent_wgs.yMaximum()},{extent_wgs.xMaximum()}"
     )
 
-    url = "https://digiarchiv.aiscr.cz/api/search/query"
 
-    iface.messageBar().pushMessage(
-        "AMCR",
-        "Hledám záznamy...",
-        level=Qgis.MessageLevel.Info
-    )
-    QApplication.setOverrideCursor(QCursor(Qt.CursorShape.WaitCursor))
+def build_search_params(typ_dat, filters=None, bbox_str=None) -> dict:
+    """Builds the search query parameters for records of one entity."""
+    base_params = {
+        "mapa": "true",
+        "sort": "ident_cely asc",
+        "entity": typ_dat
+    }
 
-    try:
-        # ==========================================
-        # A) METADATA FETCHING (Fieldwork/Site)
-        # ==========================================
+    # Restrict search to the given area
+    if bbox_str:
+        base_params["loc_rpt"] = bbox_str
 
-        base_params = {
-            "mapa": "true",
-            "sort": "ident_cely asc",
-            "entity": typ_dat
-        }
+    # Apply multi-select filters from the dialog using
+    # the ':or' syntax required by the API
+    if filters:
+        for key, value in filters.items():
+            if not value:
+                continue
+            if isinstance(value, list):
+                base_params[key] = [f"{v}:or" for v in value]
+            else:
+                base_params[key] = str(value).strip()
 
-        # Restrict search to map window if requested
-        if bb == "true":
-            base_params["loc_rpt"] = bbox_str
+    return base_params
 
-        # Apply multi-select filters from the dialog using
-        # the ':or' syntax required by the API
-        if filters:
-            for key, value in filters.items():
-                if not value:
-                    continue
-                if isinstance(value, list):
-                    base_params[key] = [f"{v}:or" for v in value]
-                else:
-                    base_params[key] = str(value).strip()
-
-        docs = []
-        current_page = 0
-        BATCH_DOCS = 500   # Records per API request
-        MAX_LIMIT = 20000  # Safety limit to prevent QGIS from freezing
-
-        seen_ids = set()
-        fetched_total = 0  # All downloaded records incl. duplicates
-        target_pian_ids_count = 0
-
-        # Check if we should skip negative results based on filter
-        skip_negativni = (
-            filters.get('posevidence') == 'true'
-            if filters
-            else False
-        )
 
-        # Check whether we should filter results based on component filters
-        filter_areal = "f_areal" in filters if filters else False
-        filter_datace = "f_obdobi" in filters if filters else False
+def plan_queries(base_params) -> list:
+    """
+    Splits a query whose multi-select filters are too long for one
+    request. Lists of more than MAX_OR_VALUES values are cut into
+    chunks, and one sub-query is made per combination of chunks; the
+    union of their results equals the result of the original query.
+
+    The longest list is always split. Further lists are split only while
+    the number of combinations stays within MAX_SUB_QUERIES; the others
+    are sent whole (which POST queries allow).
+    """
+    long_lists = sorted(
+        (
+            (key, value) for key, value in base_params.items()
+            if isinstance(value, list) and len(value) > MAX_OR_VALUES
+        ),
+        key=lambda item: len(item[1]),
+        reverse=True
+    )
+    split = {}
+    count = 1
+    for key, value in long_lists:
+        chunks = [
+            value[i: i + MAX_OR_VALUES]
+            for i in range(0, len(value), MAX_OR_VALUES)
+        ]
+        if split and count * len(chunks) > MAX_SUB_QUERIES:
+            QgsMessageLog.logMessage(
+                f"Filtr {key} ({len(value)} hodnot) se nedělí – dílčích "
+                f"dotazů by bylo víc než {MAX_SUB_QUERIES}.",
+                "AMČR", Qgis.MessageLevel.Warning
+            )
+            continue
+        split[key] = chunks
+        count *= len(chunks)
+    if not split:
+        return [base_params]
+    return [
+        {**base_params, **dict(zip(split, chunks))}
+        for chunks in itertools.product(*split.values())
+    ]
+
+
+def fetch_records(base_params, max_limit=MAX_LIMIT, pump_events=True,
+                  client=None):
+    """
+    A) METADATA FETCHING (Fieldwork/Site)
+
+    Downloads all records of the query. Returns
+    (docs, network_error, limit_reached); network_error is set when
+    a network error interrupted the download.
+    pump_events=False must be used outside the main thread.
+    client: the AmcrClient to send the requests with (default: the
+    plugin's own).
+
+    Queries with oversized filter lists are split (see plan_queries);
+    the sub-queries run concurrently and their records are merged,
+    without duplicates, in ident_cely order like a single query.
+    """
+    queries = plan_queries(base_params)
+    if len(queries) == 1:
+        return _fetch_pages(base_params, max_limit, pump_events, client)
+
+    QgsMessageLog.logMessage(
+        f"Dlouhý výběr ve filtru – dotaz rozdělen na {len(queries)} "
+        "dílčích dotazů.",
+        "AMČR", Qgis.MessageLevel.Info
+    )
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_QUERIES) as pool:
+        futures = [
+            pool.submit(_fetch_pages, query, max_limit, False, client)
+            for query in queries
+        ]
+        if pump_events:
+            _wait_pumping(futures)
+        results = [f.result() for f in futures]
+
+    merged = {}
+    for docs, _, _ in results:
+        for doc in docs:
+            merged.setdefault(doc.get('ident_cely'), doc)
+    docs = [merged[ident] for ident in sorted(merged)]
+    network_error = any(r[1] for r in results)
+    limit_reached = any(r[2] for r in results) or len(docs) > max_limit
+    return docs[:max_limit], network_error, limit_reached
 
-        # Set when a network error interrupts the download – the user
-        # gets an explicit error/warning instead of a silent partial result
-        network_error = False
 
-        # --- API PAGINATION LOOP ---
-        while True:
-            base_params['rows'] = BATCH_DOCS
-            if current_page > 0:
-                base_params['page'] = current_page
-            elif 'page' in base_params:
-                del base_params['page']
+def _is_cursor_error(resp_json) -> bool:
+    """Whether an error response rejects the cursor itself."""
+    error = resp_json.get('error')
+    return bool(error) and 'cursor' in json.dumps(error).lower()
 
-            try:
-                resp_json = _api_get_json(url, params=base_params, timeout=30)
-                data = resp_json.get('response', {})
-                batch_docs = data.get('docs', [])
-                num_found = data.get('numFound', 0)
 
-                if not batch_docs:
-                    break
+def _fetch_pages(base_params, max_limit=MAX_LIMIT, pump_events=True,
+                 client=None):
+    """
+    Pages through the search endpoint for a single query.
+
+    Pages are requested with a cursor (cursorMark on the unique
+    ident_cely sort), so deep pages cost the server no more than the
+    first one and records changing meanwhile are neither skipped nor
+    repeated. If the API ignores the cursor or rejects it with
+    a cursor error, the download continues with page=N offsets; the
+    client remembers the answer (AmcrClient.cursor_paging).
+    """
+    client = client or amcr_session.DEFAULT_CLIENT
+    base_params = dict(base_params)
+    docs = []
+    current_page = 0
+    use_cursor = client.cursor_paging is not False
+    cursor = "*"
+
+    def offset_paging():
+        nonlocal use_cursor
+        use_cursor = False
+        client.learn('cursor_paging', False)
+        QgsMessageLog.logMessage(
+            "API nepodporuje stránkování kurzorem – "
+            "použito stránkování po stranách.",
+            "AMČR", Qgis.MessageLevel.Info
+        )
 
-                fetched_total += len(batch_docs)
-
-                # Filter out duplicates and append to main list
-                new_docs = []
-                for d in batch_docs:
-                    ident = d.get('ident_cely')
-                    if ident and ident not in seen_ids:
-                        seen_ids.add(ident)
-                        new_docs.append(d)
-
-                docs.extend(new_docs)
-                QgsMessageLog.logMessage(
-                    f"Strana {current_page} stažena. "
-                    f"Celkem záznamů: {len(docs)} / {num_found}",
-                    "AMČR", Qgis.MessageLevel.Info
-                )
+    seen_ids = set()
+    fetched_total = 0  # All downloaded records incl. duplicates
+    network_error = False
+    limit_reached = False
+
+    # --- API PAGINATION LOOP ---
+    while True:
+        base_params['rows'] = BATCH_DOCS
+        base_params.pop('page', None)
+        base_params.pop('cursorMark', None)
+        if use_cursor:
+            base_params['cursorMark'] = cursor
+        elif current_page > 0:
+            base_params['page'] = current_page
 
-                # Compare downloaded (not unique) records against numFound –
-                # pages full of duplicates would otherwise trigger
-                # needless extra requests
-                if fetched_total >= num_found:
-                    break
-                if len(docs) >= MAX_LIMIT:
-                    iface.messageBar().pushMessage(
-                        "AMCR",
-                        f"Limit {MAX_LIMIT} záznamů dosažen.",
-                        level=Qgis.MessageLevel.Warning
+        try:
+            resp_json = _api_query_json(
+                SEARCH_URL, params=base_params, timeout=30, client=client
+            )
+            next_cursor = resp_json.get('nextCursorMark')
+            if use_cursor and next_cursor is None:
+                if 'response' in resp_json:
+                    # The server ignored the cursor – this is the
+                    # first offset page
+                    offset_paging()
+                elif _is_cursor_error(resp_json):
+                    # The cursor was rejected – ask again without it
+                    offset_paging()
+                    continue
+                else:
+                    raise ValueError(
+                        f"API vrátilo chybu: {resp_json.get('error')}"
                     )
-                    break
+            elif use_cursor:
+                client.learn('cursor_paging', True)
+            data = resp_json.get('response', {})
+            batch_docs = data.get('docs', [])
+            num_found = data.get('numFound', 0)
 
-                current_page += 1
-                QApplication.processEvents()  # Keep UI responsive
+            if not batch_docs:
+                break
 
-            except requests.exceptions.RequestException as e:
-                network_error = True
-                QgsMessageLog.logMessage(
-                    f"Chyba sítě při stránkování na straně "
-                    f"{current_page}: {e}",
-                    "AMČR", Qgis.MessageLevel.Critical
-                )
+            fetched_total += len(batch_docs)
+
+            # Filter out duplicates and append to main list
+            new_docs = []
+            for d in batch_docs:
+                ident = d.get('ident_cely')
+                if ident and ident not in seen_ids:
+                    seen_ids.add(ident)
+                    new_docs.append(d)
+
+            docs.extend(new_docs)
+            QgsMessageLog.logMessage(
+                f"Strana {current_page} stažena. "
+                f"Celkem záznamů: {len(docs)} / {num_found}",
+                "AMČR", Qgis.MessageLevel.Info
+            )
+
+            # Compare downloaded (not unique) records against numFound –
+            # pages full of duplicates would otherwise trigger
+            # needless extra requests
+            if fetched_total >= num_found:
                 break
-            except Exception as e:
-                QgsMessageLog.logMessage(
-                    f"Chyba při stránkování na straně {current_page}: {e}",
-                    "AMČR", Qgis.MessageLevel.Warning
-                )
+            if len(docs) >= max_limit:
+                limit_reached = True
                 break
+            if use_cursor:
+                # An unchanged cursor marks the end of the result
+                if next_cursor == cursor:
+                    break
+                cursor = next_cursor
 
-        if network_error and not docs:
-            iface.messageBar().pushMessage(
-                "AMCR",
-                "Stahování selhalo: chyba sítě. "
-                "Zkontrolujte připojení k internetu.",
-                level=Qgis.MessageLevel.Critical
-            )
-            return
+            current_page += 1
+            if pump_events:
+                QApplication.processEvents()  # Keep UI responsive
 
-        if not docs:
-            iface.messageBar().pushMessage(
-                "AMCR",
-                "Žádné záznamy nenalezeny.",
-                level=Qgis.MessageLevel.Warning
+        except requests.exceptions.RequestException as e:
+            network_error = True
+            QgsMessageLog.logMessage(
+                f"Chyba sítě při stránkování na straně "
+                f"{current_page}: {e}",
+                "AMČR", Qgis.MessageLevel.Critical
             )
-            return
+            break
+        except Exception as e:
+            QgsMessageLog.logMessage(
+                f"Chyba při stránkování na straně {current_page}: {e}",
+                "AMČR", Qgis.MessageLevel.Warning
+            )
+            break
 
-        # ==========================================
-        # B) ATTRIBUTE PARSING
-        # ==========================================
+    return docs, network_error, limit_reached
 
-        # pian_lookup maps a Geometry ID (PIAN)
-        # to a list of its associated metadata
-        pian_lookup = {}
-        target_pian_ids = set()
-        actions_with_geom = 0
-
-        # Helper: safely extract a single value
-        def g(doc, key, default=""):
-            val = doc.get(key)
-            if isinstance(val, list):
-                return str(val[0]) if val else default
-            return str(val) if val is not None else default
-
-        # Helper: safely extract and join a list of values
-        def g_list(doc, key, translate=False):
-            val = doc.get(key, [])
-            if not isinstance(val, list):
-                val = [val] if val else []
-            if translate:
-                return ", ".join([tr_code(str(x)) for x in val if x])
-            return ", ".join([str(x) for x in val if x])
-
-        # Process each downloaded metadata record
-        for doc in docs:
-            piani = doc.get('az_dj_pian', [])
-            if not piani:
+
+def parse_records(docs, typ_dat, filters=None, komponenty="false",
+                  labels=None):
+    """
+    B) ATTRIBUTE PARSING
+
+    Extracts the attributes of the downloaded records and links them to
+    their geometries. Returns (pian_lookup, actions_with_geom,
+    feature_count); pian_lookup maps a PIAN ID to the attribute rows of
+    every feature that will be drawn with that geometry. A row is built
+    once per documentation unit (or component) in the final column order
+    of layer_fields, without the three leading PIAN columns.
+    labels as in tr_code.
+    """
+    # Check if we should skip negative results based on filter
+    skip_negativni = (
+        filters.get('posevidence') == 'true'
+        if filters
+        else False
+    )
+
+    # Check whether we should filter results based on component filters
+    filter_areal = "f_areal" in filters if filters else False
+    filter_datace = "f_obdobi" in filters if filters else False
+    is_akce = (typ_dat == "akce")
+
+    target_pian_ids_count = 0
+
+    # pian_lookup maps a Geometry ID (PIAN)
+    # to a list of its associated metadata
+    pian_lookup = {}
+    actions_with_geom = 0
+
+    # Helper: safely extract a single value
+    def g(doc, key, default=""):
+        val = doc.get(key)
+        if isinstance(val, list):
+            return str(val[0]) if val else default
+        return str(val) if val is not None else default
+
+    # Helper: safely extract and join a list of values
+    def g_list(doc, key, translate=False):
+        val = doc.get(key, [])
+        if not isinstance(val, list):
+            val = [val] if val else []
+        if translate:
+            return ", ".join([tr_code(str(x), labels) for x in val if x])
+        return ", ".join([str(x) for x in val if x])
+
+    # Process each downloaded metadata record
+    for doc in docs:
+        piani = doc.get('az_dj_pian', [])
+        if not piani:
+            continue
+
+        actions_with_geom += 1
+
+        # Extract protected fields ('or {}' – key may hold None)
+        az_chranene = doc.get('az_chranene_udaje') or {}
+        chranene = (
+            doc.get('akce_chranene_udaje')
+            or doc.get('lokalita_chranene_udaje')
+            or {}
+        )
+
+        # Format additional cadastral areas from nested dicts
+        dalsi_kat = az_chranene.get('dalsi_katastr', [])
+        dalsi_kat_str = ""
+        if isinstance(dalsi_kat, list):
+            items = [
+                x.get('value', '') if isinstance(x, dict) else str(x)
+                for x in dalsi_kat
+            ]
+            dalsi_kat_str = ", ".join([i for i in items if i])
+
+        lokalizace = chranene.get('lokalizace_okolnosti', "")
+        lokalita_nazev = chranene.get('nazev', "")
+        lokalita_popis = chranene.get('popis', "")
+
+        # Attribute row of the record, split where the documentation
+        # unit's own columns go (final column order, see layer_fields)
+        ident_cely = doc.get('ident_cely', '')
+        row_record = [
+            g_list(doc, 'loc'),
+            ident_cely,
+            DIGIARCHIV_ID_URL + ident_cely,
+            g(doc, 'az_okres'),
+            g_list(doc, 'katastr'),
+            dalsi_kat_str,
+        ]
+        if is_akce:
+            row_record += [
+                str(lokalizace) if lokalizace else "",
+                g(doc, 'akce_hlavni_vedouci'),
+                tr_code(g(doc, 'akce_organizace'), labels),
+                tr_code(g(doc, 'akce_specifikace_data'), labels),
+                g(doc, 'akce_datum_zahajeni'),
+                g(doc, 'akce_datum_ukonceni'),
+                tr_code(g(doc, 'akce_hlavni_typ'), labels),
+                g_list(doc, 'akce_vedlejsi_typ', translate=True),
+            ]
+            # zjisteni (per DJ) comes between these
+            row_tail = [
+                "Ano" if doc.get('akce_je_nz') is True else "Ne",
+                g(doc, 'pristupnost'),
+            ]
+        else:
+            row_record += [
+                lokalita_nazev,
+                lokalita_popis,
+                tr_code(g(doc, 'lokalita_typ_lokality'), labels),
+                tr_code(g(doc, 'lokalita_druh'), labels),
+                tr_code(g(doc, 'lokalita_zachovalost'), labels),
+            ]
+            row_tail = [g(doc, 'pristupnost')]
+
+        # Documentation units (DJ) within the record
+        djs = doc.get('az_dokumentacni_jednotka', [])
+
+        for dj in djs:
+            # Skip negative evidence units if requested
+            if skip_negativni and dj.get('dj_negativni_jednotka') is True:
                 continue
 
-            actions_with_geom += 1
-
-            # Extract protected fields ('or {}' – key may hold None)
-            az_chranene = doc.get('az_chranene_udaje') or {}
-            chranene = (
-                doc.get('akce_chranene_udaje')
-                or doc.get('lokalita_chranene_udaje')
-                or {}
-            )
-
-            # Format additional cadastral areas from nested dicts
-            dalsi_kat = az_chranene.get('dalsi_katastr', [])
-            dalsi_kat_str = ""
-            if isinstance(dalsi_kat, list):
-                items = [
-                    x.get('value', '') if isinstance(x, dict) else str(x)
-                    for x in dalsi_kat
-                ]
-                dalsi_kat_str = ", ".join([i for i in items if i])
-
-            lokalizace = chranene.get('lokalizace_okolnosti', "")
-            lokalita_nazev = chranene.get('nazev', "")
-            lokalita_popis = chranene.get('popis', "")
-
-            # Core metadata structure
-            meta = {
-                "ident_cely": doc.get('ident_cely', ''),
-                "az_okres": g(doc, 'az_okres'),
-                "katastr": g_list(doc, 'katastr'),
-                "dalsi_katastr": dalsi_kat_str,
-                "pristupnost": g(doc, 'pristupnost'),
-                "loc": g_list(doc, 'loc')
-            }
+            komps = dj.get('dj_komponenta', [])
 
-            # Add entity-specific metadata
-            if typ_dat == "akce":
-                meta.update({
-                    "akce_hlavni_vedouci": g(
-                        doc,
-                        'akce_hlavni_vedouci'
-                    ),
-                    "akce_organizace": tr_code(g(
-                        doc,
-                        'akce_organizace'
-                    )),
-                    "akce_specifikace_data": tr_code(g(
-                        doc,
-                        'akce_specifikace_data'
-                    )),
-                    "akce_datum_zahajeni": g(
-                        doc,
-                        'akce_datum_zahajeni'
-                    ),
-                    "akce_datum_ukonceni": g(
-                        doc,
-                        'akce_datum_ukonceni'
-                    ),
-                    "akce_hlavni_typ": tr_code(g(
-                        doc,
-                        'akce_hlavni_typ'
-                    )),
-                    "akce_vedlejsi_typ": g_list(
-                        doc,
-                        'akce_vedlejsi_typ',
-                        translate=True
-                    ),
-                    "lokalizace_okolnosti": (
-                        str(lokalizace)
-                        if lokalizace
-                        else ""
-                    ),
-                    "akce_je_nz": (
-                        "Ano"
-                        if doc.get('akce_je_nz') is True
-                        else "Ne"
-                    ),
-                })
-
-            elif typ_dat == "lokalita":
-                meta.update({
-                    "lokalita_nazev": lokalita_nazev,
-                    "lokalita_popis": lokalita_popis,
-                    "lokalita_zachovalost": tr_code(g(
-                        doc,
-                        'lokalita_zachovalost'
-                    )),
-                    "lokalita_druh": tr_code(g(
-                        doc,
-                        'lokalita_druh'
-                    )),
-                    "lokalita_typ": tr_code(g(
-                        doc,
-                        'lokalita_typ_lokality'
-                    )),
-                })
-
-            # Documentation units (DJ) within the record
-            djs = doc.get('az_dokumentacni_jednotka', [])
-
-            for dj in djs:
-                # Skip negative evidence units if requested
-                if skip_negativni and dj.get('dj_negativni_jednotka') is True:
+            if filter_areal or filter_datace:
+                if not komps:
+                    continue
+                if not any(
+                    komp_projde_filtrem(
+                        komp, filter_areal,
+                        filter_datace, filters
+                    )
+                    for komp in komps
+                ):
                     continue
 
-                komps = dj.get('dj_komponenta', [])
+            # Link Documentation Unit to Geometry (PIAN)
+            dj_pian_value = (dj.get('dj_pian') or {}).get('id')
+            if not dj_pian_value:
+                continue
 
-                if filter_areal or filter_datace:
-                    if not komps:
-                        continue
-                    if not any(
-                        komp_projde_filtrem(
+            dj_typ = dj.get('dj_typ')
+            row = [
+                dj.get('ident_cely'),
+                dj_typ.get('value') if dj_typ else "",
+                *row_record,
+            ]
+            if is_akce:
+                row.append(
+                    "Negativní"
+                    if dj.get('dj_negativni_jednotka') is True
+                    else "Pozitivní"
+                )
+            row += row_tail
+
+            rows = pian_lookup.setdefault(dj_pian_value, [])
+            if komponenty == "true":
+                # One feature per component –
+                # all data on a single row, no relations needed
+                if komps:
+                    for komp in komps:
+                        if not komp_projde_filtrem(
                             komp, filter_areal,
                             filter_datace, filters
-                        )
-                        for komp in komps
-                    ):
-                        continue
-
-                dj_id = dj.get('ident_cely')
-                dj_typ = dj.get('dj_typ')
-
-                # Merge shared metadata with documentation unit-specific fields
-                dj_meta = {
-                    **meta,
-                    'dj_id': dj_id,
-                    'dj_typ_value': dj_typ.get('value') if dj_typ else "",
-                    'dj_negativni': (
-                        "Negativní"
-                        if dj.get('dj_negativni_jednotka') is True
-                        else "Pozitivní"
-                    )
-                }
-
-                # Link Documentation Unit to Geometry (PIAN)
-                dj_pian = dj.get('dj_pian')
-                if dj_pian:
-                    dj_pian_value = dj_pian.get('id')
-                    if dj_pian_value:
-                        target_pian_ids.add(dj_pian_value)
-                        if dj_pian_value not in pian_lookup:
-                            pian_lookup[dj_pian_value] = []
-
-                        if komponenty == "true":
-                            # One feature per component –
-                            # all data on a single row, no relations needed
-                            if komps:
-                                for komp in komps:
-                                    if not komp_projde_filtrem(
-                                        komp, filter_areal,
-                                        filter_datace, filters
-                                    ):
-                                        continue
-
-                                    komp_meta = {
-                                        **dj_meta,
-                                        'komponenta_id': komp.get(
-                                            'ident_cely',
-                                            ""
-                                            ),
-                                        'komponenta_areal': (
-                                            komp.get('komponenta_areal')
-                                            or {}
-                                        ).get('value', ""),
-                                        'komponenta_obdobi': (
-                                            komp.get('komponenta_obdobi')
-                                            or {}
-                                        ).get('value', ""),
-                                    }
-                                    pian_lookup[dj_pian_value].append(komp_meta)
-                                    target_pian_ids_count += 1
-                            else:
-                                # DJ without components — still include
-                                # with empty component fields
-                                if filter_areal or filter_datace:
-                                    continue
-
-                                empty_meta = {
-                                    **dj_meta,
-                                    'komponenta_id': "",
-                                    'komponenta_areal': "",
-                                    'komponenta_obdobi': "",
-                                }
-                                pian_lookup[dj_pian_value].append(empty_meta)
-                                target_pian_ids_count += 1
-                        else:
-                            target_pian_ids_count += 1
-                            pian_lookup[dj_pian_value].append(dj_meta)
-
-        if not target_pian_ids:
-            iface.messageBar().pushMessage(
-                "AMCR",
-                f"Nalezeno {len(docs)} záznamů, ale žádný nemá geometrii.",
-                level=Qgis.MessageLevel.Warning
-            )
-            return
+                        ):
+                            continue
+                        rows.append(row + [
+                            komp.get('ident_cely', ""),
+                            (komp.get('komponenta_areal') or {}).get(
+                                'value', ""
+                            ),
+                            (komp.get('komponenta_obdobi') or {}).get(
+                                'value', ""
+                            ),
+                        ])
+                        target_pian_ids_count += 1
+                elif not (filter_areal or filter_datace):
+                    # DJ without components — still include
+                    # with empty component fields
+                    rows.append(row + ["", "", ""])
+                    target_pian_ids_count += 1
+            else:
+                rows.append(row)
+                target_pian_ids_count += 1
 
-        # ==========================================
-        # C) GEOMETRY FETCHING (PIAN)
-        # ==========================================
-        ids_list = list(target_pian_ids)
-        total_pians = len(ids_list)
-        docs_pian = []
-        # Geometry requests are batch-processed
-        # to stay under URL length limits:
-        BATCH_PIAN = 200
+    return pian_lookup, actions_with_geom, target_pian_ids_count
 
-        iface.messageBar().pushMessage(
-            "AMCR",
-            f"Záznamů: {len(docs)} (z toho {actions_with_geom} s mapou). "
-            f"Stahuji {total_pians} unikátních geometrií, "
-            f"vykresluji {target_pian_ids_count} geometrií...",
-            level=Qgis.MessageLevel.Info
-        )
 
-        fl_pian = [
-            "ident_cely", "pian_typ",
-            "pian_chranene_udaje", "pian_presnost"
-        ]
+def fetch_pians(pian_ids, filters=None, pump_events=True, on_batch=None,
+                client=None):
+    """
+    C) GEOMETRY FETCHING (PIAN)
 
-        for i in range(0, total_pians, BATCH_PIAN):
-            batch = ids_list[i: i + BATCH_PIAN]
-            or_query = " OR ".join(batch)
-            fq_pian = f"ident_cely:({or_query})"
-
-            params_pian = {
-                "mapa": "true",
-                "entity": "pian",
-                "q": fq_pian,
-                "rows": len(batch),
-                "fl": ",".join(fl_pian)
-            }
-            try:
-                QApplication.processEvents()
-                r_json = _api_get_json(url, params=params_pian, timeout=15)
-                docs_pian.extend(r_json.get('response', {}).get('docs', []))
-            except requests.exceptions.RequestException as e:
-                # Network is down – stop immediately instead of
-                # uselessly retrying every remaining batch
-                network_error = True
-                QgsMessageLog.logMessage(
-                    f"Chyba sítě při stahování geometrií PIAN: {e}",
-                    "AMČR", Qgis.MessageLevel.Critical
-                )
-                break
-            except Exception as e:
-                QgsMessageLog.logMessage(
-                    f"Chyba PIAN: {e}",
-                    "AMČR", Qgis.MessageLevel.Warning
-                )
+    Downloads the PIAN records of the given IDs in batches.
+    Returns (docs_pian, network_error). With on_batch, every batch is
+    passed to it as soon as it arrives instead of being collected
+    (docs_pian stays empty). client as in fetch_records.
+    """
+    client = client or amcr_session.DEFAULT_CLIENT
+    ids_list = list(pian_ids)
+    total_pians = len(ids_list)
+    # Larger batches once the query is known to fit in a POST body
+    batch_size = BATCH_PIAN_POST if client.post_queries else BATCH_PIAN
+    docs_pian = []
+    network_error = False
+
+    fl_pian = [
+        "ident_cely", "pian_typ",
+        "pian_chranene_udaje", "pian_presnost"
+    ]
+
+    # The precision filter is part of the PIAN query itself, so
+    # geometries of rejected precision are never transferred.
+    # (The metadata query already carries it as f_pian_presnost.)
+    presnost_filter = (
+        filters.get('f_pian_presnost') if filters else None
+    )
+    fq_presnost = (
+        f" AND pian_presnost:({' OR '.join(presnost_filter)})"
+        if presnost_filter
+        else ""
+    )
 
-        # ==========================================
-        # D) LAYER CREATION (QGIS Memory Layers)
-        # ==========================================
+    for i in range(0, total_pians, batch_size):
+        batch = ids_list[i: i + batch_size]
+        or_query = " OR ".join(batch)
+        fq_pian = f"ident_cely:({or_query}){fq_presnost}"
 
-        archeologicky_zaznam = "Akce" if typ_dat == "akce" else "Lokalita"
+        params_pian = {
+            "mapa": "true",
+            "entity": "pian",
+            "q": fq_pian,
+            "rows": len(batch),
+            "fl": ",".join(fl_pian)
+        }
+        try:
+            if pump_events:
+                QApplication.processEvents()
+            r_json = _api_query_json(
+                SEARCH_URL, params=params_pian, timeout=15, client=client
+            )
+            batch_docs = r_json.get('response', {}).get('docs', [])
+        except requests.exceptions.RequestException as e:
+            # Network is down – stop immediately instead of
+            # uselessly retrying every remaining batch
+            network_error = True
+            QgsMessageLog.logMessage(
+                f"Chyba sítě při stahování geometrií PIAN: {e}",
+                "AMČR", Qgis.MessageLevel.Critical
+            )
+            break
+        except Exception as e:
+            QgsMessageLog.logMessage(
+                f"Chyba PIAN: {e}",
+                "AMČR", Qgis.MessageLevel.Warning
+            )
+            continue
 
-        # Initialize three layers for different geometry types (S-JTSK CRS)
-        vl_poly = QgsVectorLayer(
-            "Polygon?crs=epsg:5514",
-            f"AMCR_{archeologicky_zaznam}_Polygony",
-            "memory"
-        )
-        vl_line = QgsVectorLayer(
-            "LineString?crs=epsg:5514",
-            f"AMCR_{archeologicky_zaznam}_Linie",
-            "memory"
-        )
-        vl_point = QgsVectorLayer(
-            "Point?crs=epsg:5514",
-            f"AMCR_{archeologicky_zaznam}_Body",
-            "memory"
-        )
-        layers = [vl_poly, vl_line, vl_point]
-
-        # Define attribute table structure
-        cols = [
-            QgsField("pian", QMetaType.Type.QString),
-            QgsField("presnost", QMetaType.Type.QString),
-            QgsField("pian_typ", QMetaType.Type.QString),
-            QgsField("dj", QMetaType.Type.QString),
-            QgsField("typ_dj", QMetaType.Type.QString),
-            QgsField("definicni_body", QMetaType.Type.QString),
-            QgsField(typ_dat, QMetaType.Type.QString),
-            QgsField("odkaz_do_digiarchivu", QMetaType.Type.QString),
-            QgsField("okres", QMetaType.Type.QString),
-            QgsField("katastr", QMetaType.Type.QString),
-            QgsField("dalsi_katastry", QMetaType.Type.QString)
+        # Outside the try – an error of the consumer must not be
+        # mistaken for a failed batch
+        if on_batch is None:
+            docs_pian.extend(batch_docs)
+        else:
+            on_batch(batch_docs)
+
+    return docs_pian, network_error
+
+
+def layer_fields(typ_dat, komponenty="false"):
+    """Returns the attribute table structure of the output layers."""
+    cols = [
+        QgsField("pian", QMetaType.Type.QString),
+        QgsField("presnost", QMetaType.Type.QString),
+        QgsField("pian_typ", QMetaType.Type.QString),
+        QgsField("dj", QMetaType.Type.QString),
+        QgsField("typ_dj", QMetaType.Type.QString),
+        QgsField("definicni_body", QMetaType.Type.QString),
+        QgsField(typ_dat, QMetaType.Type.QString),
+        QgsField("odkaz_do_digiarchivu", QMetaType.Type.QString),
+        QgsField("okres", QMetaType.Type.QString),
+        QgsField("katastr", QMetaType.Type.QString),
+        QgsField("dalsi_katastry", QMetaType.Type.QString)
+    ]
+
+    # Extend table based on data type
+    if typ_dat == "akce":
+        cols += [
+            QgsField("akce_lokalizace", QMetaType.Type.QString),
+            QgsField("vedouci", QMetaType.Type.QString),
+            QgsField("organizace", QMetaType.Type.QString),
+            QgsField("specifikace_data", QMetaType.Type.QString),
+            QgsField("zahajeni", QMetaType.Type.QString),
+            QgsField("ukonceni", QMetaType.Type.QString),
+            QgsField("hlavni_typ", QMetaType.Type.QString),
+            QgsField("vedlejsi_typ", QMetaType.Type.QString),
+            QgsField("zjisteni", QMetaType.Type.QString),
+            QgsField("nahrazuje_NZ", QMetaType.Type.QString),
+        ]
+    elif typ_dat == "lokalita":
+        cols += [
+            QgsField("nazev_lokality", QMetaType.Type.QString),
+            QgsField("popis_lokality", QMetaType.Type.QString),
+            QgsField("typ_lokality", QMetaType.Type.QString),
+            QgsField("druh_lokality", QMetaType.Type.QString),
+            QgsField("zachovalost", QMetaType.Type.QString)
         ]
 
-        # Extend table based on data type
-        if typ_dat == "akce":
-            cols += [
-                QgsField("akce_lokalizace", QMetaType.Type.QString),
-                QgsField("vedouci", QMetaType.Type.QString),
-                QgsField("organizace", QMetaType.Type.QString),
-                QgsField("specifikace_data", QMetaType.Type.QString),
-                QgsField("zahajeni", QMetaType.Type.QString),
-                QgsField("ukonceni", QMetaType.Type.QString),
-                QgsField("hlavni_typ", QMetaType.Type.QString),
-                QgsField("vedlejsi_typ", QMetaType.Type.QString),
-                QgsField("zjisteni", QMetaType.Type.QString),
-                QgsField("nahrazuje_NZ", QMetaType.Type.QString),
-            ]
-        elif typ_dat == "lokalita":
-            cols += [
-                QgsField("nazev_lokality", QMetaType.Type.QString),
-                QgsField("popis_lokality", QMetaType.Type.QString),
-                QgsField("typ_lokality", QMetaType.Type.QString),
-                QgsField("druh_lokality", QMetaType.Type.QString),
-                QgsField("zachovalost", QMetaType.Type.QString)
-            ]
+    cols.append(QgsField("Přístupnost", QMetaType.Type.QString))
 
-        cols.append(QgsField("Přístupnost", QMetaType.Type.QString))
-
-        # Use aliases for technical field names
-        alias_map = {
-            "pian": "PIAN",
-            "presnost": "Přesnost",
-            "pian_typ": "PIAN – typ",
-            "dj": "Dokumentační jednotka",
-            "typ_dj": "Typ dokumentační jednotky",
-            "definicni_body": "Definiční bod(y) (WGS-84)",
-            typ_dat: archeologicky_zaznam,
-            "odkaz_do_digiarchivu": "Odkaz do Digitálního archivu AMČR",
-            "okres": "Okres",
-            "katastr": "Katastr",
-            "dalsi_katastry": "Další katastry",
-            "akce_lokalizace": "Akce – lokalizace",
-            "vedouci": "Vedoucí akce",
-            "organizace": "Organizace",
-            "specifikace_data": "Specifikace data",
-            "zahajeni": "Datum zahájeni",
-            "ukonceni": "Datum ukončení",
-            "hlavni_typ": "Hlavní typ",
-            "vedlejsi_typ": "Vedlejší typ",
-            "zjisteni": "Zjištění",
-            "nahrazuje_NZ": "Akce – nahrazuje NZ",
-            "nazev_lokality": "Název lokality",
-            "popis_lokality": "Popis lokality",
-            "typ_lokality": "Typ lokality",
-            "druh_lokality": "Druh lokality",
-            "zachovalost": "Zachovalost",
-            "komponenta": "Komponenta",
-            "komponenta_areal": "Areál",
-            "komponenta_obdobi": "Období",
-        }
+    if komponenty == "true":
+        cols += [
+            QgsField("komponenta", QMetaType.Type.QString),
+            QgsField("komponenta_areal", QMetaType.Type.QString),
+            QgsField("komponenta_obdobi", QMetaType.Type.QString),
+        ]
 
-        if komponenty == "true":
-            cols += [
-                QgsField("komponenta", QMetaType.Type.QString),
-                QgsField("komponenta_areal", QMetaType.Type.QString),
-                QgsField("komponenta_obdobi", QMetaType.Type.QString),
-            ]
+    return cols
 
-        for vl in layers:
-            vl.dataProvider().addAttributes(cols)
-            vl.updateFields()
-            for tech_name, alias in alias_map.items():
-                idx = vl.fields().lookupField(tech_name)
-                if idx != -1:
-                    vl.setFieldAlias(idx, alias)
 
-        # Lists to hold features before batch-adding to layers
-        feats_p, feats_l, feats_pt = [], [], []
-
-        # Transform for PIANs that only provide WGS-84 geometry (geom_wkt) –
-        # the target layers are in S-JTSK (EPSG:5514)
-        xform_wgs_to_sjtsk = QgsCoordinateTransform(
-            QgsCoordinateReferenceSystem("EPSG:4326"),
-            QgsCoordinateReferenceSystem("EPSG:5514"),
-            QgsProject.instance()
-        )
+def feature_key(feat, komponenty="false"):
+    """
+    Returns the stable identity of an output feature:
+    (pian, dj, komponenta).
+    """
+    attrs = feat.attributes()
+    # Component columns precede the geometry level columns
+    komp = -3 - len(SIMPLIFY_LEVELS)
+    return (attrs[0], attrs[3], attrs[komp] if komponenty == "true" else "")
 
-        # --- FEATURE POPULATION ---
-        for doc in docs_pian:
-            try:
-                pid = doc.get('ident_cely', '')
-                if pid not in pian_lookup:
-                    continue
 
-                metas = pian_lookup[pid]
+def create_layers(typ_dat, komponenty="false", name_suffix="",
+                  suffixes=None):
+    """
+    D) LAYER CREATION (QGIS Memory Layers)
 
-                # Extract WKT geometry from protected JSON data
-                raw = doc.get('pian_chranene_udaje')
-                if isinstance(raw, list) and raw:
-                    raw = raw[0]
-                jdata = (
-                    json.loads(raw)
-                    if isinstance(raw, str)
-                    else (raw or {})
-                )
+    Creates empty output layers with the attribute table structure,
+    keyed by the layer name suffix ('Polygony', 'Linie', 'Body') –
+    all three, or only those listed in suffixes.
+    """
+    archeologicky_zaznam = "Akce" if typ_dat == "akce" else "Lokalita"
 
-                wkt = None
-                wkt_is_wgs = False
-                if jdata.get('geom_sjtsk_wkt'):
-                    wkt = jdata.get('geom_sjtsk_wkt', {}).get('value')
-                elif jdata.get('geom_wkt'):
-                    # Fallback geometry is in WGS-84 and must be
-                    # transformed to S-JTSK before use
-                    wkt = jdata.get('geom_wkt', {}).get('value')
-                    wkt_is_wgs = True
-
-                # The API may return the value as a single-item list –
-                # normalize before comparing against filter codes
-                raw_presnost = doc.get('pian_presnost', '')
-                if isinstance(raw_presnost, list):
-                    raw_presnost = raw_presnost[0] if raw_presnost else ''
-                raw_typ = doc.get('pian_typ', '')
-                if isinstance(raw_typ, list):
-                    raw_typ = raw_typ[0] if raw_typ else ''
-
-                pian_presnost = tr_code(str(raw_presnost))
-                pian_typ = tr_code(str(raw_typ))
-
-                # Final precision filter check
-                if (
-                    filters
-                    and filters.get('f_pian_presnost')
-                    and str(raw_presnost)
-                    not in filters.get('f_pian_presnost')
-                ):
-                    continue
+    # Initialize three layers for different geometry types (S-JTSK CRS)
+    layers = {
+        n: QgsVectorLayer(
+            f"{geom}?crs=epsg:5514",
+            f"AMCR_{archeologicky_zaznam}_{n}{name_suffix}",
+            "memory"
+        )
+        for geom, n in LAYER_GEOMETRIES
+        if suffixes is None or n in suffixes
+    }
+
+    # Detailed polygons and lines are drawn simplified when zoomed out
+    for n in ("Polygony", "Linie"):
+        if n in layers:
+            setup_geometry_levels(layers[n], n)
+
+    # The geometry levels (see iter_features) follow the attributes
+    # of the record, hidden from forms and the attribute table
+    level_fields = [field for field, _, _ in SIMPLIFY_LEVELS]
+    cols = layer_fields(typ_dat, komponenty) + [
+        QgsField(field, QMetaType.Type.QByteArray) for field in level_fields
+    ]
+
+    # Use aliases for technical field names
+    alias_map = {
+        "pian": "PIAN",
+        "presnost": "Přesnost",
+        "pian_typ": "PIAN – typ",
+        "dj": "Dokumentační jednotka",
+        "typ_dj": "Typ dokumentační jednotky",
+        "definicni_body": "Definiční bod(y) (WGS-84)",
+        typ_dat: archeologicky_zaznam,
+        "odkaz_do_digiarchivu": "Odkaz do Digitálního archivu AMČR",
+        "okres": "Okres",
+        "katastr": "Katastr",
+        "dalsi_katastry": "Další katastry",
+        "akce_lokalizace": "Akce – lokalizace",
+        "vedouci": "Vedoucí akce",
+        "organizace": "Organizace",
+        "specifikace_data": "Specifikace data",
+        "zahajeni": "Datum zahájeni",
+        "ukonceni": "Datum ukončení",
+        "hlavni_typ": "Hlavní typ",
+        "vedlejsi_typ": "Vedlejší typ",
+        "zjisteni": "Zjištění",
+        "nahrazuje_NZ": "Akce – nahrazuje NZ",
+        "nazev_lokality": "Název lokality",
+        "popis_lokality": "Popis lokality",
+        "typ_lokality": "Typ lokality",
+        "druh_lokality": "Druh lokality",
+        "zachovalost": "Zachovalost",
+        "komponenta": "Komponenta",
+        "komponenta_areal": "Areál",
+        "komponenta_obdobi": "Období",
+    }
+
+    for vl in layers.values():
+        vl.dataProvider().addAttributes(cols)
+        vl.updateFields()
+        for tech_name, alias in alias_map.items():
+            idx = vl.fields().lookupField(tech_name)
+            if idx != -1:
+                vl.setFieldAlias(idx, alias)
+        for field in level_fields:
+            vl.setEditorWidgetSetup(
+                vl.fields().lookupField(field),
+                QgsEditorWidgetSetup("Hidden", {})
+            )
+        config = vl.attributeTableConfig()
+        columns = config.columns()
+        for column in columns:
+            column.hidden = column.name in level_fields
+        config.setColumns(columns)
+        vl.setAttributeTableConfig(config)
 
-                if wkt:
-                    geom = QgsGeometry.fromWkt(wkt)
-                    if geom.isNull():
-                        continue
-                    if wkt_is_wgs:
-                        geom.transform(xform_wgs_to_sjtsk)
-                    if not geom.isGeosValid():
-                        # Try to repair (e.g. self-intersections)
-                        # instead of silently dropping the feature
-                        geom = geom.makeValid()
-                    if geom.isGeosValid():
-                        t = geom.type()
-                        target_list = None
-                        if t == QgsWkbTypes.PolygonGeometry:
-                            target_list = feats_p
-                        elif t == QgsWkbTypes.LineGeometry:
-                            target_list = feats_l
-                        elif t == QgsWkbTypes.PointGeometry:
-                            target_list = feats_pt
-
-                        if target_list is None:
-                            continue
+    return layers
 
-                        is_akce = (typ_dat == "akce")
-
-                        # Create a QGIS feature for each documentation unit
-                        # associated with this geometry
-                        for meta in metas:
-                            feat = QgsFeature()
-                            feat.setGeometry(geom)
-                            atributy = [
-                                pid,
-                                pian_presnost,
-                                pian_typ,
-                                meta['dj_id'],
-                                meta['dj_typ_value'],
-                                meta['loc'],
-                                meta['ident_cely'],
-                                "https://digiarchiv.aiscr.cz/id/"
-                                + meta['ident_cely'],
-                                meta['az_okres'],
-                                meta['katastr'],
-                                meta['dalsi_katastr']
-                            ]
-                            if is_akce:
-                                atributy.extend([
-                                    meta['lokalizace_okolnosti'],
-                                    meta['akce_hlavni_vedouci'],
-                                    meta['akce_organizace'],
-                                    meta['akce_specifikace_data'],
-                                    meta['akce_datum_zahajeni'],
-                                    meta['akce_datum_ukonceni'],
-                                    meta['akce_hlavni_typ'],
-                                    meta['akce_vedlejsi_typ'],
-                                    meta['dj_negativni'],
-                                    meta['akce_je_nz']
-                                ])
-                            else:
-                                atributy.extend([
-                                    meta['lokalita_nazev'],
-                                    meta['lokalita_popis'],
-                                    meta['lokalita_typ'],
-                                    meta['lokalita_druh'],
-                                    meta['lokalita_zachovalost']
-                                ])
-
-                            atributy.append(meta['pristupnost'])
-
-                            if komponenty == "true":
-                                atributy.extend([
-                                    meta.get('komponenta_id', ""),
-                                    meta.get('komponenta_areal', ""),
-                                    meta.get('komponenta_obdobi', ""),
-                                ])
-
-                            feat.setAttributes(atributy)
-                            target_list.append(feat)
-
-            except Exception as ex:
-                QgsMessageLog.logMessage(
-                    f"Chyba při tvorbě feature: {ex}",
-                    "AMČR", Qgis.MessageLevel.Warning
-                )
 
-# --- ADDING TO QGIS INTERFACE ---
-        proj = QgsProject.instance()
-        added = 0
-        layers_to_process = [
-            (feats_p, vl_poly, "Polygony"),
-            (feats_l, vl_line, "Linie"),
-            (feats_pt, vl_point, "Body"),
-        ]
+def parse_pian(doc, filters=None, xform_wgs_to_sjtsk=None, labels=None):
+    """
+    Extracts the geometry of a PIAN record. Returns (layer name suffix,
+    geometry, precision label, type label), or None if the PIAN has no
+    usable geometry or does not pass the precision filter. labels as in
+    tr_code.
+    """
+    # Extract WKT geometry from protected JSON data
+    raw = doc.get('pian_chranene_udaje')
+    if isinstance(raw, list) and raw:
+        raw = raw[0]
+    jdata = (
+        json.loads(raw)
+        if isinstance(raw, str)
+        else (raw or {})
+    )
 
-        for f, l, n in layers_to_process:
-            if f:
-                l.dataProvider().addFeatures(f)
-                l.updateExtents()
-                l.setName(f"AMCR_{archeologicky_zaznam}_{n}")
-                proj.addMapLayer(l)
-                added += len(f)
+    wkt = None
+    wkt_is_wgs = False
+    if jdata.get('geom_sjtsk_wkt'):
+        wkt = jdata.get('geom_sjtsk_wkt', {}).get('value')
+    elif jdata.get('geom_wkt'):
+        # Fallback geometry is in WGS-84 and must be
+        # transformed to S-JTSK before use
+        wkt = jdata.get('geom_wkt', {}).get('value')
+        wkt_is_wgs = True
+
+    # The API may return the value as a single-item list –
+    # normalize before comparing against filter codes
+    raw_presnost = doc.get('pian_presnost', '')
+    if isinstance(raw_presnost, list):
+        raw_presnost = raw_presnost[0] if raw_presnost else ''
+    raw_typ = doc.get('pian_typ', '')
+    if isinstance(raw_typ, list):
+        raw_typ = raw_typ[0] if raw_typ else ''
+
+    pian_presnost = tr_code(str(raw_presnost), labels)
+    pian_typ = tr_code(str(raw_typ), labels)
+
+    # Final precision filter check – a safety net only,
+    # the server already filtered by precision
+    if (
+        filters
+        and filters.get('f_pian_presnost')
+        and str(raw_presnost)
+        not in filters.get('f_pian_presnost')
+    ):
+        return None
+
+    if not wkt:
+        return None
+    geom = QgsGeometry.fromWkt(wkt)
+    if geom.isNull():
+        return None
+    if wkt_is_wgs:
+        if xform_wgs_to_sjtsk is None:
+            xform_wgs_to_sjtsk = QgsCoordinateTransform(
+                QgsCoordinateReferenceSystem("EPSG:4326"),
+                QgsCoordinateReferenceSystem("EPSG:5514"),
+                QgsProject.instance()
+            )
+        geom.transform(xform_wgs_to_sjtsk)
+    if not geom.isGeosValid():
+        # Try to repair (e.g. self-intersections)
+        # instead of silently dropping the feature
+        geom = geom.makeValid()
+    if not geom.isGeosValid():
+        return None
+    suffix = LAYER_SUFFIXES.get(geom.type())
+    if suffix is None:
+        return None
+    return suffix, geom, pian_presnost, pian_typ
+
+
+def iter_features(docs_pian, pian_lookup, typ_dat, komponenty="false",
+                  filters=None, parsed_pians=None, levels=True,
+                  labels=None):
+    """
+    Converts the downloaded PIANs into features – one per attribute row
+    linked to the PIAN (see parse_records). Yields (layer name suffix,
+    QgsFeature).
+
+    With levels, the simplified geometry levels of the PIAN (see
+    geometry_levels) are appended to the attributes, as the layers of
+    create_layers expect; they are computed once per PIAN.
+
+    parsed_pians may be a dict shared by several calls with the same
+    levels setting (PIAN ID → parse result), so that a PIAN used by more
+    entities is parsed only once. typ_dat and komponenty must match the
+    parse_records call that built the rows (the rows already follow
+    their column layout). labels as in tr_code.
+    """
+    # Transform for PIANs that only provide WGS-84 geometry (geom_wkt) –
+    # the target layers are in S-JTSK (EPSG:5514)
+    xform_wgs_to_sjtsk = QgsCoordinateTransform(
+        QgsCoordinateReferenceSystem("EPSG:4326"),
+        QgsCoordinateReferenceSystem("EPSG:5514"),
+        QgsProject.instance()
+    )
+
+    # --- FEATURE POPULATION ---
+    for doc in docs_pian:
+        try:
+            pid = doc.get('ident_cely', '')
+            if pid not in pian_lookup:
+                continue
+
+            rows = pian_lookup[pid]
+
+            if parsed_pians is not None and pid in parsed_pians:
+                parsed = parsed_pians[pid]
+            else:
+                parsed = parse_pian(
+                    doc, filters, xform_wgs_to_sjtsk, labels
+                )
+                if parsed is not None:
+                    parsed += (
+                        geometry_levels(parsed[0], parsed[1])
+                        if levels else [],
+                    )
+                if parsed_pians is not None:
+                    parsed_pians[pid] = parsed
+            if parsed is None:
+                continue
+            suffix, geom, pian_presnost, pian_typ, tail = parsed
+
+            # Create a QGIS feature for each documentation unit
+            # associated with this geometry – the rows are complete
+            # except for the PIAN's own columns (and the levels)
+            head = [pid, pian_presnost, pian_typ]
+            for row in rows:
+                feat = QgsFeature()
+                feat.setGeometry(geom)
+                feat.setAttributes(head + row + tail)
+                yield suffix, feat
+
+        except Exception as ex:
+            QgsMessageLog.logMessage(
+                f"Chyba při tvorbě feature: {ex}",
+                "AMČR", Qgis.MessageLevel.Warning
+            )
+
+
+def tag_layer(layer, typ_dat, komponenty, suffix):
+    """Marks a layer as the output of a download (see find_layers)."""
+    layer.setCustomProperty(LAYER_PROPERTY_PREFIX + "typ_dat", typ_dat)
+    layer.setCustomProperty(LAYER_PROPERTY_PREFIX + "komponenty", komponenty)
+    layer.setCustomProperty(LAYER_PROPERTY_PREFIX + "vrstva", suffix)
+
+
+def find_layers(typ_dat, komponenty):
+    """
+    Returns the project layers of earlier downloads with the same entity
+    and component setting, keyed by the layer name suffix. When several
+    downloads exist, the most recently added layers win.
+    """
+    found = {}
+    for layer in QgsProject.instance().mapLayers().values():
+        prop = layer.customProperty
+        if (
+            prop(LAYER_PROPERTY_PREFIX + "typ_dat") == typ_dat
+            and prop(LAYER_PROPERTY_PREFIX + "komponenty") == komponenty
+        ):
+            suffix = prop(LAYER_PROPERTY_PREFIX + "vrstva")
+            if suffix in LAYER_SUFFIXES.values():
+                found[suffix] = layer
+    return found
+
+
+def upsert_features(layer, feats, typ_dat, komponenty="false",
+                    delete_missing=True):
+    """
+    Updates the layer in place to match the given features, matched by
+    their stable key (see feature_key): new keys are added, changed
+    attributes and geometries are rewritten and – unless the result is
+    incomplete (delete_missing=False) – features missing from the result
+    are deleted. Unchanged features are not touched.
+
+    Returns the number of (added, changed, deleted) features.
+    """
+    keys = layer_keys(layer, typ_dat, komponenty)
+    unmatched = dict(keys.by_key)  # feature key → fid
+    # Record columns; the geometry levels after them follow the geometry
+    record_cols = len(layer.fields()) - len(SIMPLIFY_LEVELS)
+
+    to_add = []
+    matched = {}  # fid → new feature
+    for feat in feats:
+        fid = unmatched.pop(feature_key(feat, komponenty), None)
+        if fid is None:
+            to_add.append(feat)
+        else:
+            matched[fid] = feat
+
+    # Only the matched features are read back for comparison
+    attr_changes = {}
+    geom_changes = {}
+    request = QgsFeatureRequest().setFilterFids(list(matched))
+    for old in layer.getFeatures(request):
+        feat = matched[old.id()]
+        old_attrs = old.attributes()
+        attrs = feat.attributes()
+        changed = {
+            i: attrs[i]
+            for i in range(record_cols)
+            if old_attrs[i] != attrs[i]
+        }
+        if not old.geometry().equals(feat.geometry()):
+            geom_changes[old.id()] = feat.geometry()
+            changed.update(
+                (i, attrs[i]) for i in range(record_cols, len(attrs))
+            )
+        if changed:
+            attr_changes[old.id()] = changed
+
+    to_delete = list(unmatched.values()) if delete_missing else []
+
+    provider = layer.dataProvider()
+    if to_add:
+        _, added_feats = provider.addFeatures(to_add)
+        keys.add(added_feats)
+    if attr_changes:
+        provider.changeAttributeValues(attr_changes)
+    if geom_changes:
+        provider.changeGeometryValues(geom_changes)
+    if to_delete:
+        provider.deleteFeatures(to_delete)
+        keys.remove(to_delete)
+
+    if to_add or geom_changes or to_delete:
+        layer.updateExtents()
+    layer.triggerRepaint()
+
+    changed_fids = set(attr_changes) | set(geom_changes)
+    return len(to_add), len(changed_fids), len(to_delete)
+
+
+def record_fingerprint(doc):
+    """
+    Returns a value that changes whenever the record changes – the index
+    version – or None if the API does not provide it. Fingerprints of
+    a download and of a sync's identifier-only pass are thus of the same
+    kind.
+    """
+    version = doc.get('_version_')
+    return str(version) if version is not None else None
+
+
+def store_sync_state(layers, filters, bbox_str, docs):
+    """
+    Remembers on the output layers the query that produced them, the
+    time of the download and the fingerprints of the returned records.
+    """
+    state = json.dumps({
+        'filters': filters or {},
+        'bbox': bbox_str,
+        'synced': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'fingerprints': {
+            doc['ident_cely']: record_fingerprint(doc)
+            for doc in docs if doc.get('ident_cely')
+        },
+    }, ensure_ascii=False)
+    for layer in layers:
+        layer.setCustomProperty(LAYER_PROPERTY_PREFIX + "sync", state)
+
+
+def read_sync_state(layers):
+    """Returns the sync state stored on the layers, or None."""
+    for layer in layers:
+        try:
+            state = json.loads(
+                layer.customProperty(LAYER_PROPERTY_PREFIX + "sync") or ""
+            )
+        except (TypeError, ValueError):
+            continue
+        if isinstance(state, dict) and 'fingerprints' in state:
+            return state
+    return None
+
+
+def replace_records(layer, typ_dat, idents, feats, komponenty="false"):
+    """
+    Replaces all features of the given records (identified by the record
+    column) with the given features. Returns (added, deleted).
+    """
+    keys = layer_keys(layer, typ_dat, komponenty)
+    to_delete = [
+        fid for ident in idents for fid in keys.by_record.get(ident, ())
+    ]
+    provider = layer.dataProvider()
+    if to_delete:
+        provider.deleteFeatures(to_delete)
+        keys.remove(to_delete)
+    if feats:
+        _, added_feats = provider.addFeatures(feats)
+        keys.add(added_feats)
+    if to_delete or feats:
+        layer.updateExtents()
+        layer.triggerRepaint()
+    return len(feats), len(to_delete)
+
+
+def sync_amcr_layers(typ_dat, komponenty="false"):
+    """
+    Brings the layers of an earlier download up to date with minimal
+    transfer.
+
+    The stored query is repeated asking only for identifiers and
+    fingerprints; full metadata and geometries are then downloaded only
+    for new and changed records, and features of changed or vanished
+    records are replaced in the layers.
+    Records without a version (before or now) cannot be compared and
+    are downloaded again every time. An empty result removes all
+    records. Returns (new, changed, removed) record counts, or None if
+    there was nothing to sync or the sync failed.
+    """
+    layers = find_layers(typ_dat, komponenty)
+    state = read_sync_state(layers.values())
+    if state is None:
+        return None
+    filters = state.get('filters') or {}
+    old = state['fingerprints']
+
+    # 1. Fingerprints of the current result
+    params = build_search_params(typ_dat, filters, state.get('bbox'))
+    params['fl'] = SYNC_FIELDS
+    light_docs, network_error, limit_reached = fetch_records(params)
+    if network_error:
+        # An unknown result must not remove anything
+        return None
+    current = {
+        doc['ident_cely']: record_fingerprint(doc)
+        for doc in light_docs if doc.get('ident_cely')
+    }
+
+    new = [i for i in current if i not in old]
+    changed = [
+        i for i in current
+        if i in old and (old[i] is None or old[i] != current[i])
+    ]
+    if any(v is None for v in current.values()):
+        QgsMessageLog.logMessage(
+            "API nevrací verze záznamů – záznamy bez verze "
+            "synchronizace stáhne znovu celé.",
+            "AMČR", Qgis.MessageLevel.Warning
+        )
+    removed = [] if limit_reached else [i for i in old if i not in current]
+
+    # 2. Full metadata of new and changed records, in batches of
+    # identifiers to stay under URL length limits (larger with POST)
+    docs = []
+    to_fetch = new + changed
+    batch_size = (
+        BATCH_PIAN_POST if amcr_session.DEFAULT_CLIENT.post_queries
+        else BATCH_PIAN
+    )
+    for i in range(0, len(to_fetch), batch_size):
+        batch = to_fetch[i: i + batch_size]
+        batch_params = build_search_params(typ_dat, filters)
+        batch_params['q'] = f"ident_cely:({' OR '.join(batch)})"
+        batch_docs, network_error, _ = fetch_records(batch_params)
+        if network_error:
+            return None
+        docs.extend(batch_docs)
+
+    # 3. Geometries and features of those records
+    feats = {n: [] for n in LAYER_SUFFIXES.values()}
+    if docs:
+        pian_lookup, _, _ = parse_records(docs, typ_dat, filters, komponenty)
+        docs_pian, network_error = fetch_pians(pian_lookup, filters)
+        if network_error:
+            return None
+        for suffix, feat in iter_features(
+            docs_pian, pian_lookup, typ_dat, komponenty, filters
+        ):
+            feats[suffix].append(feat)
+
+    # 4. Replace the features of touched records
+    missing = [n for n in feats if feats[n] and n not in layers]
+    if missing:
+        new_layers = create_layers(typ_dat, komponenty, suffixes=missing)
+        for n, layer in new_layers.items():
+            tag_layer(layer, typ_dat, komponenty, n)
+            QgsProject.instance().addMapLayer(layer)
+            layers[n] = layer
+
+    touched = set(to_fetch) | set(removed)
+    for n, layer in layers.items():
+        replace_records(layer, typ_dat, touched, feats[n], komponenty)
+
+    # Records beyond the limit were not seen – keep their fingerprints
+    fingerprints = dict(old) if limit_reached else {}
+    fingerprints.update(current)
+    state['fingerprints'] = fingerprints
+    state['synced'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    raw = json.dumps(state, ensure_ascii=False)
+    for layer in layers.values():
+        layer.setCustomProperty(LAYER_PROPERTY_PREFIX + "sync", raw)
+
+    return len(new), len(changed), len(removed)
+
+
+def _exclusive(busy_result=None):
+    """
+    Decorates a download entry point: it runs under the re-entrancy
+    guard (_LOADING) with the wait cursor. A call while another download
+    runs only warns and returns busy_result.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            global _LOADING
+            if _LOADING:
+                iface.messageBar().pushMessage(
+                    "AMCR",
+                    "Stahování již probíhá, počkejte na jeho dokončení.",
+                    level=Qgis.MessageLevel.Warning
+                )
+                return busy_result
+            _LOADING = True
+            QApplication.setOverrideCursor(
+                QCursor(Qt.CursorShape.WaitCursor)
+            )
+            try:
+                return func(*args, **kwargs)
+            finally:
+                # Released even after a failure
+                _LOADING = False
+                QApplication.restoreOverrideCursor()
+        return wrapper
+    return decorate
+
+
+@_exclusive()
+def sync_all_layers():
+    """
+    Synchronizes every set of AMČR layers in the project
+    (one per entity and component setting).
+    """
+
+    load_translations()
+
+    sets = []
+    for layer in QgsProject.instance().mapLayers().values():
+        key = (
+            layer.customProperty(LAYER_PROPERTY_PREFIX + "typ_dat"),
+            layer.customProperty(LAYER_PROPERTY_PREFIX + "komponenty"),
+        )
+        if key[0] and key not in sets:
+            sets.append(key)
+
+    try:
+        if not sets:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                "V projektu nejsou žádné vrstvy AMČR k synchronizaci.",
+                level=Qgis.MessageLevel.Info
+            )
+            return
+
+        totals = [0, 0, 0]
+        failed = 0
+        for typ_dat, komponenty in sets:
+            counts = sync_amcr_layers(typ_dat, komponenty)
+            if counts is None:
+                failed += 1
+                continue
+            totals = [a + b for a, b in zip(totals, counts)]
+
+        iface.messageBar().pushMessage(
+            "AMCR",
+            f"Synchronizace dokončena. Nové záznamy: {totals[0]}, "
+            f"změněné: {totals[1]}, odebrané: {totals[2]}."
+            + (f" Nezdařilo se u {failed} sad vrstev." if failed else ""),
+            level=(
+                Qgis.MessageLevel.Warning if failed
+                else Qgis.MessageLevel.Success
+            )
+        )
+    except Exception as e:
+        iface.messageBar().pushMessage(
+            "Chyba",
+            str(e),
+            level=Qgis.MessageLevel.Critical
+        )
+
+
+def publish_features(typ_dat, komponenty, feats, refresh="false",
+                     complete=True):
+    """
+    Adds the features (lists keyed by layer name suffix) to new output
+    layers in the project or – with refresh="true" – updates the layers
+    of an earlier download in place (see upsert_features).
+
+    Returns (result_layers, refreshed_layers, added, diff), where diff
+    counts the added, changed and deleted features.
+    """
+    # Layers of an earlier download to update in place
+    targets = find_layers(typ_dat, komponenty) if refresh == "true" else {}
+    # New layers only where there is something to add and no target
+    layers = create_layers(typ_dat, komponenty, suffixes=[
+        n for _, n in LAYER_GEOMETRIES if feats[n] and n not in targets
+    ])
+
+    # --- ADDING TO QGIS INTERFACE ---
+    proj = QgsProject.instance()
+    added = 0
+
+    deferred_indexes = QSettings().value(
+        DEFERRED_INDEXES_KEY, True, type=bool
+    )
+
+    result_layers = dict(targets)
+    diff = [0, 0, 0]  # added, changed, deleted
+
+    for _, n in LAYER_GEOMETRIES:
+        f = feats[n]
+        target = targets.get(n)
+        if target is not None:
+            counts = upsert_features(
+                target, f, typ_dat, komponenty, complete
+            )
+            diff = [a + b for a, b in zip(diff, counts)]
+            added += len(f)
+            continue
+        l = layers.get(n)
+        if l is not None:
+            tag_layer(l, typ_dat, komponenty, n)
+            result_layers[n] = l
+            diff[0] += len(f)
+            l.dataProvider().addFeatures(f)
+            l.updateExtents()
+            if not deferred_indexes:
+                build_layer_indexes(l, typ_dat, komponenty)
+            proj.addMapLayer(l)
+            added += len(f)
+            if deferred_indexes:
+                # Runs once control returns to the event loop,
+                # i.e. after the layer has been drawn
+                QTimer.singleShot(
+                    0,
+                    lambda layer=l: build_layer_indexes(
+                        layer, typ_dat, komponenty
+                    )
+                )
+
+    return result_layers, targets, added, diff
+
+
+def _mirror_fallback(typ_dat, filters, query_bbox):
+    """
+    Answers a query the server could not from the offline mirror.
+    Returns (docs, docs_pian), or None if the mirror holds no records of
+    the entity or cannot answer the query.
+    """
+    if not amcr_mirror.has_data(typ_dat):
+        return None
+    try:
+        return amcr_mirror.query(typ_dat, filters, query_bbox, MAX_LIMIT)
+    except amcr_mirror.MirrorError as e:
+        QgsMessageLog.logMessage(str(e), "AMČR", Qgis.MessageLevel.Warning)
+        return None
+
+
+@_exclusive()
+def load_amcr_data(canvas, bb, filters=None,
+                   typ_dat="akce", komponenty="false", refresh="false",
+                   offline="false"):
+    """
+    Main processing function:
+    1. Determines search area (Bounding Box)
+    2. Fetches metadata and geometries from API – or, with
+       offline="true", from the local mirror (see amcr_mirror)
+    3. Creates QGIS memory layers and populates them with features –
+       or, with refresh="true", updates the layers of an earlier
+       download in place
+
+    When the server cannot be reached, a query the mirror can answer
+    falls back to it.
+
+    With amcr_viewer/profile_memory set, the memory of every stage is
+    profiled (see amcr_profiling).
+    """
+    profile = amcr_profiling.start(f"{typ_dat}, komponenty={komponenty}")
+
+    load_translations()
+
+    # --- 1. COORDINATE TRANSFORMATION ---
+    # Get current map extent and transform it
+    # from project CRS (usually S-JTSK) to WGS-84 for the API
+    bbox_str = bbox_param(canvas_extent_wgs(canvas))
+    query_bbox = bbox_str if bb == "true" else None
+
+    iface.messageBar().pushMessage(
+        "AMCR",
+        "Hledám záznamy...",
+        level=Qgis.MessageLevel.Info
+    )
+
+    try:
+        # ==========================================
+        # A) METADATA FETCHING (Fieldwork/Site)
+        # ==========================================
+
+        docs_pian = None
+        if offline == "true":
+            try:
+                docs, docs_pian = amcr_mirror.query(
+                    typ_dat, filters, query_bbox, MAX_LIMIT
+                )
+            except amcr_mirror.MirrorError as e:
+                iface.messageBar().pushMessage(
+                    "AMCR", str(e), level=Qgis.MessageLevel.Critical
+                )
+                return
+            network_error = False
+            limit_reached = len(docs) >= MAX_LIMIT
+        else:
+            # Restrict search to map window if requested
+            base_params = build_search_params(typ_dat, filters, query_bbox)
+            docs, network_error, limit_reached = fetch_records(base_params)
+        profile.stage("A) záznamy")
+
+        fallback = (
+            _mirror_fallback(typ_dat, filters, query_bbox)
+            if network_error and not docs else None
+        )
+        if fallback is not None:
+            docs, docs_pian = fallback
+            offline = "true"
+            network_error = False
+            limit_reached = len(docs) >= MAX_LIMIT
+            iface.messageBar().pushMessage(
+                "AMCR",
+                "Server je nedostupný – použito offline zrcadlo.",
+                level=Qgis.MessageLevel.Warning
+            )
+
+        if limit_reached:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                f"Limit {MAX_LIMIT} záznamů dosažen.",
+                level=Qgis.MessageLevel.Warning
+            )
+
+        if network_error and not docs:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                "Stahování selhalo: chyba sítě. "
+                "Zkontrolujte připojení k internetu.",
+                level=Qgis.MessageLevel.Critical
+            )
+            return
+
+        if not docs:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                "Žádné záznamy nenalezeny.",
+                level=Qgis.MessageLevel.Warning
+            )
+            return
+
+        # ==========================================
+        # B) ATTRIBUTE PARSING
+        # ==========================================
+        pian_lookup, actions_with_geom, target_pian_ids_count = (
+            parse_records(docs, typ_dat, filters, komponenty)
+        )
+        profile.stage("B) atributy")
+
+        if not pian_lookup:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                f"Nalezeno {len(docs)} záznamů, ale žádný nemá geometrii.",
+                level=Qgis.MessageLevel.Warning
+            )
+            return
+
+        # ==========================================
+        # C) GEOMETRY FETCHING (PIAN)
+        # ==========================================
+        iface.messageBar().pushMessage(
+            "AMCR",
+            f"Záznamů: {len(docs)} (z toho {actions_with_geom} s mapou). "
+            f"Stahuji {len(pian_lookup)} unikátních geometrií, "
+            f"vykresluji {target_pian_ids_count} geometrií...",
+            level=Qgis.MessageLevel.Info
+        )
+
+        if docs_pian is None:
+            docs_pian, pian_network_error = fetch_pians(pian_lookup, filters)
+            network_error = network_error or pian_network_error
+        profile.stage("C) geometrie")
+
+        # ==========================================
+        # D) LAYER CREATION (QGIS Memory Layers)
+        # ==========================================
+        # Lists to hold features before batch-adding to layers
+        feats = {n: [] for _, n in LAYER_GEOMETRIES}
+        for suffix, feat in iter_features(
+            docs_pian, pian_lookup, typ_dat, komponenty, filters
+        ):
+            feats[suffix].append(feat)
+        profile.stage("D) prvky")
+
+        # An incomplete result must not delete features from refreshed
+        # layers
+        complete = not (network_error or limit_reached)
+        result_layers, targets, added, diff = publish_features(
+            typ_dat, komponenty, feats, refresh, complete
+        )
+        profile.stage("D) vrstvy")
+        profile.render(
+            [result_layers[n] for n in ("Polygony", "Linie")
+             if n in result_layers],
+            [scale for _, _, scale in SIMPLIFY_LEVELS]
+        )
+
+        # Remember the query and the record fingerprints, so that a later
+        # sync downloads only what has changed (see sync_amcr_layers)
+        store_sync_state(result_layers.values(), filters, query_bbox, docs)
+
+        if offline != "true" and amcr_mirror.harvest_enabled():
+            amcr_mirror.store(typ_dat, docs, docs_pian)
 
         if network_error:
             iface.messageBar().pushMessage(
@@ -975,6 +2007,14 @@ def load_amcr_data(canvas, bb, filters=None,
                     else Qgis.MessageLevel.Critical
                 )
             )
+        elif targets:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                f"Vrstvy aktualizovány. Záznamů: {len(docs)}. "
+                f"Přidáno {diff[0]}, změněno {diff[1]}, "
+                f"odebráno {diff[2]} prvků.",
+                level=Qgis.MessageLevel.Success
+            )
         elif added > 0:
             iface.messageBar().pushMessage(
                 "AMCR",
@@ -996,6 +2036,426 @@ def load_amcr_data(canvas, bb, filters=None,
             level=Qgis.MessageLevel.Critical
         )
     finally:
-        # Always restore cursor and release the guard, even after failure
-        _LOADING = False
-        QApplication.restoreOverrideCursor()
+        profile.finish()
+
+
+def export_path(path, driver, suffix):
+    """
+    Returns the file written for one geometry type: the path with the
+    layer suffix (see EXPORT_FORMATS).
+    """
+    base, ext = os.path.splitext(path)
+    ext = ext or EXPORT_FORMATS[driver]
+    return f"{base}_{suffix}{ext}"
+
+
+def _open_writer(path, driver, typ_dat, komponenty, suffix):
+    """Creates the output file of one geometry type."""
+    fields = QgsFields()
+    for field in layer_fields(typ_dat, komponenty):
+        fields.append(field)
+
+    archeologicky_zaznam = "Akce" if typ_dat == "akce" else "Lokalita"
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = driver
+    options.fileEncoding = "UTF-8"
+    options.layerName = f"AMCR_{archeologicky_zaznam}_{suffix}"
+    options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteFile
+
+    target = export_path(path, driver, suffix)
+    writer = QgsVectorFileWriter.create(
+        target, fields, EXPORT_GEOMETRIES[suffix],
+        QgsCoordinateReferenceSystem("EPSG:5514"),
+        QgsProject.instance().transformContext(), options
+    )
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise OSError(
+            f"Soubor {target} nelze vytvořit: {writer.errorMessage()}"
+        )
+    return writer
+
+
+@_exclusive(busy_result=[])
+def export_amcr_data(canvas, bb, filters=None, typ_dat="akce",
+                     komponenty="false", path="", driver="GPKG"):
+    """
+    Downloads records like load_amcr_data, but writes the features
+    straight to files instead of memory layers.
+
+    Every batch of PIANs is turned into features and written as soon as
+    it arrives, so neither the geometries nor the features of the whole
+    result are held in memory – only the records' metadata
+    (pian_lookup) needed to build the features. A file is created only
+    for the geometry types that occur. Returns the list of written files.
+    """
+
+    load_translations()
+    bbox_str = bbox_param(canvas_extent_wgs(canvas))
+
+    iface.messageBar().pushMessage(
+        "AMCR",
+        "Hledám záznamy...",
+        level=Qgis.MessageLevel.Info
+    )
+
+    writers = {}
+    written = {}
+    failed = {}
+    try:
+        # A + B) Records and their attributes
+        base_params = build_search_params(
+            typ_dat, filters, bbox_str if bb == "true" else None
+        )
+        docs, network_error, limit_reached = fetch_records(base_params)
+        pian_lookup, actions_with_geom, target_pian_ids_count = (
+            parse_records(docs, typ_dat, filters, komponenty)
+        )
+        record_count = len(docs)
+        # The records are not needed any more – only their metadata
+        del docs
+
+        if not pian_lookup:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                "Stahování selhalo: chyba sítě. "
+                "Zkontrolujte připojení k internetu."
+                if network_error
+                else "Žádné záznamy s geometrií nenalezeny.",
+                level=(
+                    Qgis.MessageLevel.Critical if network_error
+                    else Qgis.MessageLevel.Warning
+                )
+            )
+            return []
+
+        iface.messageBar().pushMessage(
+            "AMCR",
+            f"Záznamů: {record_count} (z toho {actions_with_geom} s mapou). "
+            f"Exportuji {target_pian_ids_count} prvků...",
+            level=Qgis.MessageLevel.Info
+        )
+
+        # C + D) Geometries, written batch by batch
+        def write_batch(batch_docs):
+            for suffix, feat in iter_features(
+                batch_docs, pian_lookup, typ_dat, komponenty, filters,
+                levels=False
+            ):
+                writer = writers.get(suffix)
+                if writer is None:
+                    writer = _open_writer(
+                        path, driver, typ_dat, komponenty, suffix
+                    )
+                    writers[suffix] = writer
+                    written[suffix] = 0
+                    failed[suffix] = 0
+                geom = feat.geometry()
+                if not geom.isMultipart():
+                    geom.convertToMultiType()
+                    feat.setGeometry(geom)
+                if writer.addFeature(feat):
+                    written[suffix] += 1
+                    continue
+                failed[suffix] += 1
+                if failed[suffix] == 1:
+                    QgsMessageLog.logMessage(
+                        f"Prvek PIAN {feat.attributes()[0]} nelze zapsat "
+                        f"do {export_path(path, driver, suffix)}: "
+                        f"{writer.errorMessage()}",
+                        "AMČR", Qgis.MessageLevel.Warning
+                    )
+
+        _, pian_network_error = fetch_pians(
+            pian_lookup, filters, on_batch=write_batch
+        )
+        network_error = network_error or pian_network_error
+
+        files = sorted({
+            export_path(path, driver, suffix) for suffix in writers
+        })
+        total = sum(written.values())
+        not_written = sum(failed.values())
+        if not_written:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                f"{not_written} prvků se nepodařilo zapsat "
+                "(podrobnosti v protokolu).",
+                level=Qgis.MessageLevel.Warning
+            )
+        if limit_reached:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                f"Limit {MAX_LIMIT} záznamů dosažen.",
+                level=Qgis.MessageLevel.Warning
+            )
+        if network_error:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                "Export byl přerušen chybou sítě – "
+                f"soubory jsou neúplné (zapsáno {total} prvků).",
+                level=Qgis.MessageLevel.Warning
+            )
+        elif files:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                f"Hotovo. Zapsáno {total} prvků do: {', '.join(files)}",
+                level=(
+                    Qgis.MessageLevel.Warning if not_written
+                    else Qgis.MessageLevel.Success
+                )
+            )
+        else:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                "Žádná data k exportu.",
+                level=Qgis.MessageLevel.Info
+            )
+        return files
+
+    except Exception as e:
+        iface.messageBar().pushMessage(
+            "Chyba",
+            str(e),
+            level=Qgis.MessageLevel.Critical
+        )
+        return []
+    finally:
+        # Deleting the writers closes the files
+        for writer in writers.values():
+            writer.flushBuffer()
+        writers.clear()
+
+
+def _wait_pumping(futures):
+    """Waits for background work while keeping the GUI responsive."""
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, timeout=0.05)
+        QApplication.processEvents()
+
+
+def _fetch_entity(typ_dat, filters, bbox_str, komponenty, labels):
+    """Stages A and B of one entity; runs in a worker thread."""
+    base_params = build_search_params(typ_dat, filters, bbox_str)
+    docs, network_error, limit_reached = fetch_records(
+        base_params, pump_events=False
+    )
+    pian_lookup, actions_with_geom, _ = parse_records(
+        docs, typ_dat, filters, komponenty, labels
+    )
+    return docs, network_error, limit_reached, pian_lookup, actions_with_geom
+
+
+def load_combined_data(canvas, bb, filters=None, komponenty="false",
+                       refresh="false", offline="false"):
+    """
+    Downloads Fieldwork events and Sites of the same area in one run.
+
+    The records of both entities are fetched concurrently; their PIAN
+    IDs are then merged into one pool, so that a geometry used by both
+    an event and a site is downloaded and parsed only once. Each entity
+    gets its own set of layers, as with load_amcr_data.
+    Only the filters common to both entities apply.
+
+    As in load_amcr_data, an entity the server cannot deliver falls back
+    to the offline mirror, and the stages are profiled with
+    amcr_viewer/profile_memory set.
+    """
+    if offline == "true":
+        # The mirror answers locally – a shared PIAN pool saves nothing
+        for typ_dat in ENTITIES:
+            load_amcr_data(
+                canvas, bb, filters, typ_dat, komponenty, refresh, offline
+            )
+    else:
+        _load_combined(canvas, bb, filters, komponenty, refresh)
+
+
+@_exclusive()
+def _load_combined(canvas, bb, filters, komponenty, refresh):
+    """The online part of load_combined_data."""
+    profile = amcr_profiling.start(f"oboje, komponenty={komponenty}")
+
+    # Worker threads get a snapshot of the label index: the index itself
+    # may be dropped while the GUI is pumped (new translations arriving)
+    load_translations()
+    labels = label_index()
+
+    bbox_str = bbox_param(canvas_extent_wgs(canvas))
+    query_bbox = bbox_str if bb == "true" else None
+
+    iface.messageBar().pushMessage(
+        "AMCR",
+        "Hledám akce a lokality...",
+        level=Qgis.MessageLevel.Info
+    )
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(ENTITIES)) as pool:
+            # A + B) Records of both entities side by side
+            futures = {
+                typ_dat: pool.submit(
+                    _fetch_entity, typ_dat, filters, query_bbox, komponenty,
+                    labels
+                )
+                for typ_dat in ENTITIES
+            }
+            _wait_pumping(futures.values())
+            results = {t: f.result() for t, f in futures.items()}
+            profile.stage("A+B) záznamy a atributy")
+
+            # Entities the server could not deliver come from the mirror
+            # together with their PIANs
+            mirrored = {}
+            for typ_dat, (docs, network_error, _, _, _) in results.items():
+                fallback = (
+                    _mirror_fallback(typ_dat, filters, query_bbox)
+                    if network_error and not docs else None
+                )
+                if fallback is None:
+                    continue
+                docs, mirrored[typ_dat] = fallback
+                pian_lookup, actions_with_geom, _ = parse_records(
+                    docs, typ_dat, filters, komponenty, labels
+                )
+                results[typ_dat] = (
+                    docs, False, len(docs) >= MAX_LIMIT, pian_lookup,
+                    actions_with_geom
+                )
+            if mirrored:
+                iface.messageBar().pushMessage(
+                    "AMCR",
+                    "Server je nedostupný – použito offline zrcadlo "
+                    f"({', '.join(ENTITIES[t] for t in mirrored)}).",
+                    level=Qgis.MessageLevel.Warning
+                )
+
+            # C) One shared PIAN pool
+            fetched = [
+                r for t, r in results.items() if t not in mirrored
+            ]
+            pian_pool = {}
+            for _, _, _, pian_lookup, _ in fetched:
+                pian_pool.update(dict.fromkeys(pian_lookup))
+            shared = ""
+            if len(fetched) > 1:
+                n_shared = sum(
+                    1 for pid in pian_pool
+                    if all(pid in r[3] for r in fetched)
+                )
+                shared = (
+                    f" (z toho {n_shared} společných pro akce i lokality)"
+                )
+
+            if not (pian_pool or any(r[3] for r in results.values())):
+                network_error = any(r[1] for r in results.values())
+                iface.messageBar().pushMessage(
+                    "AMCR",
+                    "Stahování selhalo: chyba sítě. "
+                    "Zkontrolujte připojení k internetu."
+                    if network_error
+                    else "Žádné záznamy s geometrií nenalezeny.",
+                    level=(
+                        Qgis.MessageLevel.Critical if network_error
+                        else Qgis.MessageLevel.Warning
+                    )
+                )
+                return
+
+            docs_pian, pian_network_error = [], False
+            if pian_pool:
+                iface.messageBar().pushMessage(
+                    "AMCR",
+                    f"Stahuji {len(pian_pool)} unikátních geometrií"
+                    f"{shared}...",
+                    level=Qgis.MessageLevel.Info
+                )
+                future = pool.submit(fetch_pians, pian_pool, filters, False)
+                _wait_pumping([future])
+                docs_pian, pian_network_error = future.result()
+            profile.stage("C) geometrie")
+
+        # D) Features and layers, per entity; shared PIANs parsed once
+        parsed_pians = {}
+        added = 0
+        summary = []
+        any_network_error = pian_network_error
+        all_layers = []
+        for typ_dat, (docs, network_error, limit_reached, pian_lookup,
+                      actions_with_geom) in results.items():
+            any_network_error = any_network_error or network_error
+            if limit_reached:
+                iface.messageBar().pushMessage(
+                    "AMCR",
+                    f"Limit {MAX_LIMIT} záznamů dosažen "
+                    f"({ENTITIES[typ_dat]}).",
+                    level=Qgis.MessageLevel.Warning
+                )
+            if not pian_lookup:
+                summary.append(f"{ENTITIES[typ_dat]}: {len(docs)} záznamů")
+                continue
+
+            entity_pians = mirrored.get(typ_dat, docs_pian)
+            feats = {n: [] for _, n in LAYER_GEOMETRIES}
+            for suffix, feat in iter_features(
+                entity_pians, pian_lookup, typ_dat, komponenty, filters,
+                parsed_pians, labels=labels
+            ):
+                feats[suffix].append(feat)
+
+            complete = not (
+                network_error or limit_reached
+                or (pian_network_error and typ_dat not in mirrored)
+            )
+            result_layers, _, entity_added, _ = publish_features(
+                typ_dat, komponenty, feats, refresh, complete
+            )
+            profile.stage(f"D) {ENTITIES[typ_dat]}")
+            all_layers += [
+                result_layers[n] for n in ("Polygony", "Linie")
+                if n in result_layers
+            ]
+            store_sync_state(
+                result_layers.values(), filters, query_bbox, docs
+            )
+            if typ_dat not in mirrored and amcr_mirror.harvest_enabled():
+                amcr_mirror.store(typ_dat, docs, [
+                    doc for doc in docs_pian
+                    if doc.get('ident_cely') in pian_lookup
+                ])
+            added += entity_added
+            summary.append(
+                f"{ENTITIES[typ_dat]}: {len(docs)} záznamů "
+                f"(s geom: {actions_with_geom})"
+            )
+        profile.render(all_layers, [scale for _, _, scale in SIMPLIFY_LEVELS])
+
+        if any_network_error:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                "Stahování bylo přerušeno chybou sítě – "
+                f"výsledek je neúplný (vykresleno {added} prvků). "
+                "Zkontrolujte připojení a spusťte stahování znovu.",
+                level=(
+                    Qgis.MessageLevel.Warning
+                    if added > 0
+                    else Qgis.MessageLevel.Critical
+                )
+            )
+        else:
+            iface.messageBar().pushMessage(
+                "AMCR",
+                f"Hotovo. {', '.join(summary)}. "
+                f"Geometrií: {len(parsed_pians)}. "
+                f"Vykresleno: {added} prvků.",
+                level=Qgis.MessageLevel.Success
+            )
+
+    except Exception as e:
+        iface.messageBar().pushMessage(
+            "Chyba",
+            str(e),
+            level=Qgis.MessageLevel.Critical
+        )
+    finally:
+        profile.finish()
@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication, QUrl
 from qgis.PyQt.QtGui import QIcon, QDesktopServices
-from qgis.PyQt.QtWidgets import QMenu, QAction, QToolButton, QDialog
-from qgis.core import Qgis
+from qgis.PyQt.QtWidgets import (QMenu, QAction, QToolButton, QDialog,
+                                 QInputDialog, QFileDialog)
+from qgis.core import Qgis, QgsMessageLog
 
-from .amcr_tools import load_amcr_data, login_to_api
-from .amcr_dialog import AmcrFilterDialog, LoginDialog
 import os.path
+import time
+
+# The download engine (amcr_tools, requests) and the dialogs with their
+# codelists are imported on first use, not when QGIS loads the plugin –
+# see run_download() and login()
 
 
 class AmcrViewer:
@@ -21,6 +25,10 @@ class AmcrViewer:
         internationalization (i18n).
         """
         self.iface = iface
+        # Start of plugin loading; classFactory() overrides it with the
+        # moment before the plugin module was imported
+        self.load_started = time.perf_counter()
+        self.startup_ms = None
         self.plugin_dir = os.path.dirname(__file__)
 
         # Determine the user's locale to load appropriate translation files.
@@ -43,6 +51,7 @@ class AmcrViewer:
         self.actions = []
         self.menu = self.tr(u'&AMČR Viewer')
         self.first_start = None
+        self.live_loader = None
 
     def tr(self, message):
         """
@@ -119,6 +128,47 @@ class AmcrViewer:
         )
         self.plugin_menu.addAction(self.action_download_lokality)
 
+        self.action_download_oboje = self.add_action(
+            icon_path=icon_akce_path,
+            text=self.tr(u'Stáhnout akce i lokality | AMČR Viewer'),
+            callback=lambda checked=False: self.run_download('oboje'),
+            parent=self.iface.mainWindow(),
+            add_to_menu=False,
+            add_to_toolbar=False
+        )
+        self.plugin_menu.addAction(self.action_download_oboje)
+
+        self.action_sync = self.add_action(
+            icon_path=icon_akce_path,
+            text=self.tr(u'Synchronizovat vrstvy | AMČR Viewer'),
+            callback=lambda checked=False: self.sync_layers(),
+            parent=self.iface.mainWindow(),
+            add_to_menu=False,
+            add_to_toolbar=False
+        )
+        self.plugin_menu.addAction(self.action_sync)
+
+        self.action_export = self.add_action(
+            icon_path=icon_akce_path,
+            text=self.tr(u'Exportovat do souboru | AMČR Viewer'),
+            callback=lambda checked=False: self.run_export(),
+            parent=self.iface.mainWindow(),
+            add_to_menu=False,
+            add_to_toolbar=False
+        )
+        self.plugin_menu.addAction(self.action_export)
+
+        self.action_live = self.add_action(
+            icon_path=icon_akce_path,
+            text=self.tr(u'Průběžně načítat podle mapy | AMČR Viewer'),
+            callback=self.toggle_live,
+            parent=self.iface.mainWindow(),
+            add_to_menu=False,
+            add_to_toolbar=False
+        )
+        self.action_live.setCheckable(True)
+        self.plugin_menu.addAction(self.action_live)
+
         self.action_login_dialog = self.add_action(
             icon_path=icon_akce_path,
             text=self.tr(u'Přihlásit se | AMČR Viewer'),
@@ -164,6 +214,14 @@ class AmcrViewer:
 
         self.first_start = True
 
+        # Publish the startup cost (module import + GUI registration)
+        # so that regressions are visible in the log
+        self.startup_ms = (time.perf_counter() - self.load_started) * 1000
+        QgsMessageLog.logMessage(
+            f"Plugin načten za {self.startup_ms:.1f} ms.",
+            "AMČR", Qgis.MessageLevel.Info
+        )
+
     def unload(self):
         """
         Called when the plugin is disabled or removed.
@@ -187,12 +245,27 @@ class AmcrViewer:
         if hasattr(self, 'tool'):
             self.iface.mapCanvas().unsetMapTool(self.tool)
 
+        # 5. Stop following the map extent
+        if self.live_loader is not None:
+            self.live_loader.stop()
+            self.live_loader = None
+
     # --- Data downloading ---
     def run_download(self, typ_dat):
         """
         Triggered by menu/toolbar actions. Opens the filter dialog and
         hands off the parameters to the data loader.
         """
+        from .amcr_dialog import AmcrFilterDialog
+        from .amcr_session import prepare_session_async
+        from .amcr_tools import (load_amcr_data, load_combined_data,
+                                 refresh_translations_async)
+
+        # Get the translation dictionary and the login session ready
+        # while the user sets filters
+        refresh_translations_async()
+        prepare_session_async()
+
         # Open the specific filter dialog (Projects vs Sites)
         dlg = AmcrFilterDialog(typ_dat)
         result = dlg.exec()
@@ -203,19 +276,149 @@ class AmcrViewer:
             filters = dlg.get_filters()
             bbox = dlg.get_bbox()
             komponenty = dlg.get_komponenty()
+            refresh = dlg.get_refresh()
+            offline = dlg.get_offline()
 
             # Access the map canvas and start
             # the fetch/render process from amcr_tools
             canvas = self.iface.mapCanvas()
-            load_amcr_data(canvas, bbox, filters, typ_dat, komponenty)
+            if typ_dat == 'oboje':
+                # Both entities at once, sharing the PIAN downloads
+                load_combined_data(
+                    canvas, bbox, filters, komponenty, refresh, offline
+                )
+            else:
+                load_amcr_data(
+                    canvas, bbox, filters, typ_dat, komponenty, refresh,
+                    offline
+                )
+
+    def sync_layers(self):
+        """
+        Updates the AMČR layers in the project, downloading only the
+        records that changed since they were downloaded.
+        """
+        from .amcr_session import prepare_session_async
+        from .amcr_tools import sync_all_layers
+
+        prepare_session_async()
+        sync_all_layers()
+
+    def run_export(self):
+        """
+        Downloads records straight into files (FlatGeobuf, GeoPackage or
+        GeoParquet) without creating layers in the project.
+        """
+        from .amcr_dialog import AmcrFilterDialog
+        from .amcr_session import prepare_session_async
+        from .amcr_tools import export_amcr_data, refresh_translations_async
+
+        refresh_translations_async()
+        prepare_session_async()
+
+        entities = {"Akce": "akce", "Lokality": "lokalita"}
+        label, ok = QInputDialog.getItem(
+            self.iface.mainWindow(),
+            "AMČR Viewer",
+            "Exportovat:",
+            list(entities),
+            0,
+            False
+        )
+        if not ok:
+            return
+        typ_dat = entities[label]
+
+        dlg = AmcrFilterDialog(typ_dat, mode="export")
+        if dlg.exec() != QDialog.DialogCode.Accepted:
+            return
+
+        formats = {
+            "GeoPackage (*.gpkg)": "GPKG",
+            "FlatGeobuf (*.fgb)": "FlatGeobuf",
+            "GeoParquet (*.parquet)": "Parquet",
+        }
+        path, selected = QFileDialog.getSaveFileName(
+            self.iface.mainWindow(),
+            "Exportovat do souboru",
+            "",
+            ";;".join(formats)
+        )
+        if not path:
+            return
+
+        export_amcr_data(
+            self.iface.mapCanvas(),
+            dlg.get_bbox(),
+            dlg.get_filters(),
+            typ_dat,
+            dlg.get_komponenty(),
+            path,
+            formats.get(selected, "GPKG")
+        )
+
+    def toggle_live(self, checked):
+        """
+        Switches the browsing mode, in which the records of the visible
+        map extent are downloaded on demand as the user pans and zooms.
+        """
+        if self.live_loader is not None:
+            self.live_loader.stop()
+            self.live_loader = None
+        if not checked:
+            return
+
+        from .amcr_dialog import AmcrFilterDialog
+        from .amcr_live import LiveLoader
+        from .amcr_session import prepare_session_async
+        from .amcr_tools import refresh_translations_async
+
+        refresh_translations_async()
+        prepare_session_async()
+
+        entities = {"Akce": "akce", "Lokality": "lokalita"}
+        label, ok = QInputDialog.getItem(
+            self.iface.mainWindow(),
+            "AMČR Viewer",
+            "Průběžně načítat:",
+            list(entities),
+            0,
+            False
+        )
+        if not ok:
+            self.action_live.setChecked(False)
+            return
+        typ_dat = entities[label]
+
+        # The extent comes from the map
+        dlg = AmcrFilterDialog(typ_dat, mode="live")
+        if dlg.exec() != QDialog.DialogCode.Accepted:
+            self.action_live.setChecked(False)
+            return
+
+        self.live_loader = LiveLoader(
+            self.iface.mapCanvas(),
+            typ_dat,
+            dlg.get_filters(),
+            dlg.get_komponenty()
+        )
+        self.live_loader.start()
 
     def login(self):
+        from .amcr_dialog import LoginDialog
+        from .amcr_session import (login_to_api, forget_session,
+                                   remember_session)
+
         dlg = LoginDialog(parent=self.iface.mainWindow())
         result = dlg.exec()
         if result == QDialog.DialogCode.Accepted:
+            # The credentials may have changed – drop the old session
+            forget_session()
             username, password = LoginDialog.get_credentials()
             session = login_to_api(username, password)
             if session:
+                # Keep the session cookie for the next QGIS start
+                remember_session()
                 self.iface.messageBar().pushMessage(
                     "AMČR",
                     "Přihlášení proběhlo úspěšně.",